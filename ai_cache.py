@@ -1,203 +1,922 @@
 """
-Модуль для кэширования ответов ИИ в PostgreSQL
+Модуль для кэширования ответов ИИ
+Бэкенды: PostgreSQL (по умолчанию) и встроенный SQLite (WAL-режим)
+
+Выбор бэкенда - переменная окружения AI_CACHE_BACKEND:
+    postgres - PostgreSQL, при недоступности автоматически переключаемся на SQLite
+    sqlite   - только SQLite (один контейнер без PostgreSQL, тесты)
 """
 
-import psycopg2
+import atexit
 import json
 import hashlib
+import math
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import os
 
-class AICacheManager:
-    """Менеджер кэша для ответов ИИ"""
-    
+from config import Config
+from local_db import get_sqlite_connection
+from deadline import Deadline
+
+try:
+    import psycopg2
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    psycopg2 = None
+    PSYCOPG2_AVAILABLE = False
+
+
+class CacheBackendUnavailable(Exception):
+    """Бэкенд кэша недоступен (нет подключения к БД)"""
+
+
+# Счетчики статистики кэша (в таблице ai_response_cache_stats, по провайдеру и модели):
+# entries/bytes/confidence_sum/usage_total - по записям в таблице, hits/misses - обращения
+STATS_FIELDS = ('entries', 'bytes', 'confidence_sum', 'usage_total', 'hits', 'misses')
+
+
+def _record_size(record: Dict[str, Any]) -> int:
+    """Объем данных записи в байтах (текстовые поля в UTF-8)"""
+    return sum(
+        len((record.get(field) or '').encode('utf-8'))
+        for field in ('student_answer', 'correct_variants', 'question_context', 'explanation')
+    )
+
+
+class CacheBackend:
+    """Базовый интерфейс бэкенда кэша"""
+
+    name = 'base'
+
+    def get(self, cache_key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Вернуть действительную запись и увеличить счетчик использования.
+        timeout - сколько секунд можно ждать БД (остаток бюджета проверки)
+        """
+        raise NotImplementedError
+
+    def put(self, cache_key: str, record: Dict[str, Any], expires_at: datetime,
+            timeout: Optional[float] = None) -> Optional[Tuple]:
+        """
+        Вставить запись или заменить существующую (UPSERT): вердикт, провайдер
+        и срок жизни берутся из record - иначе после короткоживущего fallback
+        повторное сохранение настоящего вердикта продлило бы ошибку.
+
+        Returns:
+            None - запись новая, иначе прежние (provider, model, size_bytes,
+            confidence, usage_count) для пересчета статистики
+        """
+        raise NotImplementedError
+
+    def sweep_expired(self, batch_size: int, max_batches: Optional[int], pause: float) -> int:
+        """
+        Удалить устаревшие записи небольшими пакетами, вернуть количество удаленных.
+        Счетчики entries/bytes/... уменьшаются в той же транзакции.
+        """
+        raise NotImplementedError
+
+    def apply_stats_deltas(self, deltas: Dict[Tuple[str, str], List[float]]):
+        """Прибавить накопленные приращения к таблице статистики"""
+        raise NotImplementedError
+
+    def read_stats(self) -> List[Tuple]:
+        """Строки таблицы статистики: (provider, model, *STATS_FIELDS)"""
+        raise NotImplementedError
+
+    def rebuild_stats(self):
+        """Пересчитать entries/bytes/... полным проходом по таблице кэша"""
+        raise NotImplementedError
+
+
+class PostgresCacheBackend(CacheBackend):
+    """Кэш в PostgreSQL (таблица создается скриптом init_cache_db.py)"""
+
+    name = 'postgres'
+
+    # Ключ advisory-lock: очисткой занимается только один воркер
+    SWEEP_LOCK_ID = 0x41494341  # 'AICA'
+
+    STATS_UPSERT_SQL = """
+        INSERT INTO ai_response_cache_stats AS s
+            (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+            entries = s.entries + EXCLUDED.entries,
+            bytes = s.bytes + EXCLUDED.bytes,
+            confidence_sum = s.confidence_sum + EXCLUDED.confidence_sum,
+            usage_total = s.usage_total + EXCLUDED.usage_total,
+            hits = s.hits + EXCLUDED.hits,
+            misses = s.misses + EXCLUDED.misses
+    """
+
     def __init__(self):
+        # Таблица создана через init_cache_db.py --partitioned (секции по дням expires_at)
+        self.partitioned = os.getenv('AI_CACHE_PARTITIONED', '0').lower() in ('1', 'true', 'yes')
+        self.partition_days_ahead = int(os.getenv('AI_CACHE_PARTITION_DAYS_AHEAD', 3))
         self.db_config = {
             'host': os.getenv('POSTGRES_HOST', 'flask_db'),
             'database': os.getenv('POSTGRES_DB', 'flask_db'),
             'user': os.getenv('POSTGRES_USER', 'flask_user'),
             'password': os.getenv('POSTGRES_PASSWORD', 'flask_password123'),
-            'port': int(os.getenv('POSTGRES_PORT', 5432))
+            'port': int(os.getenv('POSTGRES_PORT', 5432)),
+            # Недоступный хост не должен подвешивать проверку ответа
+            'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT', 3))
         }
-        self.default_ttl = int(os.getenv('AI_CACHE_TTL', 3600))  # 1 час по умолчанию
-    
+        self._schema_ready = False
+
+    def _get_connection(self, timeout: Optional[float] = None):
+        """Получить подключение к БД (timeout ограничивает подключение и запросы)"""
+        if not PSYCOPG2_AVAILABLE:
+            raise CacheBackendUnavailable("psycopg2 не установлен")
+        db_config = self.db_config
+        if timeout is not None:
+            # connect_timeout - целые секунды, не меньше 1; запросы - через statement_timeout
+            db_config = dict(
+                db_config,
+                connect_timeout=max(1, min(db_config['connect_timeout'], math.ceil(timeout))),
+                options=f"-c statement_timeout={max(int(timeout * 1000), 1)}"
+            )
+        try:
+            conn = psycopg2.connect(**db_config)
+        except psycopg2.OperationalError as e:
+            raise CacheBackendUnavailable(str(e)) from e
+
+        if not self._schema_ready:
+            # Таблица статистики и колонка size_bytes для баз, созданных до их появления;
+            # на готовой базе - только чтение каталога, без DDL и блокировок
+            from init_cache_db import create_stats_table
+            self._schema_ready = create_stats_table(conn)
+        return conn
+
+    def get(self, cache_key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        conn = self._get_connection(timeout)
+        try:
+            cursor = conn.cursor()
+            # Чтение и счетчик использования - за одно подключение.
+            # В секционированной таблице cache_key не уникален - берем самую свежую запись
+            if self.partitioned:
+                cursor.execute("""
+                    UPDATE ai_response_cache
+                    SET usage_count = usage_count + 1
+                    WHERE (id, expires_at) = (
+                        SELECT id, expires_at FROM ai_response_cache
+                        WHERE cache_key = %s AND expires_at > NOW()
+                        ORDER BY expires_at DESC LIMIT 1
+                    )
+                    RETURNING is_correct, confidence, explanation, ai_provider
+                """, (cache_key,))
+            else:
+                cursor.execute("""
+                    UPDATE ai_response_cache
+                    SET usage_count = usage_count + 1
+                    WHERE cache_key = %s AND expires_at > NOW()
+                    RETURNING is_correct, confidence, explanation, ai_provider
+                """, (cache_key,))
+            result = cursor.fetchone()
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+        if result:
+            return {
+                'is_correct': result[0],
+                'confidence': result[1],
+                'explanation': result[2],
+                'ai_provider': result[3]
+            }
+        return None
+
+    def put(self, cache_key: str, record: Dict[str, Any], expires_at: datetime,
+            timeout: Optional[float] = None) -> Optional[Tuple]:
+        conn = self._get_connection(timeout)
+        values = (record['ai_provider'], record['ai_model'], record['is_correct'], record['confidence'],
+                  record['explanation'], record['size_bytes'], expires_at)
+        try:
+            cursor = conn.cursor()
+            # Замена записи с возвратом прежних значений (UPDATE ... RETURNING отдает только новые).
+            # Секционированная таблица: истекшая запись не заменяется - ее удалит DROP секции
+            cursor.execute(f"""
+                UPDATE ai_response_cache c
+                SET ai_provider = %s, ai_model = %s, is_correct = %s, confidence = %s,
+                    explanation = %s, size_bytes = %s, expires_at = %s,
+                    usage_count = c.usage_count + 1
+                FROM (
+                    SELECT id, expires_at, ai_provider, ai_model, size_bytes, confidence, usage_count
+                    FROM ai_response_cache
+                    WHERE cache_key = %s{' AND expires_at > NOW()' if self.partitioned else ''}
+                    LIMIT 1
+                    FOR UPDATE
+                ) old
+                WHERE c.id = old.id AND c.expires_at = old.expires_at
+                RETURNING old.ai_provider, old.ai_model, old.size_bytes, old.confidence, old.usage_count
+            """, (*values, cache_key))
+            previous = cursor.fetchone()
+            if previous is None:
+                insert_sql = """
+                    INSERT INTO ai_response_cache
+                    (cache_key, student_answer, correct_variants, question_context,
+                     ai_provider, ai_model, is_correct, confidence, explanation, expires_at, size_bytes)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """
+                if not self.partitioned:
+                    # Запись мог вставить другой воркер после UPDATE выше
+                    insert_sql += """
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        ai_provider = EXCLUDED.ai_provider,
+                        is_correct = EXCLUDED.is_correct,
+                        confidence = EXCLUDED.confidence,
+                        explanation = EXCLUDED.explanation,
+                        size_bytes = EXCLUDED.size_bytes,
+                        expires_at = EXCLUDED.expires_at,
+                        usage_count = ai_response_cache.usage_count + 1
+                    """
+                cursor.execute(insert_sql + " RETURNING (xmax = 0)", (
+                    cache_key,
+                    record['student_answer'],
+                    record['correct_variants'],
+                    record['question_context'],
+                    record['ai_provider'],
+                    record['ai_model'],
+                    record['is_correct'],
+                    record['confidence'],
+                    record['explanation'],
+                    expires_at,
+                    record['size_bytes']
+                ))
+                if not cursor.fetchone()[0]:
+                    # Гонка с другим воркером: прежние значения неизвестны,
+                    # считаем их равными новым (счетчики не сдвигаются)
+                    previous = (record['ai_provider'], record['ai_model'], record['size_bytes'],
+                                record['confidence'], 0)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return tuple(previous) if previous else None
+
+    def sweep_expired(self, batch_size: int, max_batches: Optional[int], pause: float) -> int:
+        conn = self._get_connection()
+        deleted_total = 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.SWEEP_LOCK_ID,))
+            if not cursor.fetchone()[0]:
+                # Очисткой уже занимается другой воркер
+                conn.rollback()
+                return 0
+
+            try:
+                if self.partitioned:
+                    # Целые истекшие секции удаляются через DROP, а не построчно
+                    from init_cache_db import ensure_future_partitions, drop_expired_partitions
+                    conn.commit()
+                    ensure_future_partitions(conn, self.partition_days_ahead)
+                    dropped = drop_expired_partitions(conn)
+                    if dropped:
+                        print(f"🧹 Удалено истекших секций кэша: {dropped}")
+
+                batches = 0
+                while max_batches is None or batches < max_batches:
+                    # Удаление пакета и вычитание его из статистики - одним запросом
+                    cursor.execute("""
+                        WITH expired AS (
+                            SELECT id, expires_at FROM ai_response_cache
+                            WHERE expires_at < NOW()
+                            LIMIT %s
+                        ), deleted AS (
+                            DELETE FROM ai_response_cache c USING expired e
+                            WHERE c.id = e.id AND c.expires_at = e.expires_at
+                            RETURNING c.ai_provider, c.ai_model, c.size_bytes, c.confidence, c.usage_count
+                        ), stats AS (
+                            INSERT INTO ai_response_cache_stats AS s
+                                (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses)
+                            SELECT ai_provider, ai_model, -COUNT(*), -SUM(size_bytes),
+                                   -SUM(confidence), -SUM(usage_count), 0, 0
+                            FROM deleted GROUP BY ai_provider, ai_model
+                            ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+                                entries = s.entries + EXCLUDED.entries,
+                                bytes = s.bytes + EXCLUDED.bytes,
+                                confidence_sum = s.confidence_sum + EXCLUDED.confidence_sum,
+                                usage_total = s.usage_total + EXCLUDED.usage_total
+                        )
+                        SELECT COUNT(*) FROM deleted
+                    """, (batch_size,))
+                    deleted = cursor.fetchone()[0]
+                    conn.commit()
+                    deleted_total += deleted
+                    batches += 1
+                    if deleted < batch_size:
+                        break
+                    time.sleep(pause)
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (self.SWEEP_LOCK_ID,))
+                conn.commit()
+                cursor.close()
+        finally:
+            conn.close()
+        return deleted_total
+
+    def apply_stats_deltas(self, deltas: Dict[Tuple[str, str], List[float]]):
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(self.STATS_UPSERT_SQL, [
+                (provider, model, *values) for (provider, model), values in deltas.items()
+            ])
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def read_stats(self) -> List[Tuple]:
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses
+                FROM ai_response_cache_stats
+            """)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        return rows
+
+    def rebuild_stats(self):
+        conn = self._get_connection()
+        try:
+            from init_cache_db import rebuild_stats_table
+            rebuild_stats_table(conn)
+        finally:
+            conn.close()
+
+    def listen(self, channel: str):
+        """Отдельное подключение с LISTEN channel (уведомления читает вызывающий)"""
+        conn = self._get_connection()
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {channel}")
+        cursor.close()
+        return conn
+
+    def notify(self, channel: str, payload: str, timeout: Optional[float] = None):
+        conn = self._get_connection(timeout)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Встроенный кэш в SQLite (WAL-режим, общий для воркеров одного узла)"""
+
+    name = 'sqlite'
+
+    STATS_UPSERT_SQL = """
+        INSERT INTO ai_response_cache_stats
+            (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+            entries = entries + excluded.entries,
+            bytes = bytes + excluded.bytes,
+            confidence_sum = confidence_sum + excluded.confidence_sum,
+            usage_total = usage_total + excluded.usage_total,
+            hits = hits + excluded.hits,
+            misses = misses + excluded.misses
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'AI_CACHE_SQLITE_PATH', os.path.join(Config.DATA_FOLDER, 'ai_cache.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
     def _get_connection(self):
-        """Получить подключение к БД"""
-        return psycopg2.connect(**self.db_config)
-    
-    def _generate_cache_key(self, student_answer: str, correct_variants: list, 
+        """Получить соединение текущего потока, при первом вызове создать схему"""
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _create_schema(self, conn):
+        """Создание таблиц кэша и статистики (аналог init_cache_db.py для SQLite)"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ai_response_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache_key TEXT UNIQUE NOT NULL,
+                student_answer TEXT NOT NULL,
+                correct_variants TEXT NOT NULL,
+                question_context TEXT,
+                ai_provider TEXT NOT NULL,
+                ai_model TEXT NOT NULL,
+                is_correct INTEGER NOT NULL,
+                confidence REAL NOT NULL,
+                explanation TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                usage_count INTEGER DEFAULT 1,
+                size_bytes INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(ai_response_cache)")}
+        if 'size_bytes' not in columns:
+            conn.execute("ALTER TABLE ai_response_cache ADD COLUMN size_bytes INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_expires_at ON ai_response_cache(expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_provider_model ON ai_response_cache(ai_provider, ai_model)")
+
+        stats_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ai_response_cache_stats'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ai_response_cache_stats (
+                ai_provider TEXT NOT NULL,
+                ai_model TEXT NOT NULL,
+                entries INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                confidence_sum REAL NOT NULL DEFAULT 0,
+                usage_total INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (ai_provider, ai_model)
+            )
+        """)
+        if not stats_exists:
+            self._rebuild_stats(conn)
+
+    @staticmethod
+    def _rebuild_stats(conn):
+        """Пересчет entries/bytes/... по всей таблице (hits/misses сохраняются)"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE ai_response_cache_stats SET entries = 0, bytes = 0, "
+                         "confidence_sum = 0, usage_total = 0")
+            conn.execute("""
+                INSERT INTO ai_response_cache_stats
+                    (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total)
+                SELECT ai_provider, ai_model, COUNT(*), SUM(size_bytes), SUM(confidence), SUM(usage_count)
+                FROM ai_response_cache WHERE true
+                GROUP BY ai_provider, ai_model
+                ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+                    entries = excluded.entries,
+                    bytes = excluded.bytes,
+                    confidence_sum = excluded.confidence_sum,
+                    usage_total = excluded.usage_total
+            """)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, cache_key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        # Локальная база: ожидание блокировки ограничено busy_timeout соединения
+        conn = self._get_connection()
+        now = time.time()
+        row = conn.execute("""
+            SELECT is_correct, confidence, explanation, ai_provider
+            FROM ai_response_cache
+            WHERE cache_key = ? AND expires_at > ?
+        """, (cache_key, now)).fetchone()
+
+        if not row:
+            return None
+
+        conn.execute(
+            "UPDATE ai_response_cache SET usage_count = usage_count + 1 WHERE cache_key = ?",
+            (cache_key,)
+        )
+        return {
+            'is_correct': bool(row[0]),
+            'confidence': row[1],
+            'explanation': row[2],
+            'ai_provider': row[3]
+        }
+
+    def put(self, cache_key: str, record: Dict[str, Any], expires_at: datetime,
+            timeout: Optional[float] = None) -> Optional[Tuple]:
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = conn.execute("""
+                SELECT ai_provider, ai_model, size_bytes, confidence, usage_count
+                FROM ai_response_cache WHERE cache_key = ?
+            """, (cache_key,)).fetchone()
+            if previous is None:
+                conn.execute("""
+                    INSERT INTO ai_response_cache
+                    (cache_key, student_answer, correct_variants, question_context,
+                     ai_provider, ai_model, is_correct, confidence, explanation, created_at, expires_at,
+                     size_bytes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    cache_key,
+                    record['student_answer'],
+                    record['correct_variants'],
+                    record['question_context'],
+                    record['ai_provider'],
+                    record['ai_model'],
+                    1 if record['is_correct'] else 0,
+                    record['confidence'],
+                    record['explanation'],
+                    time.time(),
+                    expires_at.timestamp(),
+                    record['size_bytes']
+                ))
+            else:
+                conn.execute("""
+                    UPDATE ai_response_cache
+                    SET ai_provider = ?, ai_model = ?, is_correct = ?, confidence = ?, explanation = ?,
+                        size_bytes = ?, expires_at = ?, usage_count = usage_count + 1
+                    WHERE cache_key = ?
+                """, (record['ai_provider'], record['ai_model'], 1 if record['is_correct'] else 0,
+                      record['confidence'], record['explanation'], record['size_bytes'],
+                      expires_at.timestamp(), cache_key))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return tuple(previous) if previous else None
+
+    def sweep_expired(self, batch_size: int, max_batches: Optional[int], pause: float) -> int:
+        conn = self._get_connection()
+        deleted_total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            # Короткие транзакции: писатели из других воркеров не ждут долго
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("""
+                    SELECT id, ai_provider, ai_model, size_bytes, confidence, usage_count
+                    FROM ai_response_cache WHERE expires_at < ? LIMIT ?
+                """, (time.time(), batch_size)).fetchall()
+
+                deltas = {}
+                for _, provider, model, size_bytes, confidence, usage_count in rows:
+                    values = deltas.setdefault((provider, model), [0] * len(STATS_FIELDS))
+                    values[0] -= 1
+                    values[1] -= size_bytes
+                    values[2] -= confidence
+                    values[3] -= usage_count
+
+                conn.executemany("DELETE FROM ai_response_cache WHERE id = ?", [(row[0],) for row in rows])
+                conn.executemany(self.STATS_UPSERT_SQL, [
+                    (provider, model, *values) for (provider, model), values in deltas.items()
+                ])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            deleted_total += len(rows)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+        return deleted_total
+
+    def apply_stats_deltas(self, deltas: Dict[Tuple[str, str], List[float]]):
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self.STATS_UPSERT_SQL, [
+                (provider, model, *values) for (provider, model), values in deltas.items()
+            ])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def read_stats(self) -> List[Tuple]:
+        conn = self._get_connection()
+        return conn.execute("""
+            SELECT ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses
+            FROM ai_response_cache_stats
+        """).fetchall()
+
+    def rebuild_stats(self):
+        self._rebuild_stats(self._get_connection())
+
+
+class AICacheManager:
+    """Менеджер кэша для ответов ИИ"""
+
+    def __init__(self):
+        self.default_ttl = int(os.getenv('AI_CACHE_TTL', 3600))  # 1 час по умолчанию
+        # Через сколько секунд снова пробовать PostgreSQL после сбоя
+        self.primary_retry_interval = int(os.getenv('AI_CACHE_PRIMARY_RETRY', 60))
+
+        backend_name = os.getenv('AI_CACHE_BACKEND', 'postgres').lower()
+        self.fallback_backend = SQLiteCacheBackend()
+        if backend_name == 'sqlite' or not PSYCOPG2_AVAILABLE:
+            self.primary_backend = self.fallback_backend
+        else:
+            self.primary_backend = PostgresCacheBackend()
+
+        self._primary_down_until = 0.0
+
+        # Фоновая очистка устаревших записей
+        self.sweep_interval = int(os.getenv('AI_CACHE_SWEEP_INTERVAL', 300))
+        self.sweep_batch_size = int(os.getenv('AI_CACHE_SWEEP_BATCH', 500))
+        self.sweep_max_batches = int(os.getenv('AI_CACHE_SWEEP_MAX_BATCHES', 200))
+        self.sweep_pause = float(os.getenv('AI_CACHE_SWEEP_PAUSE', 0.05))
+
+        # Приращения статистики копятся в памяти и периодически сбрасываются в БД:
+        # {имя бэкенда: {(provider, model): [entries, bytes, confidence_sum, usage_total, hits, misses]}}
+        self.stats_flush_interval = float(os.getenv('AI_CACHE_STATS_FLUSH', 5))
+        self._pending_stats = {}
+        self._stats_lock = threading.Lock()
+
+        self._maintenance_thread = None
+        self._maintenance_lock = threading.Lock()
+
+    @property
+    def backend(self) -> CacheBackend:
+        """Текущий активный бэкенд (SQLite, пока PostgreSQL недоступен)"""
+        if self.primary_backend is not self.fallback_backend and time.time() < self._primary_down_until:
+            return self.fallback_backend
+        return self.primary_backend
+
+    def _call(self, operation: str, *args) -> Tuple[CacheBackend, Any]:
+        """
+        Вызвать операцию бэкенда с автоматическим переключением на SQLite.
+        Возвращает (бэкенд, выполнивший операцию, результат).
+        """
+        backend = self.backend
+        try:
+            return backend, getattr(backend, operation)(*args)
+        except CacheBackendUnavailable as e:
+            if backend is self.fallback_backend:
+                raise
+            print(f"⚠️ PostgreSQL кэш недоступен, переключаемся на SQLite "
+                  f"на {self.primary_retry_interval} с: {e}")
+            self._primary_down_until = time.time() + self.primary_retry_interval
+            return self.fallback_backend, getattr(self.fallback_backend, operation)(*args)
+
+    def _count(self, backend: CacheBackend, provider: str, model: str, **deltas):
+        """Учесть приращения счетчиков статистики (без обращения к БД)"""
+        with self._stats_lock:
+            per_backend = self._pending_stats.setdefault(backend.name, {})
+            values = per_backend.setdefault((provider, model), [0] * len(STATS_FIELDS))
+            for field, delta in deltas.items():
+                values[STATS_FIELDS.index(field)] += delta
+
+    def flush_stats(self):
+        """Сбросить накопленные приращения статистики в таблицу ai_response_cache_stats"""
+        with self._stats_lock:
+            pending, self._pending_stats = self._pending_stats, {}
+
+        for backend in {self.primary_backend, self.fallback_backend}:
+            deltas = pending.get(backend.name)
+            if not deltas:
+                continue
+            try:
+                backend.apply_stats_deltas(deltas)
+            except Exception as e:
+                print(f"⚠️ Ошибка сохранения статистики кэша: {e}")
+                # Возвращаем приращения, чтобы не потерять их
+                with self._stats_lock:
+                    per_backend = self._pending_stats.setdefault(backend.name, {})
+                    for key, values in deltas.items():
+                        current = per_backend.setdefault(key, [0] * len(STATS_FIELDS))
+                        for i, value in enumerate(values):
+                            current[i] += value
+
+    def _generate_cache_key(self, student_answer: str, correct_variants: list,
                           question_context: str, ai_model: str) -> str:
-        """Генерация ключа кэша"""
-        data = f"{student_answer}_{json.dumps(correct_variants, sort_keys=True)}_{question_context}_{ai_model}"
+        """
+        Генерация ключа кэша. Ответ приводится к нижнему регистру без
+        пробелов по краям - локальная проверка тоже не различает "Кот" и "кот"
+        """
+        data = f"{student_answer.strip().lower()}_{json.dumps(correct_variants, sort_keys=True)}_{question_context}_{ai_model}"
         return hashlib.md5(data.encode('utf-8')).hexdigest()
-    
+
     def get_cached_result(self, student_answer: str, correct_variants: list,
-                         question_context: str, ai_model: str) -> Optional[Dict[str, Any]]:
+                         question_context: str, ai_model: str,
+                         deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
         """
         Получить закэшированный результат
-        
+
+        Args:
+            deadline: бюджет времени проверки - БД ждем не дольше его остатка
+
         Returns:
             Dict или None если не найдено в кэше
         """
+        if deadline and deadline.expired():
+            return None
         cache_key = self._generate_cache_key(student_answer, correct_variants, question_context, ai_model)
-        
+
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT is_correct, confidence, explanation, ai_provider
-                FROM ai_response_cache 
-                WHERE cache_key = %s AND expires_at > NOW()
-            """, (cache_key,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
+            backend, result = self._call('get', cache_key, deadline.remaining() if deadline else None)
             if result:
-                # Увеличиваем счетчик использования
-                self._increment_usage_count(cache_key)
-                return {
-                    'is_correct': result[0],
-                    'confidence': result[1],
-                    'explanation': result[2],
-                    'ai_provider': result[3]
-                }
-            
+                self._count(backend, result['ai_provider'], ai_model, hits=1, usage_total=1)
+            else:
+                # Промах еще не привязан к провайдеру
+                self._count(backend, '', ai_model, misses=1)
+            return result
         except Exception as e:
             print(f"⚠️ Ошибка при чтении из кэша: {e}")
-        
+
         return None
-    
-    def _increment_usage_count(self, cache_key: str):
-        """Увеличить счетчик использования записи"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE ai_response_cache 
-                SET usage_count = usage_count + 1 
-                WHERE cache_key = %s
-            """, (cache_key,))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-        except Exception as e:
-            print(f"⚠️ Ошибка при обновлении счетчика: {e}")
-    
+
     def save_to_cache(self, student_answer: str, correct_variants: list,
                      question_context: str, ai_provider: str, ai_model: str,
                      is_correct: bool, confidence: float, explanation: str,
-                     ttl: Optional[int] = None) -> bool:
+                     ttl: Optional[int] = None, deadline: Optional[Deadline] = None) -> bool:
         """
         Сохранить результат в кэш
-        
+
         Args:
             ttl: время жизни в секундах (по умолчанию 1 час)
+            deadline: бюджет времени проверки; оплаченный ответ AI сохраняется
+                даже при исчерпанном бюджете, но ждем БД не дольше секунды
         """
         if ttl is None:
             ttl = self.default_ttl
-            
+
         cache_key = self._generate_cache_key(student_answer, correct_variants, question_context, ai_model)
         expires_at = datetime.now() + timedelta(seconds=ttl)
-        
+        record = {
+            'student_answer': student_answer,
+            'correct_variants': json.dumps(correct_variants, ensure_ascii=False),
+            'question_context': question_context,
+            'ai_provider': ai_provider,
+            'ai_model': ai_model,
+            'is_correct': is_correct,
+            'confidence': confidence,
+            'explanation': explanation
+        }
+        record['size_bytes'] = _record_size(record)
+
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            # Используем UPSERT (обновляем если существует)
-            cursor.execute("""
-                INSERT INTO ai_response_cache 
-                (cache_key, student_answer, correct_variants, question_context, 
-                 ai_provider, ai_model, is_correct, confidence, explanation, expires_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (cache_key) 
-                DO UPDATE SET 
-                    usage_count = ai_response_cache.usage_count + 1,
-                    expires_at = EXCLUDED.expires_at
-            """, (
-                cache_key,
-                student_answer,
-                json.dumps(correct_variants, ensure_ascii=False),
-                question_context,
-                ai_provider,
-                ai_model,
-                is_correct,
-                confidence,
-                explanation,
-                expires_at
-            ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            timeout = max(deadline.remaining(), 1.0) if deadline else None
+            backend, previous = self._call('put', cache_key, record, expires_at, timeout)
+            usage = 1
+            if previous is not None:
+                # Запись заменена: ее прежний вклад вычитается (провайдер мог смениться)
+                old_provider, old_model, old_size, old_confidence, usage = previous
+                self._count(backend, old_provider, old_model, entries=-1, bytes=-(old_size or 0),
+                            confidence_sum=-(old_confidence or 0), usage_total=-usage)
+                usage += 1
+            self._count(backend, ai_provider, ai_model, entries=1, bytes=record['size_bytes'],
+                        confidence_sum=confidence, usage_total=usage)
             return True
-            
         except Exception as e:
             print(f"⚠️ Ошибка при сохранении в кэш: {e}")
             return False
-    
+
     def clear_expired_entries(self) -> int:
         """Очистить устаревшие записи и вернуть количество удаленных"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("DELETE FROM ai_response_cache WHERE expires_at < NOW()")
-            deleted_count = cursor.rowcount
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return deleted_count
-            
+            # Без ограничения числа пакетов, но без одного большого DELETE
+            return self._call('sweep_expired', self.sweep_batch_size, None, 0)[1]
         except Exception as e:
             print(f"⚠️ Ошибка при очистке кэша: {e}")
             return 0
-    
+
+    def sweep_expired(self) -> int:
+        """Один проход фоновой очистки (ограничен sweep_max_batches пакетами)"""
+        try:
+            return self._call('sweep_expired', self.sweep_batch_size,
+                              self.sweep_max_batches, self.sweep_pause)[1]
+        except Exception as e:
+            print(f"⚠️ Ошибка фоновой очистки кэша: {e}")
+            return 0
+
+    @property
+    def notifications_available(self) -> bool:
+        """Работает ли кэш на PostgreSQL (LISTEN/NOTIFY между воркерами)"""
+        return isinstance(self.primary_backend, PostgresCacheBackend)
+
+    def listen(self, channel: str):
+        """Подключение PostgreSQL, подписанное на channel, или None"""
+        if not self.notifications_available:
+            return None
+        try:
+            return self.primary_backend.listen(channel)
+        except Exception as e:
+            print(f"⚠️ LISTEN {channel} недоступен: {e}")
+            return None
+
+    def notify(self, channel: str, payload: str = '') -> bool:
+        """Уведомить все подписанные на channel процессы"""
+        if not self.notifications_available:
+            return False
+        try:
+            self.primary_backend.notify(channel, payload, timeout=3)
+            return True
+        except Exception as e:
+            print(f"⚠️ NOTIFY {channel} не отправлен: {e}")
+            return False
+
+    def rebuild_stats(self) -> bool:
+        """Пересчитать статистику полным проходом (если счетчики разошлись с таблицей)"""
+        self.flush_stats()
+        try:
+            self._call('rebuild_stats')
+            return True
+        except Exception as e:
+            print(f"⚠️ Ошибка пересчета статистики кэша: {e}")
+            return False
+
+    def start_maintenance(self) -> bool:
+        """
+        Запустить фоновый поток обслуживания кэша (один на процесс):
+        сброс статистики каждые AI_CACHE_STATS_FLUSH секунд и
+        очистка устаревших записей каждые AI_CACHE_SWEEP_INTERVAL секунд
+        (0 - очистка отключена).
+        """
+        with self._maintenance_lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return True
+
+            def _run():
+                next_sweep = time.time() + self.sweep_interval
+                while True:
+                    time.sleep(self.stats_flush_interval)
+                    self.flush_stats()
+                    if self.sweep_interval > 0 and time.time() >= next_sweep:
+                        deleted = self.sweep_expired()
+                        if deleted:
+                            print(f"🧹 Фоновая очистка кэша: удалено {deleted} записей")
+                        next_sweep = time.time() + self.sweep_interval
+
+            self._maintenance_thread = threading.Thread(target=_run, name='ai-cache-maintenance', daemon=True)
+            self._maintenance_thread.start()
+            atexit.register(self.flush_stats)
+            return True
+
     def get_cache_stats(self) -> Dict[str, Any]:
-        """Получить статистику кэша"""
+        """
+        Получить статистику кэша.
+        Читается из таблицы счетчиков (несколько строк), а не полным проходом по кэшу.
+        Записи, истекшие после последней фоновой очистки, еще учитываются как действительные.
+        """
+        backend = self.backend
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_entries,
-                    COUNT(CASE WHEN expires_at > NOW() THEN 1 END) as valid_entries,
-                    SUM(usage_count) as total_usage,
-                    AVG(confidence) as avg_confidence,
-                    COUNT(DISTINCT ai_provider) as providers_count
-                FROM ai_response_cache
-            """)
-            
-            stats = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'total_entries': stats[0] or 0,
-                'valid_entries': stats[1] or 0,
-                'total_usage': stats[2] or 0,
-                'avg_confidence': float(stats[3] or 0),
-                'providers_count': stats[4] or 0
-            }
-            
+            _, rows = self._call('read_stats')
         except Exception as e:
             print(f"⚠️ Ошибка при получении статистики: {e}")
-            return {
-                'total_entries': 0,
-                'valid_entries': 0,
-                'total_usage': 0,
-                'avg_confidence': 0,
-                'providers_count': 0
-            }
+            rows = []
+
+        totals = {}
+        with self._stats_lock:
+            for (provider, model), values in self._pending_stats.get(backend.name, {}).items():
+                totals[(provider, model)] = list(values)
+        for provider, model, *values in rows:
+            current = totals.setdefault((provider, model), [0] * len(STATS_FIELDS))
+            for i, value in enumerate(values):
+                current[i] += value or 0
+
+        summary = dict.fromkeys(STATS_FIELDS, 0)
+        per_model = {}
+        providers = set()
+        for (provider, model), values in totals.items():
+            model_stats = per_model.setdefault(model, dict.fromkeys(STATS_FIELDS, 0))
+            for field, value in zip(STATS_FIELDS, values):
+                summary[field] += value
+                model_stats[field] += value
+            if provider and values[0] > 0:
+                providers.add(provider)
+
+        def _hit_ratio(stats):
+            lookups = stats['hits'] + stats['misses']
+            return round(stats['hits'] / lookups, 4) if lookups else 0
+
+        entries = max(int(summary['entries']), 0)
+        return {
+            'total_entries': entries,
+            'valid_entries': entries,
+            'total_usage': int(summary['usage_total']),
+            'avg_confidence': round(float(summary['confidence_sum'] / entries), 4) if entries else 0,
+            'providers_count': len(providers),
+            'hits': int(summary['hits']),
+            'misses': int(summary['misses']),
+            'hit_ratio': _hit_ratio(summary),
+            'bytes_stored': max(int(summary['bytes']), 0),
+            'per_model': {
+                model: {
+                    'entries': max(int(stats['entries']), 0),
+                    'bytes': max(int(stats['bytes']), 0),
+                    'hits': int(stats['hits']),
+                    'misses': int(stats['misses']),
+                    'hit_ratio': _hit_ratio(stats)
+                }
+                for model, stats in per_model.items()
+            },
+            'backend': backend.name
+        }
 
 
 # Глобальный экземпляр менеджера кэша
-cache_manager = AICacheManager()
\ No newline at end of file
+cache_manager = AICacheManager()
@@ -4,12 +4,21 @@
 ИСПРАВЛЕНА КОДИРОВКА UTF-8
 """
 
+import contextvars
+import copy
 import os
 import json
-from typing import List, Dict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Optional, Tuple
 import requests
 from dataclasses import dataclass
 
+from circuit_breaker import circuit_breaker
+from deadline import Deadline, request_timeout
+from provider_health import provider_health
+
 # Импортируем менеджер кэша
 try:
     from ai_cache import cache_manager
@@ -26,35 +35,120 @@ class AICheckResult:
     explanation: str
     ai_provider: str
     from_cache: bool = False  # Новое поле: из кэша или нет
+    # Уровни каскада моделей: [{"provider", "model", "is_correct", "confidence", "accepted"}]
+    cascade: Optional[List[Dict]] = None
+    # Токены запроса: {"prompt_tokens", "output_tokens", "cached_tokens"}
+    usage: Optional[Dict] = None
+
+
+# Постоянная часть промпта Gemini - в systemInstruction; в самом запросе
+# остаются только контекст, варианты и ответ ученика
+GEMINI_INSTRUCTIONS = (
+    "Ты проверяешь ответы учеников. Реши, засчитать ли ответ ученика, сравнив его "
+    "с правильными ответами. Учитывай синонимы, опечатки и падежи, будь лоялен, "
+    "если суть верна; отвергай только явно неверный по смыслу ответ. "
+    "confidence - уверенность от 0 до 100, explanation - одна короткая фраза."
+)
+GEMINI_JSON_FORMAT = (
+    "Верни ТОЛЬКО JSON без другого текста: "
+    '{"is_correct": true, "confidence": 95, "explanation": "краткое пояснение"}'
+)
+
+# systemInstruction не зависит от модели и настроек: для structured output
+# формат задает responseSchema, иначе формат дописывается к инструкциям
+GEMINI_SYSTEM_INSTRUCTIONS = {
+    True: {"parts": [{"text": GEMINI_INSTRUCTIONS}]},
+    False: {"parts": [{"text": f"{GEMINI_INSTRUCTIONS}\n{GEMINI_JSON_FORMAT}"}]},
+}
+
+
+# Схема ответа Gemini в режиме structured output (responseSchema)
+GEMINI_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "is_correct": {"type": "BOOLEAN"},
+        "confidence": {"type": "INTEGER"},
+        "explanation": {"type": "STRING"}
+    },
+    "required": ["is_correct", "confidence", "explanation"],
+    "propertyOrdering": ["is_correct", "confidence", "explanation"]
+}
+
+
+# Потоки для hedged-запросов: в них идет только запасной провайдер,
+# основной запрос выполняется в потоке проверки (очередь пула не считается его задержкой)
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ai-hedge')
+
+# Одновременных запросов одного проверщика (и соединений в его HTTP сессии)
+MAX_CONCURRENT_REQUESTS = 10
 
 
 class AIAnswerChecker:
     """Класс для проверки ответов студентов с помощью ИИ с кэшированием"""
     
-    def __init__(self, provider: str = "gemini", api_key: Optional[str] = None):
+    # Модели провайдеров, кроме Gemini (модель Gemini берется из AIConfig)
+    PROVIDER_MODELS = {
+        "groq": "llama-3.1-8b-instant",
+        "huggingface": "facebook/bart-large-mnli",
+        "cohere": "command-light"
+    }
+    
+    # Переменные окружения с API ключами провайдеров
+    PROVIDER_ENV_VARS = {
+        "groq": "GROQ_API_KEY",
+        "gemini": "GOOGLE_API_KEY",
+        "huggingface": "HUGGINGFACE_API_KEY",
+        "cohere": "COHERE_API_KEY"
+    }
+    
+    def __init__(self, provider: str = "gemini", api_key: Optional[str] = None,
+                 fallback_providers: Optional[List["AIAnswerChecker"]] = None,
+                 cascade_checkers: Optional[List["AIAnswerChecker"]] = None,
+                 model: Optional[str] = None):
         """
         Инициализация проверщика с кэшированием
         
         Args:
             provider: "groq", "gemini", "huggingface", или "cohere"
             api_key: API ключ (если None, берется из переменных окружения)
+            fallback_providers: запасные проверщики - цепочка провайдеров,
+                упорядоченная по здоровью (см. _ordered_chain)
+            cascade_checkers: проверщики провайдеров, которые есть только
+                в каскаде моделей AIConfig.MODEL_CASCADE
+            model: модель по умолчанию (если None - из AIConfig или PROVIDER_MODELS)
         """
         self.provider = provider.lower()
         self.api_key = api_key if api_key else self._get_api_key_from_env()
+        self.model = model
+        self.fallback_providers = fallback_providers or []
+        self.cascade_checkers = cascade_checkers or []
         
         if not self.api_key:
             raise ValueError(f"API ключ для {provider} не найден. "
                            f"Установите переменную окружения {self._get_env_var_name()} или передайте его напрямую.")
+        
+        # Своя HTTP сессия: соединения с провайдером (TLS) переиспользуются между запросами
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS)
+        self.session.mount('https://', adapter)
+        self._limiter = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+    
+    def with_chain(self, fallback_providers: List["AIAnswerChecker"],
+                   cascade_checkers: List["AIAnswerChecker"]) -> "AIAnswerChecker":
+        """Проверщик с цепочкой и каскадом; сессия и ограничитель - общие с этим"""
+        chained = copy.copy(self)
+        chained.fallback_providers = list(fallback_providers)
+        chained.cascade_checkers = list(cascade_checkers)
+        return chained
+    
+    @classmethod
+    def env_api_key(cls, provider: str) -> Optional[str]:
+        """API ключ провайдера из переменной окружения"""
+        return os.getenv(cls.PROVIDER_ENV_VARS.get(provider.lower(), "AI_API_KEY"))
     
     def _get_env_var_name(self) -> str:
         """Получить имя переменной окружения для API ключа"""
-        env_vars = {
-            "groq": "GROQ_API_KEY",
-            "gemini": "GOOGLE_API_KEY",
-            "huggingface": "HUGGINGFACE_API_KEY",
-            "cohere": "COHERE_API_KEY"
-        }
-        return env_vars.get(self.provider, "AI_API_KEY")
+        return self.PROVIDER_ENV_VARS.get(self.provider, "AI_API_KEY")
     
     def _get_api_key_from_env(self) -> Optional[str]:
         """Получить API ключ из переменных окружения"""
@@ -65,7 +159,9 @@ class AIAnswerChecker:
                      correct_variants: List[str],
                      question_context: str = "",
                      system_prompt: Optional[str] = None,
-                     model_name: Optional[str] = None) -> AICheckResult:
+                     model_name: Optional[str] = None,
+                     deadline: Optional[Deadline] = None,
+                     cache_ttl: Optional[int] = None) -> AICheckResult:
         """
         Проверить ответ студента с помощью ИИ с использованием кэша
         
@@ -75,22 +171,28 @@ class AIAnswerChecker:
             question_context: Контекст вопроса (опционально)
             system_prompt: Кастомный системный промпт (опционально)
             model_name: Имя модели для использования (опционально)
+            deadline: Бюджет времени работы ученика - таймауты кэша и запросов
+                не выходят за его остаток (опционально)
+            cache_ttl: Время жизни уверенного вердикта в кэше вместо
+                CACHE_DURATION (предварительная проверка, опционально)
         
         Returns:
             AICheckResult с результатом проверки (может быть из кэша)
         """
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
         # Используем модель из конфига если не указана
-        model_to_use = model_name or AIConfig.GEMINI_MODEL
+        model_to_use = model_name or settings.GEMINI_MODEL
         
         # 1. ПРОВЕРКА КЭША (если доступен и включен)
-        if CACHE_AVAILABLE and AIConfig.CACHE_AI_RESPONSES:
+        if CACHE_AVAILABLE and settings.CACHE_AI_RESPONSES:
             cached_result = cache_manager.get_cached_result(
                 student_answer=student_answer,
                 correct_variants=correct_variants,
                 question_context=question_context,
-                ai_model=model_to_use
+                ai_model=model_to_use,
+                deadline=deadline
             )
             
             if cached_result:
@@ -103,38 +205,321 @@ class AIAnswerChecker:
                     from_cache=True
                 )
         
-        # 2. ВЫЗОВ ИИ (если не найдено в кэше)
-        if self.provider == "groq":
-            result = self._check_with_groq(student_answer, correct_variants, question_context, system_prompt)
-        elif self.provider == "gemini":
-            result = self._check_with_gemini(student_answer, correct_variants, question_context, system_prompt, model_to_use)
-        elif self.provider == "huggingface":
-            result = self._check_with_huggingface(student_answer, correct_variants, question_context)
-        elif self.provider == "cohere":
-            result = self._check_with_cohere(student_answer, correct_variants, question_context, system_prompt)
-        else:
-            raise ValueError(f"Неподдерживаемый провайдер: {self.provider}")
+        # 2. ВЫЗОВ ИИ: сначала дешевые модели каскада, затем цепочка провайдеров
+        result, cascade = self._check_with_cascade(
+            student_answer, correct_variants, question_context, system_prompt, deadline, cache_ttl
+        )
+        attempted = result is not None
+        if result is None:
+            result, attempted = self._check_with_chain(
+                student_answer, correct_variants, question_context, system_prompt, model_to_use, deadline
+            )
+            if cascade:
+                cascade.append(self._cascade_entry(result, self.provider, model_to_use, attempted, True))
+        if cascade:
+            result.cascade = cascade
+        if not attempted:
+            # Все провайдеры отключены circuit breaker - запроса не было, кэшировать нечего
+            return result
+        
+        # 3. СОХРАНЕНИЕ В КЭШ (если кэш доступен и результат допущен политикой)
+        self._save_result(student_answer, correct_variants, question_context, result, model_to_use, deadline,
+                          cache_ttl)
+        
+        return result
+    
+    def _save_result(self, student_answer: str, correct_variants: List[str],
+                     question_context: str, result: AICheckResult, model_name: str,
+                     deadline: Optional[Deadline] = None, cache_ttl: Optional[int] = None):
+        """Сохранить результат в кэш под ключом модели (время жизни - по политике допуска)"""
+        from ai_config import AIConfig
+        settings = AIConfig.current()
         
-        # 3. СОХРАНЕНИЕ В КЭШ (если успешно и кэш доступен)
-        if CACHE_AVAILABLE and AIConfig.CACHE_AI_RESPONSES and not result.from_cache:
+        cache_ttl = self._cache_ttl_for(result, cache_ttl)
+        if CACHE_AVAILABLE and settings.CACHE_AI_RESPONSES and not result.from_cache and cache_ttl > 0:
             cache_saved = cache_manager.save_to_cache(
                 student_answer=student_answer,
                 correct_variants=correct_variants,
                 question_context=question_context,
                 ai_provider=result.ai_provider,
-                ai_model=model_to_use,
+                ai_model=model_name,
                 is_correct=result.is_correct,
                 confidence=result.confidence,
                 explanation=result.explanation,
-                ttl=AIConfig.CACHE_DURATION
+                ttl=cache_ttl,
+                deadline=deadline
             )
             
             if cache_saved:
-                print(f"💾 Ответ сохранен в кэш: '{student_answer}'")
+                print(f"💾 Ответ сохранен в кэш на {cache_ttl} с: '{student_answer}'")
             else:
                 print(f"⚠️ Не удалось сохранить в кэш: '{student_answer}'")
+    
+    @staticmethod
+    def _cascade_entry(result: AICheckResult, provider: str, model: str,
+                       attempted: bool, accepted: bool) -> Dict:
+        return {
+            'provider': provider,
+            'model': model,
+            'is_correct': result.is_correct,
+            'confidence': result.confidence,
+            'success': attempted and result.ai_provider != 'fallback',
+            'accepted': accepted
+        }
+    
+    def _check_with_cascade(self, student_answer: str, correct_variants: List[str],
+                            question_context: str, system_prompt: Optional[str],
+                            deadline: Optional[Deadline] = None, cache_ttl: Optional[int] = None
+                            ) -> Tuple[Optional[AICheckResult], List[Dict]]:
+        """
+        Каскад моделей AIConfig.MODEL_CASCADE: вердикт уровня принимается, если
+        уверенность не ниже его min_confidence, иначе вопрос уходит выше.
         
-        return result
+        Returns:
+            (принятый результат или None - нужен основной уровень, список уровней)
+        """
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+        
+        cascade = []
+        for level in settings.MODEL_CASCADE or []:
+            checker = self._checker_for(level.get('provider', ''))
+            if checker is None:
+                continue
+            
+            level_model = checker._model_for(level.get('model'))
+            result, attempted = checker._call_provider(
+                student_answer, correct_variants, question_context, system_prompt, level_model, deadline
+            )
+            success = attempted and result.ai_provider != 'fallback'
+            accepted = success and result.confidence >= float(
+                level.get('min_confidence', settings.CASCADE_MIN_CONFIDENCE)
+            )
+            cascade.append(self._cascade_entry(result, checker.provider, level_model, attempted, accepted))
+            
+            if success:
+                # Вердикт уровня - в кэш под его моделью: статистика для настройки порогов
+                self._save_result(student_answer, correct_variants, question_context, result, level_model,
+                                  deadline, cache_ttl)
+            if accepted:
+                return result, cascade
+            if success:
+                print(f"🪜 {checker.provider}/{level_model}: уверенность {result.confidence:.2f}, "
+                      f"вопрос передан следующему уровню")
+        
+        return None, cascade
+    
+    def _checker_for(self, provider: str) -> Optional["AIAnswerChecker"]:
+        """Проверщик провайдера из цепочки или каскада"""
+        for checker in [self] + self.fallback_providers + self.cascade_checkers:
+            if checker.provider == provider.lower():
+                return checker
+        return None
+    
+    def _call_provider(self, student_answer: str, correct_variants: List[str],
+                       question_context: str, system_prompt: Optional[str],
+                       model_name: Optional[str] = None,
+                       deadline: Optional[Deadline] = None) -> Tuple[AICheckResult, bool]:
+        """
+        Один запрос к провайдеру этого проверщика.
+        
+        Returns:
+            (результат, был ли запрос) - при открытом circuit breaker
+            или исчерпанном бюджете времени запроса нет
+        """
+        model = self._model_for(model_name)
+        if deadline and deadline.expired():
+            return self._fallback_check(
+                student_answer, correct_variants, error_message="Истек лимит времени проверки"
+            ), False
+        if not circuit_breaker.allow_request(self.provider, model):
+            return self._fallback_check(
+                student_answer, correct_variants,
+                error_message=f"{self.provider} временно недоступен (circuit breaker)"
+            ), False
+        
+        if not self._limiter.acquire(timeout=request_timeout(deadline, 15)):
+            return self._fallback_check(
+                student_answer, correct_variants,
+                error_message=f"{self.provider}: слишком много одновременных запросов"
+            ), False
+        
+        started = time.monotonic()
+        try:
+            if self.provider == "groq":
+                result = self._check_with_groq(student_answer, correct_variants, question_context, system_prompt, model, deadline)
+            elif self.provider == "gemini":
+                result = self._check_with_gemini(student_answer, correct_variants, question_context, system_prompt, model, deadline)
+            elif self.provider == "huggingface":
+                result = self._check_with_huggingface(student_answer, correct_variants, question_context, model, deadline)
+            elif self.provider == "cohere":
+                result = self._check_with_cohere(student_answer, correct_variants, question_context, system_prompt, model, deadline)
+            else:
+                raise ValueError(f"Неподдерживаемый провайдер: {self.provider}")
+        finally:
+            self._limiter.release()
+        
+        # Провайдеры возвращают fallback при любой ошибке запроса
+        success = result.ai_provider != 'fallback'
+        if not success and deadline and deadline.expired():
+            # Таймаут из-за остатка бюджета - не сбой провайдера, и кэшировать нечего
+            return result, False
+        provider_health.record(self.provider, model, success, time.monotonic() - started)
+        if result.usage:
+            provider_health.record_usage(self.provider, model, result.usage)
+        if success:
+            circuit_breaker.record_success(self.provider, model)
+        else:
+            circuit_breaker.record_failure(self.provider, model, result.explanation)
+        return result, True
+    
+    def _chain_model(self, checker: "AIAnswerChecker", model_name: str) -> str:
+        """Запрошенная модель относится к провайдеру основного проверщика, остальные - со своей"""
+        return checker._model_for(model_name if checker.provider == self.provider else None)
+    
+    def _ordered_chain(self, model_name: str) -> List["AIAnswerChecker"]:
+        """
+        Провайдеры в порядке настройки. В конец цепочки уходят провайдеры
+        с открытым circuit breaker, перед ними - нездоровые по provider_health
+        (низкая оценка при достаточном числе недавних наблюдений).
+        """
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+        
+        chain = [self] + self.fallback_providers
+        if len(chain) == 1:
+            return chain
+        
+        open_keys = {(item['provider'], item['model'])
+                     for item in circuit_breaker.status() if item['state'] == 'open'}
+        
+        def rank(item):
+            position, checker = item
+            model = self._chain_model(checker, model_name)
+            degraded = provider_health.is_degraded(checker.provider, model, settings.REQUEST_TIMEOUT)
+            return ((checker.provider, model) in open_keys, degraded, position)
+        
+        return [checker for _, checker in sorted(enumerate(chain), key=rank)]
+    
+    def _check_with_chain(self, student_answer: str, correct_variants: List[str],
+                          question_context: str, system_prompt: Optional[str],
+                          model_name: str, deadline: Optional[Deadline] = None) -> Tuple[AICheckResult, bool]:
+        """
+        Проверка через цепочку провайдеров: первый успешный ответ.
+        
+        При включенном hedging, если основной провайдер не ответил за свой p95,
+        параллельно запускается следующий (см. _check_hedged).
+        """
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+        
+        def call(checker):
+            return checker._call_provider(student_answer, correct_variants, question_context,
+                                          system_prompt, self._chain_model(checker, model_name), deadline)
+        
+        chain = self._ordered_chain(model_name)
+        result, attempted = None, False
+        
+        if settings.HEDGE_ENABLED and len(chain) > 1:
+            primary, secondary = chain[0], chain[1]
+            hedge_after = provider_health.percentile(
+                primary.provider, self._chain_model(primary, model_name), 0.95,
+                min_samples=int(settings.HEDGE_MIN_SAMPLES)
+            )
+            if hedge_after is not None:
+                result, attempted = self._check_hedged(primary, secondary, hedge_after, call,
+                                                       deadline, float(settings.REQUEST_TIMEOUT))
+                if result.ai_provider != 'fallback':
+                    return result, attempted
+                chain = chain[2:]
+        
+        for checker in chain:
+            checker_result, checker_attempted = call(checker)
+            attempted = attempted or checker_attempted
+            if checker_result.ai_provider != 'fallback':
+                if checker is not self:
+                    print(f"🔀 Ответ получен от запасного провайдера {checker.provider}")
+                return checker_result, attempted
+            result = checker_result if checker_attempted or result is None else result
+        
+        return result, attempted
+    
+    @staticmethod
+    def _check_hedged(primary: "AIAnswerChecker", secondary: "AIAnswerChecker",
+                      hedge_after: float, call, deadline: Optional[Deadline] = None,
+                      timeout: float = 10.0) -> Tuple[AICheckResult, bool]:
+        """
+        Основной запрос - в потоке проверки; если он не ответил за свой p95
+        (hedge_after секунд), запасной уходит в пул _hedge_executor.
+
+        Успешный ответ основного возвращается сразу (запасной досчитается в
+        фоне и учтется в статистике здоровья). Если основной ответил ошибкой,
+        берется ответ запасного - ожидание не дольше остатка бюджета deadline
+        (без бюджета - timeout); не запущенный запасной вызывается сразу.
+        """
+        # Запасной видит тот же снимок настроек, что и запрос
+        context = contextvars.copy_context()
+        lock = threading.Lock()
+        hedge = {'future': None, 'closed': False}
+        
+        def start_hedge():
+            with lock:
+                if hedge['closed']:
+                    return
+                print(f"⏱️ {primary.provider} не ответил за {hedge_after:.1f} с, запрос к {secondary.provider}")
+                hedge['future'] = _hedge_executor.submit(context.run, call, secondary)
+        
+        timer = threading.Timer(hedge_after, start_hedge)
+        timer.daemon = True
+        timer.start()
+        try:
+            result, attempted = call(primary)
+        finally:
+            timer.cancel()
+            with lock:
+                hedge['closed'] = True
+                future = hedge['future']
+        
+        if result.ai_provider != 'fallback':
+            return result, attempted
+        
+        if future is None:
+            # Основной уже ответил ошибкой - запасной запрашивается сразу
+            hedge_result, hedge_attempted = call(secondary)
+        else:
+            try:
+                hedge_result, hedge_attempted = future.result(timeout=request_timeout(deadline, timeout))
+            except FutureTimeoutError:
+                return result, attempted
+        if hedge_result.ai_provider != 'fallback' or hedge_attempted:
+            return hedge_result, attempted or hedge_attempted
+        return result, attempted
+    
+    def _model_for(self, model_name: Optional[str]) -> str:
+        """Модель запроса: указанная или модель провайдера по умолчанию"""
+        if model_name or self.model:
+            return model_name or self.model
+        if self.provider == "gemini":
+            from ai_config import AIConfig
+            return AIConfig.current().GEMINI_MODEL
+        return self.PROVIDER_MODELS.get(self.provider, '')
+    
+    @staticmethod
+    def _cache_ttl_for(result: AICheckResult, ttl: Optional[int] = None) -> int:
+        """
+        Политика допуска в кэш: время жизни записи для результата (0 - не кэшировать).
+        
+        Настоящий вердикт AI хранится CACHE_DURATION. Fallback (сбой или квота
+        провайдера) и неуверенный вердикт - только CACHE_NEGATIVE_TTL: кэш гасит
+        повторные запросы во время сбоя, но не закрепляет ошибку на час.
+        ttl заменяет CACHE_DURATION для настоящего вердикта.
+        """
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+        
+        if result.ai_provider == 'fallback' or result.confidence < settings.CACHE_MIN_CONFIDENCE:
+            return max(int(settings.CACHE_NEGATIVE_TTL), 0)
+        return int(ttl if ttl is not None else settings.CACHE_DURATION)
     
     def _build_prompt(self, student_answer: str, correct_variants: List[str], 
                      question_context: str = "") -> str:
@@ -155,7 +540,9 @@ class AIAnswerChecker:
     
     def _check_with_groq(self, student_answer: str, correct_variants: List[str], 
                         question_context: str = "",
-                        system_prompt: Optional[str] = None) -> AICheckResult:
+                        system_prompt: Optional[str] = None,
+                        model_name: Optional[str] = None,
+                        deadline: Optional[Deadline] = None) -> AICheckResult:
         """Проверка через Groq API"""
         url = "https://api.groq.com/openai/v1/chat/completions"
         
@@ -167,7 +554,7 @@ class AIAnswerChecker:
         user_prompt = self._build_prompt(student_answer, correct_variants, question_context)
         
         data = {
-            "model": "llama-3.1-8b-instant",
+            "model": model_name or self.PROVIDER_MODELS["groq"],
             "messages": [
                 {"role": "system", "content": system_prompt or "Ты - эксперт по проверке ответов. Всегда отвечай только валидным JSON."},
                 {"role": "user", "content": user_prompt}
@@ -177,7 +564,7 @@ class AIAnswerChecker:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = self.session.post(url, headers=headers, json=data, timeout=request_timeout(deadline, 10))
             response.encoding = 'utf-8'
             response.raise_for_status()
             
@@ -200,113 +587,153 @@ class AIAnswerChecker:
     
     def _build_gemini_request_body(self, student_answer: str, correct_variants: List[str],
                                    question_context: str, system_prompt: str,
-                                   generation_config: Dict) -> Dict:
-        """Формирует тело запроса для Gemini API с правильной кодировкой"""
-        
-        correct_answers_str = "\n".join([f"- {v}" for v in correct_variants])
+                                   generation_config: Dict, structured: bool = False) -> Dict:
+        """
+        Формирует тело запроса для Gemini API с правильной кодировкой
         
-        # ВСЕГДА используем наш фиксированный промпт
-        user_prompt_text = f"""Проверь ответ студента. Верни ТОЛЬКО валидный JSON, без дополнительного текста.
-
-Вопрос/Контекст: {question_context or "Не указан"}
-
-Правильные ответы:
-{correct_answers_str}
-
-Ответ студента: "{student_answer}"
-
-Критерии:
-- Учитывай синонимы, опечатки, падежи
-- Будь лоялен если суть верна
-- VR = virtual reality (разные форматы допустимы)
-- Истина/Верно/True - синонимы
-- Ложь/Не верно/False - синонимы
-
-Формат ответа (только JSON, ничего больше):
-{{"is_correct": true, "confidence": 95, "explanation": "краткое пояснение"}}"""
+        Инструкции передаются в systemInstruction (GEMINI_SYSTEM_INSTRUCTIONS),
+        в contents - только контекст, варианты и ответ ученика. Одинаковый
+        префикс всех запросов Gemini переиспользует (implicit caching).
+        structured=True - режим structured output: формат ответа задает responseSchema.
+        """
+        user_prompt_text = (
+            f"Контекст: {question_context or 'не указан'}\n"
+            f"Правильные ответы: {'; '.join(correct_variants)}\n"
+            f"Ответ ученика: \"{student_answer}\""
+        )
         
-        # Более строгие настройки для JSON генерации
         json_generation_config = {
             "temperature": 0.0,
-            "top_p": 0.8,
-            "top_k": 10,
             "max_output_tokens": 100,
             "candidate_count": 1
         }
+        if structured:
+            json_generation_config["responseMimeType"] = "application/json"
+            json_generation_config["responseSchema"] = GEMINI_RESPONSE_SCHEMA
         
-        request_body = {
+        return {
+            "systemInstruction": GEMINI_SYSTEM_INSTRUCTIONS[structured],
             "contents": [{
+                "role": "user",
                 "parts": [{"text": user_prompt_text}]
             }],
             "generationConfig": json_generation_config
         }
-        
-        return request_body
-
+    
     def _check_with_gemini(self, student_answer: str, correct_variants: List[str],
                           question_context: str = "",
                           system_prompt: Optional[str] = None,
-                          model_name: Optional[str] = None) -> AICheckResult:
+                          model_name: Optional[str] = None,
+                          deadline: Optional[Deadline] = None) -> AICheckResult:
         """Проверка через Google Gemini API с правильной обработкой кодировки"""
         from ai_config import AIConfig
+        settings = AIConfig.current()
 
-        model_to_use = model_name or AIConfig.GEMINI_MODEL
-        url = f"https://generativelanguage.googleapis.com/v1/models/{model_to_use}:generateContent?key={self.api_key}"
+        model_to_use = model_name or settings.GEMINI_MODEL
+        structured = bool(settings.GEMINI_STRUCTURED_OUTPUT)
+        # systemInstruction и responseSchema - в v1beta
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_to_use}:generateContent?key={self.api_key}"
         
         data = self._build_gemini_request_body(
             student_answer, correct_variants, question_context,
-            system_prompt or AIConfig.VERIFICATION_PROMPT_TEMPLATE,
-            AIConfig.GENERATION_CONFIG
+            system_prompt or settings.VERIFICATION_PROMPT_TEMPLATE,
+            settings.GENERATION_CONFIG,
+            structured=structured
         )
+        usage = {'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0}
+        
+        # Повторяются только структурно неверные ответы; ошибки HTTP -
+        # сразу в fallback (их учитывают circuit breaker и цепочка провайдеров)
+        attempts = 1 + (max(int(settings.MAX_RETRIES), 0) if structured else 0)
         
         try:
-            # КРИТИЧНО: Явно указываем кодировку UTF-8
-            headers = {
-                "Content-Type": "application/json; charset=utf-8"
-            }
-            
-            response = requests.post(
-                url, 
-                json=data, 
-                headers=headers,
-                timeout=15
-            )
-            
-            # КРИТИЧНО: Устанавливаем кодировку ответа
-            response.encoding = 'utf-8'
-            response.raise_for_status()
-            
-            # Получаем текст с правильной кодировкой
-            result = response.json()
-            
-            # Проверяем наличие candidates
-            if 'candidates' not in result or not result['candidates']:
-                error_msg = "Gemini не вернул ответ"
-                if 'promptFeedback' in result:
-                    error_msg += f": {result['promptFeedback']}"
-                raise Exception(error_msg)
-            
-            content = result['candidates'][0]['content']['parts'][0]['text'].strip()
-            
-            # Парсим JSON с правильной обработкой русских символов
-            json_result = self._extract_json(content)
+            for attempt in range(attempts):
+                if attempt and deadline and deadline.expired():
+                    raise Exception("Истек лимит времени проверки")
+                
+                # КРИТИЧНО: Явно указываем кодировку UTF-8
+                headers = {
+                    "Content-Type": "application/json; charset=utf-8"
+                }
+                
+                response = self.session.post(
+                    url, 
+                    json=data, 
+                    headers=headers,
+                    timeout=request_timeout(deadline, 15)
+                )
+                
+                # КРИТИЧНО: Устанавливаем кодировку ответа
+                response.encoding = 'utf-8'
+                response.raise_for_status()
+                
+                # Получаем текст с правильной кодировкой
+                result = response.json()
+                
+                # Учет токенов (повторные попытки суммируются)
+                metadata = result.get('usageMetadata', {})
+                usage['prompt_tokens'] += metadata.get('promptTokenCount', 0)
+                usage['output_tokens'] += metadata.get('candidatesTokenCount', 0)
+                usage['cached_tokens'] += metadata.get('cachedContentTokenCount', 0)
+                
+                # Проверяем наличие candidates
+                if 'candidates' not in result or not result['candidates']:
+                    error_msg = "Gemini не вернул ответ"
+                    if 'promptFeedback' in result:
+                        error_msg += f": {result['promptFeedback']}"
+                    raise Exception(error_msg)
+                
+                content = result['candidates'][0]['content']['parts'][0]['text'].strip()
+                
+                if not structured:
+                    # Парсим JSON с правильной обработкой русских символов
+                    json_result = self._extract_json(content)
+                    break
+                
+                json_result = self._parse_structured(content)
+                if json_result is not None:
+                    break
+                print(f"⚠️ Gemini вернул ответ не по схеме (попытка {attempt + 1}/{attempts}): {content[:200]}")
+            else:
+                raise Exception(f"Ответ Gemini не соответствует схеме: {content[:100]}")
             
             return AICheckResult(
                 is_correct=json_result.get('is_correct', False),
                 confidence=json_result.get('confidence', 0) / 100.0,
                 explanation=json_result.get('explanation', 'Нет объяснения от AI'),
                 ai_provider='gemini',
-                from_cache=False
+                from_cache=False,
+                usage=usage
             )
             
         except Exception as e:
             print(f"Ошибка Gemini API: {e}")
             return self._fallback_check(student_answer, correct_variants, error_message=str(e))
     
+    @staticmethod
+    def _parse_structured(text: str) -> Optional[Dict]:
+        """Строгий разбор ответа по GEMINI_RESPONSE_SCHEMA; None - ответ нужно запросить снова"""
+        try:
+            data = json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('is_correct'), bool):
+            return None
+        confidence = data.get('confidence')
+        if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+            return None
+        return {
+            'is_correct': data['is_correct'],
+            'confidence': min(max(confidence, 0), 100),
+            'explanation': str(data.get('explanation') or 'Нет объяснения от AI')
+        }
+    
     def _check_with_huggingface(self, student_answer: str, correct_variants: List[str],
-                               question_context: str = "") -> AICheckResult:
+                               question_context: str = "",
+                               model_name: Optional[str] = None,
+                               deadline: Optional[Deadline] = None) -> AICheckResult:
         """Проверка через HuggingFace API"""
-        url = "https://api-inference.huggingface.co/models/facebook/bart-large-mnli"
+        url = f"https://api-inference.huggingface.co/models/{model_name or self.PROVIDER_MODELS['huggingface']}"
         
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -319,7 +746,7 @@ class AIAnswerChecker:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = self.session.post(url, headers=headers, json=data, timeout=request_timeout(deadline, 10))
             response.encoding = 'utf-8'
             response.raise_for_status()
             
@@ -342,7 +769,9 @@ class AIAnswerChecker:
     
     def _check_with_cohere(self, student_answer: str, correct_variants: List[str],
                           question_context: str = "",
-                          system_prompt: Optional[str] = None) -> AICheckResult:
+                          system_prompt: Optional[str] = None,
+                          model_name: Optional[str] = None,
+                          deadline: Optional[Deadline] = None) -> AICheckResult:
         """Проверка через Cohere API"""
         url = "https://api.cohere.ai/v1/generate"
         
@@ -354,14 +783,14 @@ class AIAnswerChecker:
         user_prompt = self._build_prompt(student_answer, correct_variants, question_context)
         
         data = {
-            "model": "command-light",
+            "model": model_name or self.PROVIDER_MODELS["cohere"],
             "prompt": f"{system_prompt}\n\n{user_prompt}" if system_prompt else user_prompt,
             "max_tokens": 200,
             "temperature": 0.1
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = self.session.post(url, headers=headers, json=data, timeout=request_timeout(deadline, 10))
             response.encoding = 'utf-8'
             response.raise_for_status()
             
@@ -502,9 +931,11 @@ def quick_check_answer(student_answer: str,
                       correct_variants: List[str],
                       provider: str = "groq",
                       api_key: Optional[str] = None) -> bool:
-    """Быстрая проверка одного ответа с кэшированием"""
+    """Быстрая проверка одного ответа с кэшированием (проверщик - из общего реестра)"""
+    from checker_registry import checker_registry
+    
     try:
-        checker = AIAnswerChecker(provider=provider, api_key=api_key)
+        checker = checker_registry.get(provider, api_key)
         result = checker.check_answer(student_answer, correct_variants)
         return result.is_correct and result.confidence > 0.5
     except Exception as e:
@@ -2,8 +2,13 @@
 Конфигурация для AI-проверки ответов
 Настройки могут быть изменены через веб-интерфейс
 """
-import os
+import contextvars
+import copy
 import json
+import os
+import threading
+import time
+from contextlib import contextmanager
 
 class AIConfig:
     """Настройки для интеграции с Gemini AI"""
@@ -53,51 +58,110 @@ class AIConfig:
     REQUEST_TIMEOUT = 30
     MAX_RETRIES = 2
     
+    # Structured output Gemini (responseMimeType + responseSchema): короткий промпт,
+    # строгий разбор JSON; ответ не по схеме запрашивается снова до MAX_RETRIES раз
+    GEMINI_STRUCTURED_OUTPUT = True
+    
+    # Цепочка провайдеров: первый - основной, остальные - запасные при ошибке.
+    # Ключ Gemini - GEMINI_API_KEY, ключи остальных - PROVIDER_API_KEYS или переменные окружения
+    PROVIDER_CHAIN = ['gemini']
+    PROVIDER_API_KEYS = {}
+    # Hedging: если основной провайдер не ответил за свой p95 (нужно HEDGE_MIN_SAMPLES замеров),
+    # параллельно запрашивается следующий в цепочке
+    HEDGE_ENABLED = False
+    HEDGE_MIN_SAMPLES = 20
+    
+    # Каскад моделей: уровни проверяются по порядку до основной модели, вердикт уровня
+    # принимается при уверенности не ниже его min_confidence (по умолчанию CASCADE_MIN_CONFIDENCE).
+    # Пример: [{"provider": "groq", "model": "llama-3.1-8b-instant", "min_confidence": 0.9}]
+    MODEL_CASCADE = []
+    CASCADE_MIN_CONFIDENCE = 0.85
+    
+    # Circuit breaker (circuit_breaker.py): после BREAKER_FAILURE_THRESHOLD ошибок
+    # за BREAKER_WINDOW секунд провайдер пропускается на BREAKER_COOLDOWN секунд (0 - выключен)
+    BREAKER_FAILURE_THRESHOLD = 3
+    BREAKER_WINDOW = 60
+    BREAKER_COOLDOWN = 30
+    
     # Кэширование AI ответов
     CACHE_AI_RESPONSES = True
     CACHE_DURATION = 3600
+    # Политика допуска в кэш: fallback-ответы (сбой/квота провайдера) и вердикты
+    # с уверенностью ниже порога хранятся только CACHE_NEGATIVE_TTL секунд (0 - не кэшировать)
+    CACHE_NEGATIVE_TTL = 60
+    CACHE_MIN_CONFIDENCE = 0.7
+    
+    # Предварительная проверка вероятных ответов при сохранении шаблона (pregrader.py)
+    PREGRADE_ENABLED = False
+    PREGRADE_RATE_PER_MINUTE = 20
+    PREGRADE_MAX_PER_FIELD = 30
+    # Вердикты предварительной проверки живут в кэше дольше CACHE_DURATION -
+    # шаблон обычно сохраняют задолго до урока
+    PREGRADE_CACHE_TTL = 7 * 24 * 3600
+    
+    # Подсказка "ближайший правильный вариант" в результатах неверных ответов
+    CLOSEST_VARIANT_HINT = False
+    
+    # Асинхронная проверка: /check_answers сразу возвращает локальные вердикты,
+    # вердикты AI приходят ученику по SSE (ASYNC_GRADING_WORKERS потоков на воркер,
+    # новое значение применяется без перезапуска)
+    ASYNC_AI_GRADING = False
+    ASYNC_GRADING_WORKERS = 4
+    
+    # Очередь перепроверки (regrade_queue.py): поля, которые AI не проверил, перепроверяются
+    # в фоне не чаще REGRADE_RATE_PER_MINUTE раз в минуту на все воркеры
+    REGRADE_ENABLED = True
+    REGRADE_RATE_PER_MINUTE = 10
+    REGRADE_MAX_ATTEMPTS = 8
+    
+    # Бюджет времени /check_answers в секундах (deadline.py, 0 - без ограничения):
+    # AI, кэш и Google Sheets укладываются в остаток, остальное доделывается в фоне
+    SUBMISSION_DEADLINE = 8
+
+    @staticmethod
+    def current() -> 'SettingsSnapshot':
+        """
+        Действующие настройки: снимок, закрепленный за текущим запросом
+        (pin), иначе последний снимок процесса. Атрибуты класса AIConfig -
+        только значения по умолчанию, в процессе работы они не меняются.
+        """
+        return _pinned_settings.get() or settings_store.get()
+
+    @staticmethod
+    def pin():
+        """Закрепить за текущим контекстом один снимок (на все время запроса)"""
+        return _pinned_settings.set(settings_store.get())
+
+    @staticmethod
+    def unpin(token):
+        _pinned_settings.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def pinned():
+        """Один снимок на блок кода (фоновые задачи вне запроса)"""
+        token = AIConfig.pin()
+        try:
+            yield _pinned_settings.get()
+        finally:
+            AIConfig.unpin(token)
 
     @staticmethod
     def load_from_file():
-        """Загрузка настроек из файла"""
-        if os.path.exists(AIConfig.SETTINGS_FILE):
-            try:
-                with open(AIConfig.SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    
-                    # Обновляем настройки класса
-                    AIConfig.AI_CHECKING_ENABLED = settings.get('ai_enabled', AIConfig.AI_CHECKING_ENABLED)
-                    AIConfig.SIMILARITY_THRESHOLD = settings.get('similarity_threshold', AIConfig.SIMILARITY_THRESHOLD)
-                    
-                    if settings.get('api_key') and not settings['api_key'].startswith('***'):
-                        AIConfig.GEMINI_API_KEY = settings['api_key']
-                    
-                    AIConfig.GEMINI_MODEL = settings.get('ai_model', AIConfig.GEMINI_MODEL)
-                    AIConfig.GENERATION_CONFIG['temperature'] = settings.get('temperature', 0.0)
-                    AIConfig.GENERATION_CONFIG['max_output_tokens'] = settings.get('max_tokens', 100)
-                    AIConfig.GENERATION_CONFIG['top_p'] = settings.get('top_p', 0.8)
-                    
-                    # Загружаем промпты, но они не используются в новой версии
-                    if 'system_prompt' in settings:
-                        AIConfig.SYSTEM_PROMPT = settings['system_prompt']
-                    
-                    AIConfig.CACHE_AI_RESPONSES = settings.get('cache_enabled', AIConfig.CACHE_AI_RESPONSES)
-                    AIConfig.CACHE_DURATION = settings.get('cache_duration', AIConfig.CACHE_DURATION)
-                    AIConfig.LOG_AI_REQUESTS = settings.get('logging_enabled', AIConfig.LOG_AI_REQUESTS)
-                    AIConfig.AI_LOG_FILE = settings.get('log_file', AIConfig.AI_LOG_FILE)
-                    
-                    return True
-            except Exception as e:
-                print(f"Ошибка загрузки настроек: {e}")
-                return False
-        return False
+        """Перечитать файл настроек сразу, не дожидаясь проверки mtime"""
+        settings_store.refresh(force=True)
+        return os.path.exists(AIConfig.SETTINGS_FILE)
 
     @staticmethod
     def save_to_file(settings):
         """Сохранение настроек в файл"""
         try:
-            with open(AIConfig.SETTINGS_FILE, 'w', encoding='utf-8') as f:
+            # Через временный файл: другие воркеры не должны прочитать файл наполовину
+            tmp_file = AIConfig.SETTINGS_FILE + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
                 json.dump(settings, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, AIConfig.SETTINGS_FILE)
+            settings_store.refresh(force=True)
             return True
         except Exception as e:
             print(f"Ошибка сохранения настроек: {e}")
@@ -106,13 +170,12 @@ class AIConfig:
     @staticmethod
     def validate_config():
         """Проверка корректности конфигурации"""
-        if AIConfig.AI_CHECKING_ENABLED:
-            if AIConfig.GEMINI_API_KEY == 'YOUR_API_KEY_HERE':
-                # Пытаемся загрузить из переменной окружения
+        settings = AIConfig.current()
+        if settings.AI_CHECKING_ENABLED:
+            if settings.GEMINI_API_KEY == 'YOUR_API_KEY_HERE':
+                # Ключ из переменной окружения подставляется при загрузке снимка
                 env_key = os.getenv('GEMINI_API_KEY')
-                if env_key and env_key != 'YOUR_API_KEY_HERE':
-                    AIConfig.GEMINI_API_KEY = env_key
-                else:
+                if not env_key or env_key == 'YOUR_API_KEY_HERE':
                     raise ValueError(
                         "Не установлен API ключ Gemini. "
                         "Установите переменную окружения GEMINI_API_KEY, "
@@ -120,5 +183,178 @@ class AIConfig:
                     )
         return True
 
-# Пытаемся загрузить настройки при импорте
-AIConfig.load_from_file()
\ No newline at end of file
+
+# Ключ в ai_settings.json -> настройка AIConfig
+SETTINGS_KEYS = {
+    'ai_enabled': 'AI_CHECKING_ENABLED',
+    'similarity_threshold': 'SIMILARITY_THRESHOLD',
+    'ai_model': 'GEMINI_MODEL',
+    'system_prompt': 'SYSTEM_PROMPT',
+    'cache_enabled': 'CACHE_AI_RESPONSES',
+    'cache_duration': 'CACHE_DURATION',
+    'cache_negative_ttl': 'CACHE_NEGATIVE_TTL',
+    'cache_min_confidence': 'CACHE_MIN_CONFIDENCE',
+    'pregrade_enabled': 'PREGRADE_ENABLED',
+    'pregrade_rate_per_minute': 'PREGRADE_RATE_PER_MINUTE',
+    'pregrade_max_per_field': 'PREGRADE_MAX_PER_FIELD',
+    'pregrade_cache_ttl': 'PREGRADE_CACHE_TTL',
+    'closest_variant_hint': 'CLOSEST_VARIANT_HINT',
+    'structured_output': 'GEMINI_STRUCTURED_OUTPUT',
+    'async_grading': 'ASYNC_AI_GRADING',
+    'async_grading_workers': 'ASYNC_GRADING_WORKERS',
+    'regrade_enabled': 'REGRADE_ENABLED',
+    'regrade_rate_per_minute': 'REGRADE_RATE_PER_MINUTE',
+    'regrade_max_attempts': 'REGRADE_MAX_ATTEMPTS',
+    'submission_deadline': 'SUBMISSION_DEADLINE',
+    'provider_chain': 'PROVIDER_CHAIN',
+    'provider_api_keys': 'PROVIDER_API_KEYS',
+    'hedge_enabled': 'HEDGE_ENABLED',
+    'hedge_min_samples': 'HEDGE_MIN_SAMPLES',
+    'model_cascade': 'MODEL_CASCADE',
+    'cascade_min_confidence': 'CASCADE_MIN_CONFIDENCE',
+    'breaker_failure_threshold': 'BREAKER_FAILURE_THRESHOLD',
+    'breaker_window': 'BREAKER_WINDOW',
+    'breaker_cooldown': 'BREAKER_COOLDOWN',
+    'logging_enabled': 'LOG_AI_REQUESTS',
+    'log_file': 'AI_LOG_FILE',
+}
+# Параметры генерации: ключ в файле -> ключ GENERATION_CONFIG
+GENERATION_KEYS = {
+    'temperature': 'temperature',
+    'max_tokens': 'max_output_tokens',
+    'top_p': 'top_p',
+}
+
+# Файл настроек проверяется (os.stat) не чаще раза в столько секунд
+SETTINGS_CHECK_INTERVAL = 1.0
+
+
+class FrozenDict(dict):
+    """Словарь только для чтения (вложенные настройки снимка)"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Настройки только для чтения")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class SettingsSnapshot:
+    """
+    Неизменяемый снимок настроек AI. Атрибуты называются так же, как
+    у AIConfig (settings.GEMINI_MODEL, settings.CACHE_DURATION ...);
+    version - (mtime, размер) файла, из которого снимок загружен.
+    """
+
+    __slots__ = ('version', '_values')
+
+    def __init__(self, values, version=None):
+        object.__setattr__(self, '_values', {name: _freeze(value) for name, value in values.items()})
+        object.__setattr__(self, 'version', version)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок настроек неизменяем, используйте AIConfig.save_to_file()")
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _load_snapshot(path, version) -> SettingsSnapshot:
+    """Снимок: значения по умолчанию из AIConfig, поверх них - ai_settings.json"""
+    values = {name: copy.deepcopy(value) for name, value in vars(AIConfig).items()
+              if name.isupper() and not callable(value)}
+    if version is not None:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+
+        for key, name in SETTINGS_KEYS.items():
+            if key in settings:
+                values[name] = settings[key]
+        for key, name in GENERATION_KEYS.items():
+            if key in settings:
+                values['GENERATION_CONFIG'][name] = settings[key]
+        if settings.get('api_key') and not settings['api_key'].startswith('***'):
+            values['GEMINI_API_KEY'] = settings['api_key']
+    return SettingsSnapshot(values, version)
+
+
+class SettingsStore:
+    """
+    Последний снимок настроек процесса. Чтение - без блокировок: раз в
+    SETTINGS_CHECK_INTERVAL один поток проверяет mtime файла и, если файл
+    изменился, загружает новый снимок; остальные в это время получают
+    прежний. Снимок заменяется целиком, поэтому запрос, взявший снимок,
+    видит согласованные настройки до конца. Если запущен наблюдатель
+    (settings_watch.py), проверкой файла занимается только он.
+    """
+
+    def __init__(self, path: str, interval: float = SETTINGS_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._failed_version = None
+        self._lock = threading.Lock()
+        # Файл проверяет поток settings_watch.SettingsWatcher - запросы его не трогают
+        self.watched = False
+
+    def get(self) -> SettingsSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and (self.watched or time.monotonic() - self._checked_at < self.interval):
+            return snapshot
+        if snapshot is None:
+            return self.revalidate()
+        # Файл проверяет один поток, остальные не ждут его
+        if not self._lock.acquire(blocking=False):
+            return snapshot
+        try:
+            return self._revalidate(force=False)
+        finally:
+            self._lock.release()
+
+    def refresh(self, force: bool = True) -> SettingsSnapshot:
+        with self._lock:
+            return self._revalidate(force)
+
+    def revalidate(self) -> SettingsSnapshot:
+        """Перечитать файл, только если изменился его mtime"""
+        return self.refresh(force=False)
+
+    def _revalidate(self, force: bool) -> SettingsSnapshot:
+        version = _file_version(self.path)
+        changed = self._snapshot is None or version not in (self._snapshot.version, self._failed_version)
+        if force or changed:
+            try:
+                self._snapshot = _load_snapshot(self.path, version)
+                self._failed_version = None
+            except Exception as e:
+                # Файл с ошибкой не заменяет рабочие настройки
+                print(f"Ошибка загрузки настроек: {e}")
+                self._failed_version = version
+                if self._snapshot is None:
+                    self._snapshot = _load_snapshot(self.path, None)
+        self._checked_at = time.monotonic()
+        return self._snapshot
+
+
+# Настройки процесса и снимок, закрепленный за текущим запросом
+settings_store = SettingsStore(AIConfig.SETTINGS_FILE)
+_pinned_settings = contextvars.ContextVar('ai_settings', default=None)
\ No newline at end of file
@@ -0,0 +1,696 @@
+"""
+Журнал AI проверок (JSON Lines)
+
+Запрос не пишет на диск: write() кладет запись в ограниченную очередь
+в памяти, фоновый поток забирает записи пачками и дописывает их в файл
+AIConfig.AI_LOG_FILE одним write() с O_APPEND - строки нескольких
+воркеров gunicorn не перемешиваются. fsync - не чаще раза в
+LOG_FSYNC_INTERVAL секунд. Если очередь переполнена (диск не успевает),
+запись отбрасывается и учитывается в счетчике dropped.
+
+Ротация (LogSegments): файл больше LOG_MAX_BYTES или с записями за
+прошлый день переименовывается в сегмент ai_checks.log.<время>, через
+LOG_COMPRESS_DELAY секунд (воркеры успевают переоткрыть файл) сегмент
+сжимается в .gz и попадает в манифест ai_checks.log.manifest.json со
+сводкой: время первой и последней записи, число записей и счетчики.
+Статистика берется из сводок. Просмотр (LogPage) читает журнал с конца
+страницами по курсору; сжатые сегменты разбиты на gzip блоки с индексом
+в манифесте, поэтому распаковываются только блоки нужной страницы и
+нужного периода. Сводку несжатых файлов LogSegments.summary() ведет
+по смещениям в ai_checks.log.stats.json - каждый вызов дочитывает только
+новые строки. Сегменты старше LOG_RETENTION_DAYS дней и сверх
+LOG_MAX_SEGMENTS удаляются. Ротацией и сжатием в каждый момент занят
+один воркер (flock на ai_checks.log.lock).
+"""
+
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import Config
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+# Пачка пишется, как только набралась, или через столько секунд после первой записи
+LOG_FLUSH_INTERVAL = 0.2
+LOG_FSYNC_INTERVAL = 1.0
+
+LOG_MAX_BYTES = int(os.getenv('AI_LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_RETENTION_DAYS = int(os.getenv('AI_LOG_RETENTION_DAYS', 90))
+LOG_MAX_SEGMENTS = int(os.getenv('AI_LOG_MAX_SEGMENTS', 200))
+# Сегмент сжимается, когда все воркеры уже пишут в новый файл
+LOG_COMPRESS_DELAY = 10
+LOG_MAINTENANCE_INTERVAL = 5
+# Исходный размер gzip блока сжатого сегмента (шаг разреженного индекса)
+LOG_INDEX_BLOCK_BYTES = 1024 * 1024
+# Чтение несжатых файлов с конца - блоками такого размера
+LOG_READ_BLOCK = 64 * 1024
+LOG_PAGE_SIZE = 100
+FILE_ID_BYTES = 64
+LOG_MAX_PAGE_SIZE = 1000
+# Больше строк за один запрос страницы не просматривается (редкий фильтр) -
+# страница возвращается неполной, с курсором для продолжения
+LOG_SCAN_LIMIT = 200000
+# Границы корзин гистограммы задержек AI проверки, мс
+LATENCY_BUCKETS_MS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000)
+# Метка времени в имени сегмента (сортируется как строка)
+SEGMENT_STAMP_FORMAT = '%Y%m%dT%H%M%S%f'
+
+
+def ai_log_path(settings=None) -> str:
+    """Абсолютный путь журнала (AI_LOG_FILE - относительно папки приложения)"""
+    if settings is None:
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+    return os.path.join(Config.BASE_DIR, settings.AI_LOG_FILE)
+
+
+def new_summary() -> Dict:
+    """Пустая сводка записей журнала"""
+    return {'total': 0, 'success': 0, 'ai_correct': 0, 'providers': {}, 'models': {}, 'latency_ms': {}}
+
+
+def latency_bucket(latency_ms: float) -> str:
+    """Корзина гистограммы задержек: верхняя граница в мс (или 'inf')"""
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return str(bound)
+    return 'inf'
+
+
+def add_to_summary(summary: Dict, entry: Dict):
+    """Учесть запись журнала в сводке"""
+    summary['total'] += 1
+    if entry.get('success'):
+        summary['success'] += 1
+    if entry.get('is_correct'):
+        summary['ai_correct'] += 1
+    provider = entry.get('ai_provider') or 'error'
+    summary['providers'][provider] = summary['providers'].get(provider, 0) + 1
+    model = entry.get('ai_model')
+    if model:
+        models = summary.setdefault('models', {})
+        models[model] = models.get(model, 0) + 1
+    latency = entry.get('latency_ms')
+    if isinstance(latency, (int, float)):
+        histogram = summary.setdefault('latency_ms', {})
+        bucket = latency_bucket(latency)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+def latency_percentiles(histogram: Dict[str, int], percentiles=(50, 90, 99)) -> Dict[str, Optional[float]]:
+    """Перцентили задержки по гистограмме (с точностью до границы корзины)"""
+    count = sum(histogram.values())
+    bounds = [str(bound) for bound in LATENCY_BUCKETS_MS] + ['inf']
+    result = {}
+    for percentile in percentiles:
+        value, seen = None, 0
+        for bound in bounds:
+            seen += histogram.get(bound, 0)
+            if count and seen >= count * percentile / 100:
+                value = float(bound)
+                break
+        result[f'p{percentile}'] = value
+    return result
+
+
+def merge_summary(total: Dict, summary: Dict):
+    """Прибавить сводку summary к total"""
+    for name, value in summary.items():
+        if isinstance(value, dict):
+            merge_summary(total.setdefault(name, {}), value)
+        else:
+            total[name] = total.get(name, 0) + value
+
+
+def _file_key(stat: os.stat_result) -> str:
+    """Идентификатор файла, не меняющийся при ротации (устройство:inode)"""
+    return f'{stat.st_dev}:{stat.st_ino}'
+
+
+def _file_id(f) -> str:
+    """
+    Идентификатор файла для курсора: inode освободившегося после сжатия
+    сегмента сразу достается новому файлу, поэтому к нему добавляется
+    отпечаток начала файла (первые FILE_ID_BYTES байт не меняются)
+    """
+    position = f.tell()
+    f.seek(0)
+    head = f.read(FILE_ID_BYTES)
+    f.seek(position)
+    return f'{_file_key(os.fstat(f.fileno()))}:{hashlib.sha1(head).hexdigest()[:12]}'
+
+
+def _parse_line(line) -> Optional[Dict]:
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+# Сводку текущего файла в процессе дочитывает один поток
+_stats_lock = threading.Lock()
+
+
+class LogSegments:
+    """Ротация, сжатие и хранение сегментов журнала"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.prefix = os.path.basename(path) + '.'
+        self.manifest_path = path + '.manifest.json'
+        self.stats_path = path + '.stats.json'
+        self.lock_path = path + '.lock'
+
+    @contextmanager
+    def _locked(self, blocking: bool = True):
+        """Межпроцессная блокировка; без blocking - False, если ее держит другой воркер"""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def needs_rotation(stat: os.stat_result) -> bool:
+        """Файл слишком большой или в нем записи прошлого дня"""
+        if not stat.st_size:
+            return False
+        return stat.st_size >= LOG_MAX_BYTES or date.fromtimestamp(stat.st_mtime) < date.today()
+
+    def rotate(self, force: bool = False) -> Optional[str]:
+        """Переименовать текущий файл в сегмент; воркеры откроют новый файл сами"""
+        with self._locked():
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return None
+            # Другой воркер мог уже повернуть файл, пока ждали блокировку
+            if not stat.st_size or not (force or self.needs_rotation(stat)):
+                return None
+            segment = os.path.join(self.directory, self.prefix + datetime.now().strftime(SEGMENT_STAMP_FORMAT))
+            os.rename(self.path, segment)
+        print(f"🗂️ Журнал AI: начат новый файл, прежний - {os.path.basename(segment)}")
+        return segment
+
+    def maintain(self):
+        """Сжать закрытые сегменты и удалить лишние (если этим не занят другой воркер)"""
+        with self._locked(blocking=False) as acquired:
+            if not acquired:
+                return
+            manifest = self.load_manifest()
+            now = time.time()
+            for segment in self._plain_segments():
+                if now - os.path.getmtime(segment) >= LOG_COMPRESS_DELAY:
+                    manifest['segments'].append(self._compress(segment))
+            self._apply_retention(manifest)
+            self._save_manifest(manifest)
+
+    def _plain_segments(self) -> List[str]:
+        """Повернутые, но еще не сжатые сегменты (по времени)"""
+        return sorted(path for path in glob.glob(os.path.join(self.directory, glob.escape(self.prefix) + '2*'))
+                      if '.' not in os.path.basename(path)[len(self.prefix):])
+
+    def _compress(self, segment: str) -> Dict:
+        """
+        Сжать сегмент в .gz, попутно посчитав его сводку. Файл пишется
+        отдельными gzip блоками по LOG_INDEX_BLOCK_BYTES, их смещения
+        (сжатое, исходное, время первой записи) - разреженный индекс в
+        манифесте: чтение с конца распаковывает только нужные блоки
+        """
+        name = os.path.basename(segment)
+        info = {
+            'file': name + '.gz',
+            'rotated_at': datetime.strptime(name[len(self.prefix):], SEGMENT_STAMP_FORMAT).isoformat(),
+            'first_ts': None,
+            'last_ts': None,
+            'bytes': os.path.getsize(segment),
+            'summary': new_summary(),
+            'index': []
+        }
+        tmp_path = segment + '.gz.tmp'
+        block, block_ts, offset = [], None, 0
+        with open(segment, 'rb') as source, open(tmp_path, 'wb') as target:
+            info['key'] = _file_id(source)
+            for line in source:
+                entry = _parse_line(line)
+                timestamp = entry.get('timestamp') if entry else None
+                if entry is not None:
+                    add_to_summary(info['summary'], entry)
+                if timestamp:
+                    info['first_ts'] = min(info['first_ts'] or timestamp, timestamp)
+                    info['last_ts'] = max(info['last_ts'] or timestamp, timestamp)
+                    block_ts = block_ts or timestamp
+                block.append(line)
+                if sum(map(len, block)) >= LOG_INDEX_BLOCK_BYTES:
+                    offset = self._write_block(target, block, offset, block_ts, info['index'])
+                    block, block_ts = [], None
+            if block:
+                self._write_block(target, block, offset, block_ts, info['index'])
+        os.replace(tmp_path, segment + '.gz')
+        os.remove(segment)
+        info['compressed_bytes'] = os.path.getsize(segment + '.gz')
+        return info
+
+    @staticmethod
+    def _write_block(target, block: List[bytes], offset: int, first_ts: Optional[str], index: List) -> int:
+        """Записать блок строк отдельным gzip членом; возвращает исходное смещение следующего блока"""
+        data = b''.join(block)
+        index.append([target.tell(), offset, first_ts])
+        target.write(gzip.compress(data))
+        return offset + len(data)
+
+    def _apply_retention(self, manifest: Dict):
+        cutoff = (datetime.now() - timedelta(days=LOG_RETENTION_DAYS)).isoformat()
+        segments = sorted(manifest['segments'], key=lambda item: item['rotated_at'])
+        keep = [item for item in segments if item['rotated_at'] >= cutoff][-LOG_MAX_SEGMENTS:]
+        for item in segments:
+            if item not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, item['file']))
+                except FileNotFoundError:
+                    pass
+        manifest['segments'] = keep
+
+    def load_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except ValueError as e:
+            print(f"⚠️ Манифест журнала AI поврежден, сегменты будут учтены заново: {e}")
+            manifest = {}
+        manifest.setdefault('segments', [])
+        manifest.setdefault('cleared_at', None)
+        return manifest
+
+    def _save_manifest(self, manifest: Dict):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def clear(self):
+        """
+        Начать журнал заново: текущий файл становится сегментом, все сегменты
+        остаются на диске до срока хранения, но не видны статистике и просмотру
+        """
+        self.rotate(force=True)
+        with self._locked():
+            manifest = self.load_manifest()
+            manifest['cleared_at'] = datetime.now().isoformat()
+            self._save_manifest(manifest)
+
+    def segments(self, include_cleared: bool = False) -> List[Dict]:
+        """Сжатые сегменты из манифеста (от старых к новым)"""
+        manifest = self.load_manifest()
+        cleared_at = manifest['cleared_at']
+        return sorted((item for item in manifest['segments']
+                       if include_cleared or not cleared_at or item['rotated_at'] > cleared_at),
+                      key=lambda item: item['rotated_at'])
+
+    def _visible_plain_segments(self) -> List[str]:
+        cleared_at = self.load_manifest()['cleared_at']
+        return [path for path in self._plain_segments()
+                if not cleared_at or datetime.strptime(
+                    os.path.basename(path)[len(self.prefix):], SEGMENT_STAMP_FORMAT).isoformat() > cleared_at]
+
+    def summary(self) -> Dict:
+        """
+        Сводка всего журнала: сжатые сегменты - из манифеста, несжатые и
+        текущий файл - из файла ai_checks.log.stats.json, где для каждого
+        файла хранится сводка прочитанного и смещение. Читаются только
+        строки, дописанные после прошлого вызова (в любом воркере).
+        """
+        total = new_summary()
+        segments = self.segments()
+        for item in segments:
+            merge_summary(total, item['summary'])
+        with _stats_lock:
+            known = self._load_stats()
+            files, changed = {}, False
+            for path in self._visible_plain_segments() + [self.path]:
+                try:
+                    key, state, advanced = self._tail(path, known)
+                except FileNotFoundError:
+                    continue
+                files[key] = state
+                changed = changed or advanced
+                merge_summary(total, state['summary'])
+            # Сжатые и удаленные файлы уходят из состояния
+            if changed or files.keys() != known.keys():
+                self._save_stats(files)
+        total['segments'] = len(segments)
+        return total
+
+    def _tail(self, path: str, known: Dict):
+        """Дочитать файл с сохраненного смещения: (ключ файла, состояние, были ли новые строки)"""
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            key = _file_key(stat)
+            head = hashlib.sha1(f.readline()).hexdigest()
+            state = known.get(key)
+            # Тот же inode может достаться новому файлу - сверяем первую строку
+            if state is None or state['head'] != head or stat.st_size < state['offset']:
+                state = {'offset': 0, 'head': head, 'summary': new_summary()}
+            f.seek(state['offset'])
+            advanced = False
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Строку еще дописывают - дочитаем в следующий раз
+                    break
+                state['offset'] += len(line)
+                advanced = True
+                entry = _parse_line(line)
+                if entry is not None:
+                    add_to_summary(state['summary'], entry)
+        return key, state, advanced
+
+    def _load_stats(self) -> Dict:
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('files', {})
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"⚠️ Файл статистики журнала AI поврежден, журнал будет прочитан заново: {e}")
+            return {}
+
+    def _save_stats(self, files: Dict):
+        tmp_path = f'{self.stats_path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.stats_path)
+
+    def iter_reverse(self, cursor: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None) -> Iterator[Tuple[Dict, str]]:
+        """
+        Записи от новых к старым: текущий файл, несжатые сегменты, сжатые
+        сегменты. Для каждой записи - курсор "<файл>@<смещение>", чтение с
+        которого продолжится со следующей (более старой) записи. Сжатые
+        сегменты и их блоки вне since/until не распаковываются.
+        """
+        sources = []
+        for path in [self.path] + self._visible_plain_segments()[::-1]:
+            try:
+                with open(path, 'rb') as f:
+                    sources.append((_file_id(f), path, None))
+            except FileNotFoundError:
+                continue
+        for item in self.segments()[::-1]:
+            if (since and item['last_ts'] and item['last_ts'] < since) or \
+                    (until and item['first_ts'] and item['first_ts'] > until):
+                continue
+            sources.append((item.get('key') or item['file'], os.path.join(self.directory, item['file']), item))
+
+        start_key, end = None, None
+        if cursor:
+            start_key, _, offset = cursor.rpartition('@')
+            end = int(offset)
+            if start_key not in [key for key, _, _ in sources]:
+                # Файл курсора удален по сроку хранения или после очистки журнала
+                return
+        for key, path, item in sources:
+            if start_key is not None and key != start_key:
+                continue
+            try:
+                lines = (self._reverse_blocks(path, item, end, since, until) if item
+                         else self._reverse_lines(path, end))
+                for offset, line in lines:
+                    entry = _parse_line(line)
+                    if entry is not None:
+                        yield entry, f'{key}@{offset}'
+            except FileNotFoundError:
+                pass
+            start_key, end = None, None
+
+    @staticmethod
+    def _reverse_lines(path: str, end: Optional[int]) -> Iterator[Tuple[int, bytes]]:
+        """Строки несжатого файла до смещения end (от последней к первой) с их смещениями"""
+        with open(path, 'rb') as f:
+            pos = os.fstat(f.fileno()).st_size if end is None else end
+            buf = b''
+            while True:
+                size = min(LOG_READ_BLOCK, pos)
+                pos -= size
+                f.seek(pos)
+                buf = f.read(size) + buf
+                lines = buf.split(b'\n')
+                # Первая строка блока может начинаться в предыдущем блоке
+                buf = lines.pop(0) if pos > 0 else b''
+                offset = pos + len(buf) + (1 if pos > 0 else 0)
+                starts = []
+                for line in lines:
+                    starts.append(offset)
+                    offset += len(line) + 1
+                for line_start, line in zip(reversed(starts), reversed(lines)):
+                    if line:
+                        yield line_start, line
+                if pos == 0:
+                    return
+
+    @staticmethod
+    def _reverse_blocks(path: str, item: Dict, end: Optional[int], since: Optional[str],
+                        until: Optional[str]) -> Iterator[Tuple[int, bytes]]:
+        """Строки сжатого сегмента до исходного смещения end; распаковываются только нужные блоки"""
+        # Сегменты без индекса - один блок
+        index = item.get('index') or [[0, 0, item['first_ts']]]
+        with open(path, 'rb') as f:
+            for number in range(len(index) - 1, -1, -1):
+                compressed_at, offset, first_ts = index[number]
+                if end is not None and offset >= end:
+                    continue
+                next_ts = index[number + 1][2] if number + 1 < len(index) else item['last_ts']
+                if (until and first_ts and first_ts > until) or (since and next_ts and next_ts < since):
+                    continue
+                f.seek(compressed_at)
+                next_at = index[number + 1][0] if number + 1 < len(index) else None
+                data = gzip.decompress(f.read(next_at - compressed_at) if next_at else f.read())
+                lines, starts = data.split(b'\n'), []
+                for line in lines:
+                    starts.append(offset)
+                    offset += len(line) + 1
+                for line_start, line in zip(reversed(starts), reversed(lines)):
+                    if line and (end is None or line_start < end):
+                        yield line_start, line
+
+
+class LogPage:
+    """
+    Страница журнала от новых записей к старым с фильтрами. Записи
+    отдаются по мере чтения (память не зависит от размера журнала),
+    next_cursor - курсор следующей страницы, известен после обхода
+    (None - записей больше нет).
+    """
+
+    def __init__(self, segments: LogSegments, cursor: Optional[str] = None, limit: int = LOG_PAGE_SIZE,
+                 since: Optional[str] = None, until: Optional[str] = None, template_id: Optional[str] = None,
+                 field_id: Optional[str] = None, success: Optional[bool] = None):
+        self.segments = segments
+        self.cursor = cursor
+        self.limit = max(1, min(limit, LOG_MAX_PAGE_SIZE))
+        self.since = since
+        self.until = until
+        self.template_id = template_id
+        self.field_id = field_id
+        self.success = success
+        self.next_cursor: Optional[str] = None
+
+    def matches(self, entry: Dict) -> bool:
+        timestamp = entry.get('timestamp') or ''
+        if (self.since and timestamp < self.since) or (self.until and timestamp > self.until):
+            return False
+        if self.template_id is not None and str(entry.get('template_id')) != self.template_id:
+            return False
+        if self.field_id is not None and str(entry.get('field_id')) != self.field_id:
+            return False
+        return self.success is None or bool(entry.get('success')) == self.success
+
+    def __iter__(self) -> Iterator[Dict]:
+        count = scanned = 0
+        for entry, position in self.segments.iter_reverse(self.cursor, self.since, self.until):
+            scanned += 1
+            if self.matches(entry):
+                count += 1
+                yield entry
+            if count >= self.limit or scanned >= LOG_SCAN_LIMIT:
+                self.next_cursor = position
+                return
+
+
+class AILogWriter:
+    """Фоновая запись журнала AI проверок"""
+
+    def __init__(self, max_queue: int = LOG_QUEUE_SIZE):
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._fd_path: Optional[str] = None
+        self._synced_at = time.monotonic()
+        self._dirty = False
+        self._maintained_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def write(self, entry: Dict) -> bool:
+        """Поставить запись в очередь (не блокирует); False - очередь полна, запись потеряна"""
+        self.start()
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ai-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Дождаться записи всего, что уже в очереди (тесты, остановка процесса)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def stats(self) -> Dict:
+        """Счетчики журнала (для /api/ai/status)"""
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=LOG_FSYNC_INTERVAL)]
+            except queue.Empty:
+                # Записей больше нет - последняя пачка не должна ждать fsync до следующей
+                self._sync()
+                self._maintain()
+                continue
+            # Записи, пришедшие за LOG_FLUSH_INTERVAL, уходят той же пачкой
+            flush_at = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                wait = flush_at - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=wait))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Ошибка записи журнала AI ({len(batch)} записей потеряно): {e}")
+                self._close()
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            self._maintain()
+
+    def _maintain(self):
+        """Сжатие и удаление сегментов - не чаще раза в LOG_MAINTENANCE_INTERVAL"""
+        if time.monotonic() - self._maintained_at < LOG_MAINTENANCE_INTERVAL:
+            return
+        self._maintained_at = time.monotonic()
+        try:
+            LogSegments(ai_log_path()).maintain()
+        except Exception as e:
+            print(f"⚠️ Ошибка обслуживания сегментов журнала AI: {e}")
+
+    def _write_batch(self, batch):
+        data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in batch).encode('utf-8')
+        fd = self._open(ai_log_path())
+        # O_APPEND: каждый write() целиком дописывается в конец файла
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+        self.written += len(batch)
+        self._dirty = True
+
+        if time.monotonic() - self._synced_at >= LOG_FSYNC_INTERVAL:
+            self._sync()
+
+    def _sync(self):
+        if self._fd is not None and self._dirty:
+            try:
+                os.fsync(self._fd)
+            except OSError as e:
+                print(f"⚠️ Ошибка fsync журнала AI: {e}")
+            self._dirty = False
+        self._synced_at = time.monotonic()
+
+    def _open(self, path: str) -> int:
+        """
+        Дескриптор журнала; файл переоткрывается, если его повернул
+        этот или другой воркер, переименовали или удалили
+        """
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        if current is not None and LogSegments.needs_rotation(current):
+            LogSegments(path).rotate()
+            current = None
+        if self._fd is not None and self._fd_path == path and current is not None:
+            opened = os.fstat(self._fd)
+            if (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                return self._fd
+        self._close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fd_path = path
+        return self._fd
+
+    def _close(self):
+        if self._fd is None:
+            return
+        try:
+            if self._dirty:
+                os.fsync(self._fd)
+            os.close(self._fd)
+        except OSError:
+            pass
+        self._fd, self._fd_path, self._dirty = None, None, False
+
+
+# Глобальный журнал процесса
+ai_log_writer = AILogWriter()
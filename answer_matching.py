@@ -0,0 +1,244 @@
+"""
+Локальная (без AI) проверка ответов учеников
+
+Этапы 1-4 каскада check_answers: точное совпадение, сравнение чисел
+(numeric_answers.py), начало строки и допуск опечаток. Этап 4.5 -
+морфология и синонимы (morphology.py). Поля шаблона компилируются
+один раз и кэшируются до изменения файла шаблона или словаря синонимов;
+для полей с большим списком вариантов строится индекс триграмм.
+
+Группы синонимов по умолчанию действуют во всех полях. Ключ "synonyms"
+поля (или шаблона - для всех его полей) ограничивает их: false отключает
+синонимы, список имен групп оставляет только эти группы.
+Используется при проверке ответов и при предварительной проверке шаблона.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from morphology import normalize_key, synonyms
+from numeric_answers import numbers_equal, parse_number, parse_tolerance
+
+
+def calculate_similarity(s1, s2):
+    """
+    Вычисляет схожесть двух строк (расстояние Левенштейна)
+    Возвращает значение от 0 до 1, где 1 - полное совпадение
+    """
+    if s1 == s2:
+        return 1.0
+
+    len1, len2 = len(s1), len(s2)
+    if len1 == 0 or len2 == 0:
+        return 0.0
+
+    # Матрица расстояний
+    matrix = [[0] * (len2 + 1) for _ in range(len1 + 1)]
+
+    for i in range(len1 + 1):
+        matrix[i][0] = i
+    for j in range(len2 + 1):
+        matrix[0][j] = j
+
+    for i in range(1, len1 + 1):
+        for j in range(1, len2 + 1):
+            cost = 0 if s1[i-1] == s2[j-1] else 1
+            matrix[i][j] = min(
+                matrix[i-1][j] + 1,      # удаление
+                matrix[i][j-1] + 1,      # вставка
+                matrix[i-1][j-1] + cost  # замена
+            )
+
+    distance = matrix[len1][len2]
+    max_len = max(len1, len2)
+    similarity = 1 - (distance / max_len)
+
+    return similarity
+
+
+# Индекс триграмм строится для полей, где вариантов не меньше порога;
+# до расстояния Левенштейна доходят только лучшие кандидаты по общим триграммам
+NGRAM_SIZE = 3
+NGRAM_INDEX_MIN_VARIANTS = 8
+NGRAM_CANDIDATES = 5
+# Этап 4: ответ длиннее 3 символов засчитывается при схожести с вариантом выше порога
+TYPO_MIN_LENGTH = 3
+TYPO_SIMILARITY = 0.85
+
+
+def ngrams(text: str) -> Set[str]:
+    """Триграммы строки с границами слова"""
+    padded = ' ' * (NGRAM_SIZE - 1) + text + ' '
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+def allowed_synonym_groups(setting) -> Optional[Set[str]]:
+    """Группы синонимов, разрешенные настройкой "synonyms" (None - все)"""
+    if setting is None or setting is True:
+        return None
+    if isinstance(setting, (list, tuple, set)):
+        return {str(name) for name in setting}
+    return set()
+
+
+class CompiledField:
+    """Поле шаблона, подготовленное для локальной проверки"""
+
+    def __init__(self, field: Dict, default_synonyms=None):
+        self.field = field
+        self.correct_variants = [v.strip().lower() for v in field.get('variants', [])]
+        # Ответы, которые учитель отклонил (из выученных вердиктов AI)
+        self.rejected_variants = {v.strip().lower() for v in field.get('rejected_variants', [])}
+
+        self.variant_keys = {normalize_key(v) for v in self.correct_variants} - {''}
+        self.rejected_keys = {normalize_key(v) for v in self.rejected_variants} - {''}
+        self.variant_groups = {synonyms.group_of(key) for key in self.variant_keys} - {None}
+        allowed_groups = allowed_synonym_groups(field.get('synonyms', default_synonyms))
+        if allowed_groups is not None:
+            self.variant_groups &= allowed_groups
+        self.opposite_groups = set()
+        for group in self.variant_groups:
+            self.opposite_groups |= synonyms.opposites_of(group)
+        self.opposite_groups -= self.variant_groups
+
+        # Числовые варианты и допуск поля ("tolerance": 0.01 или "1%")
+        self.numeric_variants = [n for n in map(parse_number, self.correct_variants) if n]
+        self.numeric_only = len(self.numeric_variants) == len(self.correct_variants)
+        self.tolerance = parse_tolerance(field.get('tolerance'))
+
+        # Отсортированные варианты - поиск по началу строки бинарным поиском
+        self.sorted_variants = sorted(set(self.correct_variants))
+        self.ngram_index: Dict[str, List[int]] = {}
+        if len(self.correct_variants) >= NGRAM_INDEX_MIN_VARIANTS:
+            for position, variant in enumerate(self.correct_variants):
+                for gram in ngrams(variant):
+                    self.ngram_index.setdefault(gram, []).append(position)
+
+    def _is_prefix(self, text: str) -> bool:
+        """Есть ли вариант, начинающийся с text"""
+        position = bisect_left(self.sorted_variants, text)
+        return position < len(self.sorted_variants) and self.sorted_variants[position].startswith(text)
+
+    def _similarity_candidates(self, text: str) -> List[str]:
+        """Варианты для сравнения по Левенштейну: все или лучшие по индексу"""
+        if not self.ngram_index:
+            return self.correct_variants
+        shared = Counter()
+        for gram in ngrams(text):
+            for position in self.ngram_index.get(gram, ()):
+                shared[position] += 1
+        return [self.correct_variants[position] for position, _ in shared.most_common(NGRAM_CANDIDATES)]
+
+    def closest_variant(self, student_answer: str) -> Optional[Tuple[str, float]]:
+        """Ближайший правильный вариант и его схожесть (подсказка в результатах)"""
+        text = student_answer.strip().lower()
+        if not text:
+            return None
+        scored = [(calculate_similarity(text, variant), variant)
+                  for variant in self._similarity_candidates(text)]
+        if not scored:
+            return None
+        similarity, variant = max(scored)
+        return variant, round(similarity, 3)
+
+    def match(self, student_answer: str) -> Optional[Tuple[bool, str]]:
+        """Проверить ответ без AI: (is_correct, check_method) или None"""
+        if not self.correct_variants:
+            return None
+
+        student_answer_lower = student_answer.lower()
+
+        # 1. Точное совпадение (без учета регистра)
+        if student_answer_lower in self.correct_variants:
+            return True, "exact"
+
+        # 1.1. Ответ в списке отклоненных учителем - неверно без AI
+        if student_answer_lower in self.rejected_variants:
+            return False, "exact_reject"
+
+        # 2. Сравнение чисел ("3,50" = "3.5" = "7/2", но "35" != "3.5")
+        if self.numeric_variants:
+            student_number = parse_number(student_answer)
+            if student_number:
+                verdicts = [numbers_equal(student_number, variant, self.tolerance)
+                            for variant in self.numeric_variants]
+                if any(verdicts):
+                    return True, "numeric"
+                # Все варианты - числа в сопоставимых единицах: ответ неверен без AI
+                if self.numeric_only and None not in verdicts:
+                    return False, "numeric_mismatch"
+                if self.numeric_only:
+                    # Единицы не совпали ("5 м" и "500 см") - решает AI,
+                    # текстовые этапы для чисел дали бы ложное совпадение
+                    return None
+
+        # 3. Проверка начала строки (если ответ студента - начало правильного)
+        if len(student_answer) >= 3 and self._is_prefix(student_answer_lower):
+            return True, "partial_match"
+
+        # 4. Проверка с допуском опечаток (расстояние Левенштейна)
+        if len(student_answer) > TYPO_MIN_LENGTH and any(
+            calculate_similarity(student_answer_lower, variant) > TYPO_SIMILARITY
+            for variant in self._similarity_candidates(student_answer_lower)
+        ):
+            return True, "similarity_85"
+
+        # 4.5. Морфология и синонимы
+        key = normalize_key(student_answer)
+        if not key:
+            return None
+        if key in self.variant_keys:
+            return True, "morphology"
+        if key in self.rejected_keys:
+            return False, "morphology_reject"
+
+        group = synonyms.group_of(key)
+        if group in self.variant_groups:
+            return True, "synonym"
+        if group in self.opposite_groups:
+            return False, "synonym_reject"
+
+        return None
+
+
+class CompiledTemplate:
+    """Скомпилированные поля шаблона по field_id"""
+
+    def __init__(self, template: Dict):
+        default_synonyms = template.get('synonyms')
+        self.fields = {
+            field.get('id'): CompiledField(field, default_synonyms) for field in template.get('fields', [])
+        }
+
+    def field(self, field_id: str) -> Optional[CompiledField]:
+        return self.fields.get(field_id)
+
+
+_compiled_cache: Dict[str, Tuple[tuple, CompiledTemplate]] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_template(template_path: str, template: Dict) -> CompiledTemplate:
+    """
+    Скомпилированный шаблон из кэша процесса.
+
+    Запись действительна, пока не изменились файл шаблона и словарь синонимов.
+    """
+    synonyms.refresh()
+    try:
+        mtime = os.stat(template_path).st_mtime_ns
+    except OSError:
+        mtime = None
+    version = (mtime, synonyms.version)
+
+    cached = _compiled_cache.get(template_path)
+    if cached and cached[0] == version and mtime is not None:
+        return cached[1]
+
+    compiled = CompiledTemplate(template)
+    with _compiled_lock:
+        _compiled_cache[template_path] = (version, compiled)
+    return compiled
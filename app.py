@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect, url_for, g
+import contextvars
 import os
 import json
 import uuid
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 import fitz
 import gspread
@@ -10,7 +14,19 @@ from datetime import datetime
 import re
 from config import Config
 from auth_utils import auth_manager, login_required
-from ai_checker import AIAnswerChecker
+from checker_registry import checker_registry
+from learned_variants import learned_store
+from answer_matching import get_compiled_template
+from pregrader import PreGrader
+from circuit_breaker import circuit_breaker
+from provider_health import provider_health
+from regrade_queue import regrade_queue, RegradeWorker, PENDING_RECOVERY_DELAY
+from settings_watch import settings_watcher
+from grading_analytics import grading_analytics, field_event
+from ai_log import ai_log_writer, ai_log_path, latency_percentiles, LogPage, LogSegments, LOG_PAGE_SIZE
+from deadline import deadline_after, remaining, MIN_AI_BUDGET, MIN_SHEETS_BUDGET
+from submissions import (submission_store, summarize_details, SUBMISSION_POLL_INTERVAL,
+                         SUBMISSION_STREAM_TIMEOUT)
 from dataclasses import asdict
 from flask import send_from_directory
 
@@ -20,9 +36,40 @@ checker = None
 try:
     from ai_cache import cache_manager
     CACHE_MANAGER_AVAILABLE = True
+    # Фоновое обслуживание кэша: счетчики статистики и удаление устаревших записей
+    cache_manager.start_maintenance()
 except ImportError:
     CACHE_MANAGER_AVAILABLE = False
 
+def build_ai_checker(settings=None):
+    """
+    Проверщик по цепочке провайдеров AIConfig.PROVIDER_CHAIN.
+    Провайдеры без API ключа пропускаются; без единого ключа - ValueError.
+    Проверщики провайдеров берутся из checker_registry (общие HTTP сессии).
+    """
+    from ai_config import AIConfig
+    settings = settings or AIConfig.current()
+    
+    def create(provider):
+        api_key = settings.GEMINI_API_KEY if provider == 'gemini' else settings.PROVIDER_API_KEYS.get(provider)
+        model = settings.GEMINI_MODEL if provider == 'gemini' else None
+        try:
+            return checker_registry.get(provider, api_key, model)
+        except ValueError as e:
+            print(f"⚠️ Провайдер {provider} пропущен: {e}")
+            return None
+    
+    chain = settings.PROVIDER_CHAIN or ['gemini']
+    checkers = [c for c in map(create, chain) if c]
+    if not checkers:
+        raise ValueError("Ни для одного AI провайдера не настроен API ключ")
+    
+    # Провайдеры, которые есть только в каскаде моделей
+    cascade_only = {level.get('provider', '').lower() for level in settings.MODEL_CASCADE or []} - set(chain) - {''}
+    
+    return checkers[0].with_chain(checkers[1:], [c for c in map(create, sorted(cascade_only)) if c])
+
+
 # Функция для получения checker
 def get_ai_checker():
     """
@@ -30,18 +77,15 @@ def get_ai_checker():
     с актуальным API ключом и моделью из конфигурации.
     """
     global checker, AI_AVAILABLE
-    from ai_config import AIConfig
-
-    # Принудительно загружаем самые свежие настройки из файла
-    AIConfig.load_from_file()
     
     # Если checker уже создан, возвращаем его
     if checker is not None:
+        checker_registry.touch(checker)
         return checker
     
     try:
         # Создаем новый экземпляр только если его нет
-        checker = AIAnswerChecker(provider="gemini", api_key=AIConfig.GEMINI_API_KEY)
+        checker = build_ai_checker()
         AI_AVAILABLE = True
     except (ValueError, Exception) as e:
         checker = None
@@ -49,6 +93,25 @@ def get_ai_checker():
         # Не выводим ошибку здесь, чтобы не спамить в консоль при каждом запросе
         
     return checker
+
+
+def rebuild_ai_checker(settings):
+    """
+    Пересоздать checker под новые настройки (ключ, модель, цепочка провайдеров).
+    Вызывается потоком settings_watcher; запросы до замены работают со старым.
+    Проверщики, которых нет в новой цепочке, уходят из реестра.
+    """
+    global checker, AI_AVAILABLE
+    try:
+        new_checker = build_ai_checker(settings)
+    except ValueError as e:
+        print(f"⚠️ AI checker недоступен с новыми настройками: {e}")
+        new_checker = None
+    checker, AI_AVAILABLE = new_checker, new_checker is not None
+    if new_checker is not None:
+        checker_registry.retain([new_checker] + new_checker.fallback_providers + new_checker.cascade_checkers)
+    else:
+        checker_registry.retain([])
     
 
 app = Flask(__name__)
@@ -57,9 +120,57 @@ app.secret_key = app.config['SECRET_KEY']
 
 Config.create_directories()
 # Дополнительно создаем папку для логов, если ее нет
-# Загружаем настройки AI при старте, чтобы ключ был доступен
+# Настройки AI читаются из снимка AIConfig.current() (ai_config.py)
 from ai_config import AIConfig
-AIConfig.load_from_file()
+
+# Изменения ai_settings.json (в том числе из других воркеров) применяются в фоне
+settings_watcher.subscribe(rebuild_ai_checker)
+settings_watcher.start()
+
+# Фоновая предварительная проверка шаблонов (pregrader.py)
+pregrader = PreGrader(get_ai_checker)
+# Фоновые AI проверки асинхронного режима /check_answers
+grading_workers = int(AIConfig.current().ASYNC_GRADING_WORKERS)
+grading_executor = ThreadPoolExecutor(max_workers=grading_workers, thread_name_prefix='ai-grading')
+grading_executor_lock = threading.Lock()
+
+
+def resize_grading_executor(settings):
+    """
+    Новый пул фоновых проверок при изменении ASYNC_GRADING_WORKERS.
+    Вызывается потоком settings_watcher; старый пул доделывает принятые задачи.
+    """
+    global grading_executor, grading_workers
+    workers = int(settings.ASYNC_GRADING_WORKERS)
+    with grading_executor_lock:
+        if workers < 1 or workers == grading_workers:
+            return
+        previous, grading_workers = grading_executor, workers
+        grading_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai-grading')
+    previous.shutdown(wait=False)
+    print(f"🔄 Потоков фоновой проверки: {workers}")
+
+
+settings_watcher.subscribe(resize_grading_executor)
+
+
+def submit_grading(fn, *args, **kwargs):
+    """Фоновая задача работы ученика - с тем же снимком настроек, что и запрос"""
+    with grading_executor_lock:
+        return grading_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+@app.before_request
+def pin_ai_settings():
+    # Все обращения к настройкам за время запроса видят один снимок
+    g.ai_settings_token = AIConfig.pin()
+
+
+@app.teardown_request
+def unpin_ai_settings(exc=None):
+    token = g.pop('ai_settings_token', None)
+    if token is not None:
+        AIConfig.unpin(token)
 
 #LOGS_DIR = os.path.join(Config.BASE_DIR, 'logs')
 #if not os.path.exists(LOGS_DIR):
@@ -164,19 +275,43 @@ def ai_settings():
             else:
                 # Настройки по умолчанию из ai_config.py
                 from ai_config import AIConfig
+                defaults = AIConfig.current()
                 settings = {
-                    'ai_enabled': AIConfig.AI_CHECKING_ENABLED,
-                    'similarity_threshold': AIConfig.SIMILARITY_THRESHOLD,
+                    'ai_enabled': defaults.AI_CHECKING_ENABLED,
+                    'similarity_threshold': defaults.SIMILARITY_THRESHOLD,
                     'api_key': 'YOUR_API_KEY_HERE',
-                    'ai_model': AIConfig.GEMINI_MODEL,
-                    'temperature': AIConfig.GENERATION_CONFIG['temperature'],
-                    'max_tokens': AIConfig.GENERATION_CONFIG['max_output_tokens'],
-                    'top_p': AIConfig.GENERATION_CONFIG['top_p'],
-                    'system_prompt': AIConfig.SYSTEM_PROMPT,
-                    'cache_enabled': AIConfig.CACHE_AI_RESPONSES,
-                    'cache_duration': AIConfig.CACHE_DURATION,
-                    'logging_enabled': AIConfig.LOG_AI_REQUESTS,
-                    'log_file': AIConfig.AI_LOG_FILE
+                    'ai_model': defaults.GEMINI_MODEL,
+                    'temperature': defaults.GENERATION_CONFIG['temperature'],
+                    'max_tokens': defaults.GENERATION_CONFIG['max_output_tokens'],
+                    'top_p': defaults.GENERATION_CONFIG['top_p'],
+                    'system_prompt': defaults.SYSTEM_PROMPT,
+                    'cache_enabled': defaults.CACHE_AI_RESPONSES,
+                    'cache_duration': defaults.CACHE_DURATION,
+                    'cache_negative_ttl': defaults.CACHE_NEGATIVE_TTL,
+                    'cache_min_confidence': defaults.CACHE_MIN_CONFIDENCE,
+                    'pregrade_enabled': defaults.PREGRADE_ENABLED,
+                    'pregrade_rate_per_minute': defaults.PREGRADE_RATE_PER_MINUTE,
+                    'pregrade_max_per_field': defaults.PREGRADE_MAX_PER_FIELD,
+                    'pregrade_cache_ttl': defaults.PREGRADE_CACHE_TTL,
+                    'closest_variant_hint': defaults.CLOSEST_VARIANT_HINT,
+                    'structured_output': defaults.GEMINI_STRUCTURED_OUTPUT,
+                    'async_grading': defaults.ASYNC_AI_GRADING,
+                    'async_grading_workers': defaults.ASYNC_GRADING_WORKERS,
+                    'regrade_enabled': defaults.REGRADE_ENABLED,
+                    'regrade_rate_per_minute': defaults.REGRADE_RATE_PER_MINUTE,
+                    'regrade_max_attempts': defaults.REGRADE_MAX_ATTEMPTS,
+                    'submission_deadline': defaults.SUBMISSION_DEADLINE,
+                    'provider_chain': defaults.PROVIDER_CHAIN,
+                    'provider_api_keys': defaults.PROVIDER_API_KEYS,
+                    'hedge_enabled': defaults.HEDGE_ENABLED,
+                    'hedge_min_samples': defaults.HEDGE_MIN_SAMPLES,
+                    'model_cascade': defaults.MODEL_CASCADE,
+                    'cascade_min_confidence': defaults.CASCADE_MIN_CONFIDENCE,
+                    'breaker_failure_threshold': defaults.BREAKER_FAILURE_THRESHOLD,
+                    'breaker_window': defaults.BREAKER_WINDOW,
+                    'breaker_cooldown': defaults.BREAKER_COOLDOWN,
+                    'logging_enabled': defaults.LOG_AI_REQUESTS,
+                    'log_file': defaults.AI_LOG_FILE
                 }
             
             return jsonify({'success': True, 'config': settings})
@@ -189,27 +324,17 @@ def ai_settings():
         try:
             settings = request.get_json()
             
-            # Сохраняем в файл
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
+            # Ключи, которых нет в форме настроек, сохраняются из текущего файла
+            if os.path.exists(settings_file):
+                with open(settings_file, 'r', encoding='utf-8') as f:
+                    settings = {**json.load(f), **settings}
             
-            # Обновляем конфигурацию в памяти
+            # Сохраняем в файл; следующие запросы получат новый снимок настроек
             from ai_config import AIConfig
-            AIConfig.AI_CHECKING_ENABLED = settings.get('ai_enabled', True)
-            AIConfig.SIMILARITY_THRESHOLD = settings.get('similarity_threshold', 0.8)
-            
-            if settings.get('api_key') and not settings['api_key'].startswith('***'):
-                AIConfig.GEMINI_API_KEY = settings['api_key']
-            
-            AIConfig.GEMINI_MODEL = settings.get('ai_model', 'gemini-pro')
-            AIConfig.GENERATION_CONFIG['temperature'] = settings.get('temperature', 0.1)
-            AIConfig.GENERATION_CONFIG['max_output_tokens'] = settings.get('max_tokens', 200)
-            AIConfig.GENERATION_CONFIG['top_p'] = settings.get('top_p', 0.95)
-            AIConfig.SYSTEM_PROMPT = settings.get('system_prompt', AIConfig.SYSTEM_PROMPT)
-            AIConfig.CACHE_AI_RESPONSES = settings.get('cache_enabled', True)
-            AIConfig.CACHE_DURATION = settings.get('cache_duration', 3600)
-            AIConfig.LOG_AI_REQUESTS = settings.get('logging_enabled', True)
-            AIConfig.AI_LOG_FILE = settings.get('log_file', 'logs/ai_checks.log')
+            if not AIConfig.save_to_file(settings):
+                return jsonify({'success': False, 'error': 'Не удалось сохранить настройки'}), 500
+            # Остальные воркеры перечитают файл сразу (без PostgreSQL - по mtime)
+            settings_watcher.publish()
             
             return jsonify({'success': True, 'message': 'Настройки сохранены'})
         
@@ -220,9 +345,8 @@ def ai_settings():
 @login_required
 def test_ai():
     """Тестирование AI проверки"""
-    global checker
-    
     try:
+        checker = get_ai_checker()
         if not checker:
             return jsonify({
                 'success': False, 
@@ -298,12 +422,29 @@ def ai_status():
     """Статус AI системы"""
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
         status = {
             'available': AI_AVAILABLE,
-            'enabled': AIConfig.AI_CHECKING_ENABLED,
-            'api_key_configured': AIConfig.GEMINI_API_KEY != 'YOUR_API_KEY_HERE',
-            'model': AIConfig.GEMINI_MODEL
+            'enabled': settings.AI_CHECKING_ENABLED,
+            'api_key_configured': settings.GEMINI_API_KEY != 'YOUR_API_KEY_HERE',
+            'model': settings.GEMINI_MODEL,
+            # Состояние circuit breaker по провайдерам и моделям (общее для воркеров)
+            'circuit_breakers': circuit_breaker.status(),
+            'provider_chain': settings.PROVIDER_CHAIN,
+            # Версия снимка настроек и способ узнавать об их изменении (postgres / mtime)
+            'settings_version': settings.version,
+            'settings_watch': settings_watcher.mode,
+            # Прогретые проверщики воркера: провайдер, модель, отпечаток ключа, простой
+            'checkers': checker_registry.stats(),
+            # Журнал AI проверок: очередь записи и потерянные при переполнении записи
+            'ai_log': ai_log_writer.stats(),
+            # Аналитика проверки: очередь фоновой записи
+            'grading_analytics': grading_analytics.stats(),
+            # Доля успехов и задержки провайдеров в этом воркере
+            'provider_health': provider_health.snapshot(),
+            # Поля, ожидающие повторной AI проверки (общая очередь воркеров)
+            'regrade_queue': regrade_queue.stats()
         }
         
         if not status['available']:
@@ -326,6 +467,7 @@ def ai_stats():
     """Статистика AI проверок"""
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
         stats = {
             'total_checks': 0,
@@ -334,18 +476,29 @@ def ai_stats():
             'success_rate': 0
         }
         
-        # Читаем логи для статистики
-        if os.path.exists(AIConfig.AI_LOG_FILE):
-            with open(AIConfig.AI_LOG_FILE, 'r', encoding='utf-8') as f:
-                logs = [json.loads(line) for line in f if line.strip()]
-                
-                stats['total_checks'] = len(logs)
-                stats['ai_checks'] = len(logs)  # Все записи в логах - это AI проверки
-                
-                if logs:
-                    success_count = sum(1 for log in logs if log.get('success'))
-                    stats['success_rate'] = round((success_count / len(logs)) * 100, 1)
+        # Сводки сегментов и дочитанного текущего файла - без разбора всего журнала
+        summary = LogSegments(ai_log_path(settings)).summary()
+        stats['total_checks'] = summary['total']
+        stats['ai_checks'] = summary['total']  # Все записи в логах - это AI проверки
+        stats['log_segments'] = summary['segments']
+        stats['ai_correct'] = summary['ai_correct']
+        stats['providers'] = summary['providers']
+        stats['models'] = summary.get('models', {})
+        # Перцентили задержки AI проверки поля, мс (по гистограмме сводок)
+        stats['latency_ms'] = latency_percentiles(summary.get('latency_ms', {}))
+        if summary['total']:
+            stats['success_rate'] = round((summary['success'] / summary['total']) * 100, 1)
         
+        # Статистика кэша - из счетчиков, без сканирования таблицы
+        if CACHE_MANAGER_AVAILABLE:
+            cache_stats = cache_manager.get_cache_stats()
+            stats['cache_size'] = cache_stats['valid_entries']
+            stats['cache_total_entries'] = cache_stats['total_entries']
+            stats['cache_valid_entries'] = cache_stats['valid_entries']
+            stats['cache_total_usage'] = cache_stats['total_usage']
+            stats['cache_avg_confidence'] = cache_stats['avg_confidence']
+            stats['cache_hit_ratio'] = cache_stats['hit_ratio']
+            stats['cache_bytes_stored'] = cache_stats['bytes_stored']
         
         return jsonify({'success': True, **stats})
     
@@ -356,21 +509,38 @@ def ai_stats():
 @app.route('/api/ai/logs')
 @login_required
 def ai_logs():
-    """Получение логов AI"""
+    """
+    Логи AI от новых к старым, постранично: ?cursor= (next_cursor прошлой
+    страницы), limit, template_id, field_id, success, since/until (ISO время)
+    """
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
-        logs = []
-        if os.path.exists(AIConfig.AI_LOG_FILE):
-            with open(AIConfig.AI_LOG_FILE, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        try:
-                            logs.append(json.loads(line))
-                        except:
-                            continue
+        success = request.args.get('success')
+        page = LogPage(
+            LogSegments(ai_log_path(settings)),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', LOG_PAGE_SIZE, type=int),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            template_id=request.args.get('template_id'),
+            field_id=request.args.get('field_id'),
+            success=None if success in (None, '') else success.lower() in ('1', 'true', 'yes')
+        )
         
-        return jsonify({'success': True, 'logs': logs})
+        def generate():
+            # Записи уходят клиенту по мере чтения, страница целиком в памяти не собирается
+            yield '{"success": true, "logs": ['
+            try:
+                for number, entry in enumerate(page):
+                    yield (', ' if number else '') + json.dumps(entry, ensure_ascii=False)
+                yield '], "next_cursor": ' + json.dumps(page.next_cursor) + '}'
+            except Exception as e:
+                print(f"⚠️ Ошибка чтения логов AI: {e}")
+                yield '], "next_cursor": null, "error": ' + json.dumps(str(e), ensure_ascii=False) + '}'
+        
+        return app.response_class(generate(), mimetype='application/json; charset=utf-8')
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -382,22 +552,78 @@ def clear_ai_logs():
     """Очистка логов AI"""
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
-        if os.path.exists(AIConfig.AI_LOG_FILE):
-            # Создаем бэкап перед очисткой
-            backup_file = AIConfig.AI_LOG_FILE + f'.backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            os.rename(AIConfig.AI_LOG_FILE, backup_file)
-            
-            # Создаем новый пустой файл
-            with open(AIConfig.AI_LOG_FILE, 'w', encoding='utf-8') as f:
-                pass
+        # Текущий файл становится сегментом; сегменты хранятся до срока хранения,
+        # но в статистику и просмотр больше не попадают
+        LogSegments(ai_log_path(settings)).clear()
         
-        return jsonify({'success': True, 'message': 'Логи очищены (создан бэкап)'})
+        return jsonify({'success': True, 'message': 'Логи очищены (прежние записи сохранены в архиве)'})
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/analytics/fields')
+@login_required
+def analytics_fields():
+    """
+    Поля, чаще всего уходящие в AI: доля вызовов AI и попаданий в кэш.
+    ?template_id, since/until (ISO время), limit
+    """
+    try:
+        args = request.args
+        return jsonify({
+            'success': True,
+            'summary': grading_analytics.summary(args.get('template_id'), args.get('since'), args.get('until')),
+            'fields': grading_analytics.field_report(args.get('template_id'), args.get('since'),
+                                                     args.get('until'), args.get('limit', 100, type=int))
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Неверный параметр: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/analytics/latency')
+@login_required
+def analytics_latency():
+    """
+    Распределение задержки AI проверки поля.
+    ?template_id, field_id, since/until, include_cache=1 - с ответами из кэша
+    """
+    try:
+        args = request.args
+        return jsonify({
+            'success': True,
+            'latency_ms': grading_analytics.latency_report(
+                args.get('template_id'), args.get('field_id'), args.get('since'), args.get('until'),
+                include_cache=args.get('include_cache', '').lower() in ('1', 'true', 'yes')
+            )
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Неверный параметр: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/analytics/disagreement')
+@login_required
+def analytics_disagreement():
+    """Расхождения уровней каскада моделей с итоговым вердиктом. ?template_id, since/until"""
+    try:
+        args = request.args
+        return jsonify({
+            'success': True,
+            'stages': grading_analytics.disagreement_report(args.get('template_id'), args.get('since'),
+                                                            args.get('until'))
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Неверный параметр: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/user/info')
 @login_required
 def user_info():
@@ -588,12 +814,63 @@ def save_template():
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
+        # Вероятные ответы учеников проверяются AI заранее, в фоне
+        settings = AIConfig.current()
+        if settings.PREGRADE_ENABLED and settings.AI_CHECKING_ENABLED:
+            pregrader.schedule(data['template_id'])
+
         return jsonify({'success': True, 'template_id': data['template_id']})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 
+@app.route('/api/templates/<template_id>/learned')
+@login_required
+def learned_variants_list(template_id):
+    """Выученные вердикты AI по шаблону (?status=pending|approved|rejected|dismissed|all)"""
+    try:
+        template_id = secure_filename(template_id)
+        status = request.args.get('status', 'pending')
+        variants = learned_store.list_variants(template_id, status=None if status == 'all' else status)
+        return jsonify({'success': True, 'variants': variants})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/templates/<template_id>/learned/approve', methods=['POST'])
+@login_required
+def learned_variants_approve(template_id):
+    """
+    Пакетное одобрение выученных вердиктов.
+    
+    Тело запроса: {"decisions": [{"field_id", "answer", "action"}]}
+    или {"approve_all": true, "min_confidence": 0.9} - согласиться с AI
+    по всем ожидающим ответам с уверенностью не ниже порога.
+    """
+    try:
+        template_id = secure_filename(template_id)
+        data = request.get_json() or {}
+        
+        decisions = data.get('decisions', [])
+        if data.get('approve_all'):
+            min_confidence = float(data.get('min_confidence', 0))
+            decisions = [
+                {'field_id': item['field_id'], 'answer': item['answer'], 'action': 'approve'}
+                for item in learned_store.list_variants(template_id)
+                if item['avg_confidence'] >= min_confidence
+            ]
+        
+        summary = learned_store.apply_decisions(template_id, decisions)
+        return jsonify({'success': True, **summary})
+    
+    except FileNotFoundError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/list_templates')
 def list_templates():
     """
@@ -621,51 +898,487 @@ def list_templates():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def calculate_similarity(s1, s2):
+# Замените маршрут /check_answers в app.py на этот код:
+
+# Замените функцию check_answers в app.py на эту версию:
+
+def write_ai_log(log_entry):
+    """Дописать запись в лог AI проверок (в фоне, см. ai_log.py)"""
+    ai_log_writer.write(log_entry)
+
+
+def check_field_with_ai(ai_checker, template_id, question_number, field_id, student_answer, correct_variants,
+                        deadline=None):
+    """
+    AI проверка одного поля (шаг 5 check_answers).
+    Возвращает поля вердикта для детали результата; если AI не успел
+    в бюджет времени deadline - вердикт "pending" (поле проверяется в фоне).
+    """
+    from ai_config import AIConfig
+    settings = AIConfig.current()
+    question_context = correct_variants[0] if correct_variants else ""
+    started_at = time.monotonic()
+    
+    try:
+        print(f"🤖 AI проверка для поля {field_id}:")
+        print(f"   Ответ студента: '{student_answer}'")
+        print(f"   Правильные варианты: {correct_variants}")
+        
+        check_result = ai_checker.check_answer(
+            student_answer=student_answer,
+            correct_variants=correct_variants,
+            question_context=question_context,
+            system_prompt=settings.SYSTEM_PROMPT,
+            model_name=settings.GEMINI_MODEL,
+            deadline=deadline
+        )
+        latency_ms = round((time.monotonic() - started_at) * 1000, 1)
+        
+        result_dict = asdict(check_result)
+        
+        print(f"   ✅ Результат: {result_dict}")
+        
+        # Сведения о вызове AI для аналитики проверки (клиенту не отдаются)
+        ai_call = {
+            "from_cache": result_dict.get('from_cache', False),
+            "latency_ms": latency_ms,
+            "ai_provider": result_dict.get('ai_provider'),
+            # Модель, чей вердикт принят (уровень каскада или основная)
+            "ai_model": next((level['model'] for level in result_dict.get('cascade') or []
+                              if level.get('accepted')), settings.GEMINI_MODEL),
+            "cascade": result_dict.get('cascade')
+        }
+        
+        if result_dict.get('ai_provider') == 'fallback' and deadline and deadline.expired():
+            print(f"   ⏱️ Лимит времени исчерпан, поле {field_id} проверяется в фоне")
+            return {"check_method": "pending", "ai_call": ai_call}
+        
+        is_correct = result_dict.get('is_correct', False)
+        ai_confidence = result_dict.get('confidence', 0.0)
+        
+        # КРИТИЧНО: Получаем explanation с правильной кодировкой
+        ai_explanation = result_dict.get('explanation', 'Нет объяснения от AI')
+
+        # Убеждаемся что explanation в UTF-8
+        try:
+            if isinstance(ai_explanation, bytes):
+                ai_explanation = ai_explanation.decode('utf-8')
+        except UnicodeDecodeError:
+            ai_explanation = "Не удалось декодировать объяснение"
+
+        # Настоящий вердикт AI - кандидат в варианты шаблона
+        if result_dict.get('ai_provider') != 'fallback':
+            learned_store.record(template_id, field_id, student_answer,
+                                 is_correct, ai_confidence)
+
+        # === ЛОГИРОВАНИЕ AI ПРОВЕРКИ ===
+        if settings.LOG_AI_REQUESTS:
+            log_entry = {
+                "timestamp": datetime.now().isoformat(),
+                "template_id": template_id,
+                "field_id": field_id,
+                "question_number": question_number,
+                "student_answer": student_answer,
+                "correct_variants": correct_variants,
+                "question_context": question_context,
+                "ai_provider": result_dict.get('ai_provider', 'unknown'),
+                "ai_model": ai_call['ai_model'],
+                "latency_ms": latency_ms,
+                "is_correct": is_correct,
+                "confidence": ai_confidence,
+                "explanation": ai_explanation,
+                "success": True
+            }
+            if result_dict.get('usage'):
+                # Токены запроса к AI
+                log_entry["usage"] = result_dict['usage']
+            if result_dict.get('cascade'):
+                # Исходы уровней каскада моделей - для настройки порогов
+                log_entry["cascade"] = result_dict['cascade']
+            write_ai_log(log_entry)
+
+        verdict = {
+            "is_correct": is_correct,
+            "checked_by_ai": True,
+            "ai_confidence": ai_confidence,
+            "ai_explanation": ai_explanation,
+            "check_method": "ai",
+            "ai_call": ai_call
+        }
+        if result_dict.get('ai_provider') == 'fallback' and not is_correct and settings.REGRADE_ENABLED:
+            # AI не ответил - поле не засчитывается окончательно, а ждет перепроверки
+            verdict.update({
+                "check_method": "ai_deferred",
+                "ai_error": ai_explanation,
+                "ai_explanation": "AI временно недоступен, ответ будет перепроверен"
+            })
+        return verdict
+
+    except Exception as ai_err:
+        ai_error = str(ai_err)
+        print(f"⚠️ Ошибка AI проверки для поля {field_id}: {ai_err}")
+        
+        # Выводим полный traceback для отладки
+        import traceback
+        traceback.print_exc()
+        
+        latency_ms = round((time.monotonic() - started_at) * 1000, 1)
+        
+        # === ЛОГИРОВАНИЕ ОШИБКИ AI ===
+        if settings.LOG_AI_REQUESTS:
+            write_ai_log({
+                "timestamp": datetime.now().isoformat(),
+                "template_id": template_id,
+                "field_id": field_id,
+                "question_number": question_number,
+                "student_answer": student_answer,
+                "correct_variants": correct_variants,
+                "error": ai_error,
+                "error_traceback": traceback.format_exc(),
+                "latency_ms": latency_ms,
+                "success": False
+            })
+
+        return {
+            "is_correct": False,
+            "checked_by_ai": True,
+            "ai_confidence": 0.0,
+            "ai_explanation": f"Ошибка вызова AI: {ai_error}",
+            "check_method": "ai_deferred" if settings.REGRADE_ENABLED else "ai_error",
+            "ai_error": ai_error,
+            "ai_call": {"latency_ms": latency_ms}
+        }
+
+
+def build_field_detail(compiled_field, field_id, student_answer, verdict):
+    """Детальный результат поля для ответа /check_answers и потока SSE"""
+    from ai_config import AIConfig
+    settings = AIConfig.current()
+    checked_by_ai = verdict.get("checked_by_ai", False)
+    detail = {
+        "field_id": field_id,
+        "student_answer": student_answer,
+        "correct_variants": compiled_field.correct_variants,
+        "is_correct": verdict.get("is_correct", False),
+        "checked_by_ai": checked_by_ai,
+        "ai_confidence": verdict.get("ai_confidence", 0.0),
+        "ai_explanation": verdict.get("ai_explanation", "") if checked_by_ai else None,
+        "check_method": verdict.get("check_method", "none")
+    }
+    
+    if verdict.get("ai_error"):
+        detail["ai_error"] = verdict["ai_error"]
+    
+    if (settings.CLOSEST_VARIANT_HINT and not detail["is_correct"] and student_answer
+            and detail["check_method"] != "pending"):
+        closest = compiled_field.closest_variant(student_answer)
+        if closest:
+            detail["closest_variant"], detail["closest_similarity"] = closest
+    
+    return detail
+
+
+def build_question_headers(compiled_template, fields):
+    """Заголовки столбцов вопросов в Google Sheets"""
+    question_headers = []
+    for i, field in enumerate(fields):
+        correct_variants = compiled_template.field(field['id']).correct_variants
+        if correct_variants:
+            base_header = correct_variants[0]
+            clean_header = re.sub(r'[^\w\s\-а-яёА-ЯЁ]', '', base_header)
+            clean_header = clean_header[:30].strip()
+
+            if not clean_header:
+                clean_header = f"Вопрос {i+1}"
+
+            header = clean_header
+            if clean_header in question_headers:
+                header = f"{clean_header} ({i+1})"
+        else:
+            header = f"Вопрос {i+1}"
+
+        question_headers.append(header)
+    return question_headers
+
+
+# Таймаут запроса к Google Sheets при бюджете времени (без бюджета - без ограничения, как раньше)
+SHEETS_REQUEST_TIMEOUT = 30
+# Ответ ученику, когда строка записывается в таблицу в фоне
+DEFERRED_SHEETS_RESULT = {
+    "success": True,
+    "deferred": True,
+    "message": "Результаты будут сохранены в Google Таблицу в фоне."
+}
+
+
+def bound_sheets_timeout(client, deadline):
+    """Таймаут следующих запросов gspread - остаток бюджета проверки"""
+    if deadline:
+        client.set_timeout(deadline.timeout(SHEETS_REQUEST_TIMEOUT))
+
+
+def open_results_worksheet(sheet_url, template_name, deadline=None):
+    """Вкладка результатов шаблона в таблице учителя (создается при отсутствии)"""
+    creds_path = os.path.join(Config.CREDENTIALS_FOLDER, 'credentials.json')
+    if not os.path.exists(creds_path):
+        raise Exception("Файл credentials.json не найден")
+
+    creds = Credentials.from_service_account_file(
+        creds_path, 
+        scopes=Config.GOOGLE_SHEETS_SCOPES
+    )
+    client = gspread.authorize(creds)
+    bound_sheets_timeout(client, deadline)
+    sheet = client.open_by_url(sheet_url)
+
+    try:
+        return sheet.worksheet(template_name)
+    except gspread.WorksheetNotFound:
+        return sheet.add_worksheet(
+            title=template_name, 
+            rows=1000, 
+            cols=30
+        )
+
+
+def build_results_row(template_name, student_info, details, date_str, time_str):
+    """Строка результатов ученика: общие столбцы и ответы по вопросам"""
+    totals = summarize_details(details)
+    student_name = student_info.get("studentName") or student_info.get("name", "")
+    student_class = student_info.get("studentClass") or student_info.get("class", "")
+    
+    base_row_data = [
+        template_name,
+        student_name,
+        student_class,
+        date_str,
+        time_str,
+        totals["correct_count"],
+        totals["total_count"],
+        f"{totals['percentage']}%",
+        totals["ai_check_count"]
+    ]
+    return base_row_data + [detail["student_answer"] for detail in details]
+
+
+def write_results_to_sheets(sheet_url, template_name, student_info, question_headers, details,
+                            date_str, time_str, deadline=None):
+    """
+    Записать строку результатов ученика во вкладку шаблона.
+    Возвращает (результат для ответа, номер записанной строки или None).
+    """
+    try:
+        worksheet = open_results_worksheet(sheet_url, template_name, deadline)
+        bound_sheets_timeout(worksheet.client, deadline)
+        existing_data = worksheet.get_all_values()
+
+        base_headers = [
+            "Название шаблона",
+            "ФИО",
+            "Класс",
+            "Дата",
+            "Время",
+            "Правильных ответов",
+            "Всего вопросов",
+            "Процент",
+            "AI проверок"
+        ]
+
+        all_headers = base_headers + question_headers
+
+        if not existing_data or existing_data[0] != all_headers:
+            worksheet.clear()
+            worksheet.append_row(all_headers)
+
+        bound_sheets_timeout(worksheet.client, deadline)
+        response = worksheet.append_row(
+            build_results_row(template_name, student_info, details, date_str, time_str)
+        )
+
+        # Номер строки нужен, чтобы обновить ее после отложенной AI проверки
+        row_match = re.search(r'![A-Z]+(\d+)', (response or {}).get('updates', {}).get('updatedRange', ''))
+
+        return {
+            "success": True,
+            "message": f"Результаты сохранены во вкладку '{template_name}'."
+        }, int(row_match.group(1)) if row_match else None
+
+    except Exception as e:
+        return {
+            "success": False, 
+            "error": f"Ошибка Google Sheets: {str(e)}"
+        }, None
+
+
+def patch_sheets_row(state):
+    """Переписать строку ученика после отложенной AI проверки (если строка на месте)"""
+    if not state.get('sheet_url') or not state.get('sheet_row'):
+        return
+    row_data = build_results_row(state['template_name'], state['student_info'], state['details'],
+                                 state['submitted_date'], state['submitted_time'])
+    worksheet = open_results_worksheet(state['sheet_url'], state['template_name'])
+    # Вкладка могла быть очищена при смене вопросов - чужую строку не трогаем
+    if worksheet.row_values(state['sheet_row'])[1:5] != row_data[1:5]:
+        print(f"⚠️ Строка {state['sheet_row']} во вкладке '{state['template_name']}' изменилась, "
+              f"результат перепроверки не записан")
+        return
+    worksheet.update(range_name=f"A{state['sheet_row']}", values=[row_data])
+
+
+def create_submission(template_id, template_name, student_info, sheet_url, question_headers,
+                      details, pending):
+    """Сохранить работу для фоновой или отложенной AI проверки"""
+    submission_id = uuid.uuid4().hex
+    now = datetime.now()
+    submission_store.create(submission_id, {
+        "template_id": template_id,
+        "template_name": template_name,
+        "student_info": student_info,
+        "sheet_url": sheet_url,
+        "submitted_date": now.strftime("%d.%m.%Y"),
+        "submitted_time": now.strftime("%H:%M:%S"),
+        "question_headers": question_headers,
+        "details": details,
+        "pending": pending,
+        # Поля, отправленные в фоновую AI проверку - их вердикты идут в поток SSE
+        "ai_fields": list(pending),
+        "sheets_result": None,
+        "sheet_row": None,
+        "completed": False
+    })
+    return submission_id
+
+
+def grade_pending_field(submission_id, index, field_id, compiled_field, student_answer):
     """
-    Вычисляет схожесть двух строк (расстояние Левенштейна)
-    Возвращает значение от 0 до 1, где 1 - полное совпадение
+    Фоновая AI проверка поля асинхронной работы; последний вердикт записывает строку в Sheets.
+    Вызывается из grading_executor, а после перезапуска воркера - из очереди перепроверки.
     """
-    if s1 == s2:
-        return 1.0
+    state = submission_store.get(submission_id)
+    if state is None or index not in state.get('pending', []):
+        return
     
-    len1, len2 = len(s1), len(s2)
-    if len1 == 0 or len2 == 0:
-        return 0.0
+    try:
+        ai_checker = get_ai_checker()
+        if ai_checker:
+            verdict = check_field_with_ai(ai_checker, state['template_id'], index + 1,
+                                          field_id, student_answer, compiled_field.correct_variants)
+        else:
+            verdict = {"check_method": "none"}
+    except Exception as e:
+        print(f"❌ Ошибка фоновой проверки {submission_id}/{index}: {e}")
+        verdict = {"checked_by_ai": True, "check_method": "ai_error", "ai_error": str(e),
+                   "ai_explanation": f"Ошибка вызова AI: {e}"}
     
-    # Матрица расстояний
-    matrix = [[0] * (len2 + 1) for _ in range(len1 + 1)]
+    state = submission_store.complete_pending_field(
+        submission_id, index, build_field_detail(compiled_field, field_id, student_answer, verdict)
+    )
+    if state is None:
+        # Поле уже проверено другим путем - вердикт не записываем и не учитываем
+        return
+    grading_analytics.record([field_event(state['template_id'], field_id, 'background', verdict)])
+    # Страховочная задача больше не нужна; отложенный вердикт ставит поле в очередь заново
+    regrade_queue.cancel(submission_id, index)
+    if verdict.get("check_method") == "ai_deferred":
+        regrade_queue.enqueue(submission_id, index, verdict.get("ai_error", ""))
     
-    for i in range(len1 + 1):
-        matrix[i][0] = i
-    for j in range(len2 + 1):
-        matrix[0][j] = j
+    if not state['pending']:
+        finish_submission(submission_id, state)
+
+
+def finish_submission(submission_id, state, deadline=None):
+    """Все вердикты получены: запись в Google Sheets и отметка о завершении"""
+    sheets_result, sheet_row = None, None
+    if state.get('sheet_url'):
+        sheets_result, sheet_row = write_results_to_sheets(
+            state['sheet_url'], state['template_name'], state['student_info'],
+            state['question_headers'], state['details'],
+            state['submitted_date'], state['submitted_time'], deadline
+        )
     
-    for i in range(1, len1 + 1):
-        for j in range(1, len2 + 1):
-            cost = 0 if s1[i-1] == s2[j-1] else 1
-            matrix[i][j] = min(
-                matrix[i-1][j] + 1,      # удаление
-                matrix[i][j-1] + 1,      # вставка
-                matrix[i-1][j-1] + cost  # замена
-            )
+    def apply(current):
+        current['sheets_result'] = sheets_result
+        current['sheet_row'] = sheet_row
+        current['completed'] = True
+    return submission_store.update(submission_id, apply)
+
+
+def _load_compiled_field(template_id, field_id):
+    template_path = os.path.join(Config.TEMPLATES_FOLDER, f"{template_id}.json")
+    if not os.path.exists(template_path):
+        return None
+    with open(template_path, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    return get_compiled_template(template_path, template).field(field_id)
+
+
+def regrade_field(item):
+    """Задача очереди перепроверки: None - поле проверено, иначе причина повтора"""
+    state = submission_store.get(item['submission_id'])
+    if state is None:
+        return None
     
-    distance = matrix[len1][len2]
-    max_len = max(len1, len2)
-    similarity = 1 - (distance / max_len)
+    index = item['field_index']
+    detail = state['details'][index]
+    if index in state.get('pending', []):
+        # Страховочная задача: фоновая проверка поля не завершилась (воркер перезапущен)
+        compiled_field = _load_compiled_field(state['template_id'], detail['field_id'])
+        if compiled_field is None:
+            return None
+        grade_pending_field(item['submission_id'], index, detail['field_id'], compiled_field,
+                            detail['student_answer'])
+        return None
+    if not state.get('completed'):
+        # Строка в Sheets еще не записана - обновлять нечего
+        return "работа еще проверяется"
+    if detail.get('check_method') != 'ai_deferred':
+        return None
+    compiled_field = _load_compiled_field(state['template_id'], detail['field_id'])
+    if compiled_field is None:
+        return None
     
-    return similarity
+    ai_checker = get_ai_checker()
+    if ai_checker is None:
+        return "AI недоступен"
+    verdict = check_field_with_ai(ai_checker, state['template_id'], index + 1, detail['field_id'],
+                                  detail['student_answer'], detail['correct_variants'])
+    grading_analytics.record([field_event(state['template_id'], detail['field_id'], 'regrade', verdict)])
+    if verdict['check_method'] == 'ai_deferred':
+        return verdict.get('ai_error') or verdict.get('ai_explanation')
+    
+    previous_totals = summarize_details(state['details'])
+    state = submission_store.complete_field(
+        item['submission_id'], index,
+        build_field_detail(compiled_field, detail['field_id'], detail['student_answer'], verdict)
+    )
+    print(f"🔁 Перепроверка {item['submission_id']}/{index}: "
+          f"{'верно' if verdict['is_correct'] else 'неверно'}")
+    if state and summarize_details(state['details']) != previous_totals:
+        patch_sheets_row(state)
+    return None
 
-# Замените маршрут /check_answers в app.py на этот код:
 
-# Замените функцию check_answers в app.py на эту версию:
+def regrade_give_up(item, error):
+    """Попытки перепроверки исчерпаны - поле остается неверным с ошибкой AI"""
+    def apply(state):
+        detail = state['details'][item['field_index']]
+        if detail.get('check_method') == 'ai_deferred':
+            detail['check_method'] = 'ai_error'
+            detail['ai_error'] = error
+            detail['ai_explanation'] = f"Ошибка вызова AI: {error}"
+    submission_store.update(item['submission_id'], apply)
+
+
+regrade_worker = RegradeWorker(regrade_queue, regrade_field, regrade_give_up)
+regrade_worker.start()
+
 
 @app.route('/check_answers', methods=['POST'])
 def check_answers():
     try:
         # Загружаем актуальные настройки перед каждой проверкой
         from ai_config import AIConfig
-        AIConfig.load_from_file()
+        settings = AIConfig.current()
         
         data = request.get_json()
         template_id = data.get('template_id')
@@ -684,293 +1397,117 @@ def check_answers():
 
         template_name = template.get("name", template_id)
         fields = template.get('fields', [])
+        # Варианты, ключи морфологии и синонимы полей - подготовлены заранее
+        compiled_template = get_compiled_template(template_path, template)
 
         # Получаем AI checker
         ai_checker = get_ai_checker()
+        # Асинхронный режим: поля для AI проверяются в фоне, вердикты приходят по SSE
+        async_grading = bool(settings.ASYNC_AI_GRADING)
+        # Бюджет времени работы: AI, кэш и Sheets не выходят за его остаток,
+        # а то, что не успевает, доделывается в фоне (воркер gunicorn не зависает)
+        deadline = deadline_after(settings.SUBMISSION_DEADLINE)
 
-        correct_count = 0
-        total_count = len(fields)
         detailed_results = []
-        student_answers_list = []
-        question_headers = []
-        ai_check_count = 0
+        pending_fields = []
+        analytics_events = []
 
         for i, field in enumerate(fields):
             field_id = field['id']
-            correct_variants = [v.strip().lower() for v in field.get('variants', [])]
+            compiled_field = compiled_template.field(field_id)
+            correct_variants = compiled_field.correct_variants
             student_answer = answers.get(field_id, "").strip()
-            student_answer_lower = student_answer.lower()
-
-            # Инициализируем переменные для каждого поля
-            is_correct = False
-            checked_by_ai = False
-            ai_confidence = 0.0
-            ai_explanation = ""
-            ai_error = None
-            check_method = "none"
+
+            verdict = {}
             
             if correct_variants:
-                # 1. Точное совпадение (с учетом регистра)
-                if student_answer_lower in correct_variants:
-                    is_correct = True
-                    checked_by_ai = False
-                    check_method = "exact"
-                    
-                # 2. Проверка без пробелов и знаков препинания (для числовых ответов)
-                elif any(
-                    student_answer_lower.replace(' ', '').replace(',', '').replace('.', '') == 
-                    variant.replace(' ', '').replace(',', '').replace('.', '')
-                    for variant in correct_variants
-                ):
-                    is_correct = True
-                    checked_by_ai = False
-                    check_method = "numeric_sequence"
-                    
-                # 3. Проверка начала строки (если ответ студента - начало правильного)
-                elif any(
-                    len(student_answer) >= 3 and 
-                    variant.startswith(student_answer_lower)
-                    for variant in correct_variants
-                ):
-                    is_correct = True
-                    checked_by_ai = False
-                    check_method = "partial_match"
-                    
-                # 4. Проверка с допуском опечаток (расстояние Левенштейна)
-                elif any(
-                    len(student_answer) > 3 and 
-                    calculate_similarity(student_answer_lower, variant) > 0.85
-                    for variant in correct_variants
-                ):
-                    is_correct = True
-                    checked_by_ai = False
-                    check_method = "similarity_85"
+                # 1-4.5. Локальная проверка без AI (answer_matching.CompiledField)
+                local_result = compiled_field.match(student_answer)
+                if local_result:
+                    verdict = {"is_correct": local_result[0], "check_method": local_result[1]}
                     
                 # 5. AI проверка - только если все предыдущие методы не сработали
                 elif ai_checker and student_answer and len(student_answer) > 1:
-                    try:
-                        question_context = correct_variants[0] if correct_variants else ""
-                        
-                        print(f"🤖 AI проверка для поля {field_id}:")
-                        print(f"   Ответ студента: '{student_answer}'")
-                        print(f"   Правильные варианты: {correct_variants}")
-                        
-                        check_result = ai_checker.check_answer(
-                            student_answer=student_answer,
-                            correct_variants=correct_variants,
-                            question_context=question_context,
-                            system_prompt=AIConfig.SYSTEM_PROMPT,
-                            model_name=AIConfig.GEMINI_MODEL
-                        )
-                        
-                        result_dict = asdict(check_result)
-                        
-                        print(f"   ✅ Результат: {result_dict}")
-                        
-                        is_correct = result_dict.get('is_correct', False)
-                        checked_by_ai = True
-                        ai_confidence = result_dict.get('confidence', 0.0)
-                        
-                        # КРИТИЧНО: Получаем explanation с правильной кодировкой
-                        ai_explanation = result_dict.get('explanation', 'Нет объяснения от AI')
-
-                        # Убеждаемся что explanation в UTF-8
-                        try:
-                            if isinstance(ai_explanation, bytes):
-                                ai_explanation = ai_explanation.decode('utf-8')
-                        except UnicodeDecodeError:
-                            ai_explanation = "Не удалось декодировать объяснение"
-
-                        check_method = "ai"
-
-                        if is_correct:
-                            ai_check_count += 1
-
-                        # === ЛОГИРОВАНИЕ AI ПРОВЕРКИ ===
-                        if AIConfig.LOG_AI_REQUESTS:
-                            log_entry = {
-                                "timestamp": datetime.now().isoformat(),
-                                "template_id": template_id,
-                                "field_id": field_id,
-                                "question_number": i + 1,
-                                "student_answer": student_answer,
-                                "correct_variants": correct_variants,
-                                "question_context": question_context,
-                                "ai_provider": result_dict.get('ai_provider', 'unknown'),
-                                "is_correct": is_correct,
-                                "confidence": ai_confidence,
-                                "explanation": ai_explanation,
-                                "success": True
-                            }
-                            
-                            log_file_path = os.path.join(Config.BASE_DIR, AIConfig.AI_LOG_FILE)
-                            os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
-                            
-                            # КРИТИЧНО: Явно указываем кодировку UTF-8 при записи
-                            with open(log_file_path, 'a', encoding='utf-8') as log_f:
-                                log_f.write(json.dumps(log_entry, ensure_ascii=False, indent=None) + '\n')
-
-                    except Exception as ai_err:
-                        ai_error = str(ai_err)
-                        is_correct = False
-                        checked_by_ai = True
-                        ai_explanation = f"Ошибка вызова AI: {ai_error}"
-                        check_method = "ai_error"
-                        print(f"⚠️ Ошибка AI проверки для поля {field_id}: {ai_err}")
-                        
-                        # Выводим полный traceback для отладки
-                        import traceback
-                        traceback.print_exc()
-                        
-                        # === ЛОГИРОВАНИЕ ОШИБКИ AI ===
-                        if AIConfig.LOG_AI_REQUESTS:
-                            log_entry = {
-                                "timestamp": datetime.now().isoformat(),
-                                "template_id": template_id,
-                                "field_id": field_id,
-                                "question_number": i + 1,
-                                "student_answer": student_answer,
-                                "correct_variants": correct_variants,
-                                "error": ai_error,
-                                "error_traceback": traceback.format_exc(),
-                                "success": False
-                            }
-                            
-                            log_file_path = os.path.join(Config.BASE_DIR, AIConfig.AI_LOG_FILE)
-                            os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
-                            
-                            # КРИТИЧНО: UTF-8 кодировка
-                            with open(log_file_path, 'a', encoding='utf-8') as log_f:
-                                log_f.write(json.dumps(log_entry, ensure_ascii=False, indent=None) + '\n')
-
-            if is_correct:
-                correct_count += 1
-
-            # Подготовка детального результата
-            detail = {
-                "field_id": field_id,
-                "student_answer": student_answer,
-                "correct_variants": correct_variants,
-                "is_correct": is_correct,
-                "checked_by_ai": checked_by_ai,
-                "ai_confidence": ai_confidence,
-                "ai_explanation": ai_explanation if checked_by_ai else None,
-                "check_method": check_method
-            }
-            
-            if ai_error:
-                detail["ai_error"] = ai_error
-            
-            detailed_results.append(detail)
-            student_answers_list.append(student_answer)
-
-            # Формирование заголовков
-            if correct_variants:
-                base_header = correct_variants[0]
-                clean_header = re.sub(r'[^\w\s\-а-яёА-ЯЁ]', '', base_header)
-                clean_header = clean_header[:30].strip()
-
-                if not clean_header:
-                    clean_header = f"Вопрос {i+1}"
-
-                header = clean_header
-                if clean_header in question_headers:
-                    header = f"{clean_header} ({i+1})"
+                    if async_grading or remaining(deadline) < MIN_AI_BUDGET:
+                        verdict = {"check_method": "pending"}
+                    else:
+                        verdict = check_field_with_ai(ai_checker, template_id, i + 1, field_id,
+                                                      student_answer, correct_variants, deadline)
+                    if verdict["check_method"] == "pending":
+                        pending_fields.append((i, field_id, compiled_field, student_answer))
+
+            detailed_results.append(build_field_detail(compiled_field, field_id, student_answer, verdict))
+            if verdict:
+                analytics_events.append(field_event(template_id, field_id, 'submit', verdict))
+
+        # Все поля работы - одной транзакцией аналитики (пишется в фоне)
+        grading_analytics.record(analytics_events)
+
+        question_headers = build_question_headers(compiled_template, fields)
+        totals = summarize_details(detailed_results)
+        response_data = {"success": True, **totals}
+
+        # Поля, которые AI не проверил (сбой, открыт circuit breaker) - в очередь перепроверки
+        deferred_fields = [index for index, detail in enumerate(detailed_results)
+                           if detail["check_method"] == "ai_deferred"]
+
+        if pending_fields:
+            # Строка в Google Sheets пишется после последнего вердикта AI
+            submission_id = create_submission(template_id, template_name, student_info, sheet_url,
+                                              question_headers, detailed_results,
+                                              [item[0] for item in pending_fields])
+            # Перепроверка отложенных полей начнется, когда работа будет завершена
+            for index in deferred_fields:
+                regrade_queue.enqueue(submission_id, index, detailed_results[index].get("ai_error", ""))
+            for index, field_id, compiled_field, student_answer in pending_fields:
+                # Пул фоновых проверок живет в памяти воркера - страховка в постоянной очереди
+                regrade_queue.enqueue(submission_id, index, delay=PENDING_RECOVERY_DELAY)
+                submit_grading(grade_pending_field, submission_id, index,
+                               field_id, compiled_field, student_answer)
+            response_data.update({
+                "submission_id": submission_id,
+                "pending_count": len(pending_fields),
+                "sheets_result": None
+            })
+        elif deferred_fields:
+            # Работа сохраняется, чтобы обновить ее и строку в Sheets после перепроверки
+            submission_id = create_submission(template_id, template_name, student_info, sheet_url,
+                                              question_headers, detailed_results, [])
+            for index in deferred_fields:
+                regrade_queue.enqueue(submission_id, index, detailed_results[index].get("ai_error", ""))
+            if sheet_url and remaining(deadline) < MIN_SHEETS_BUDGET:
+                submit_grading(finish_submission, submission_id, submission_store.get(submission_id))
+                sheets_result = DEFERRED_SHEETS_RESULT
             else:
-                header = f"Вопрос {i+1}"
-
-            question_headers.append(header)
-
-        percentage = round((correct_count / total_count) * 100, 2) if total_count else 0
-
-        # Запись в Google Sheets
-        sheets_result = None
-        if sheet_url:
-            try:
-                creds_path = os.path.join(Config.CREDENTIALS_FOLDER, 'credentials.json')
-                if not os.path.exists(creds_path):
-                    raise Exception("Файл credentials.json не найден")
-
-                creds = Credentials.from_service_account_file(
-                    creds_path, 
-                    scopes=Config.GOOGLE_SHEETS_SCOPES
-                )
-                client = gspread.authorize(creds)
-                sheet = client.open_by_url(sheet_url)
-                worksheet_title = template_name
-
-                try:
-                    worksheet = sheet.worksheet(worksheet_title)
-                except gspread.WorksheetNotFound:
-                    worksheet = sheet.add_worksheet(
-                        title=worksheet_title, 
-                        rows=1000, 
-                        cols=30
-                    )
-
-                existing_data = worksheet.get_all_values()
-
-                base_headers = [
-                    "Название шаблона",
-                    "ФИО",
-                    "Класс",
-                    "Дата",
-                    "Время",
-                    "Правильных ответов",
-                    "Всего вопросов",
-                    "Процент",
-                    "AI проверок"
-                ]
-
-                all_headers = base_headers + question_headers
-
-                if not existing_data or existing_data[0] != all_headers:
-                    worksheet.clear()
-                    worksheet.append_row(all_headers)
-
+                state = finish_submission(submission_id, submission_store.get(submission_id), deadline)
+                sheets_result = state["sheets_result"]
+            response_data.update({
+                "submission_id": submission_id,
+                "sheets_result": sheets_result
+            })
+        else:
+            # Запись в Google Sheets
+            sheets_result = None
+            if sheet_url:
                 now = datetime.now()
-                
-                student_name = student_info.get("studentName") or student_info.get("name", "")
-                student_class = student_info.get("studentClass") or student_info.get("class", "")
-                
-                base_row_data = [
-                    template_name,
-                    student_name,
-                    student_class,
-                    now.strftime("%d.%m.%Y"),
-                    now.strftime("%H:%M:%S"),
-                    correct_count,
-                    total_count,
-                    f"{percentage}%",
-                    ai_check_count
-                ]
-
-                complete_row_data = base_row_data + student_answers_list
-                worksheet.append_row(complete_row_data)
-
-                sheets_result = {
-                    "success": True,
-                    "message": f"Результаты сохранены во вкладку '{worksheet_title}'."
-                }
-
-            except Exception as e:
-                sheets_result = {
-                    "success": False, 
-                    "error": f"Ошибка Google Sheets: {str(e)}"
-                }
+                args = (sheet_url, template_name, student_info, question_headers, detailed_results,
+                        now.strftime("%d.%m.%Y"), now.strftime("%H:%M:%S"))
+                if remaining(deadline) < MIN_SHEETS_BUDGET:
+                    # Бюджет почти исчерпан - строка пишется в фоне, ответ ученику не ждет
+                    submit_grading(write_results_to_sheets, *args)
+                    sheets_result = DEFERRED_SHEETS_RESULT
+                else:
+                    sheets_result, _ = write_results_to_sheets(*args, deadline=deadline)
+            response_data["sheets_result"] = sheets_result
+
+        response_data.update({
+            "details": detailed_results,
+            "ai_available": AI_AVAILABLE
+        })
 
         # КРИТИЧНО: Формируем JSON ответ с ensure_ascii=False для правильной кодировки
         return app.response_class(
-            response=json.dumps({
-                "success": True,
-                "correct_count": correct_count,
-                "total_count": total_count,
-                "percentage": percentage,
-                "details": detailed_results,
-                "sheets_result": sheets_result,
-                "ai_check_count": ai_check_count,
-                "ai_available": AI_AVAILABLE
-            }, ensure_ascii=False, indent=2),
+            response=json.dumps(response_data, ensure_ascii=False, indent=2),
             status=200,
             mimetype='application/json; charset=utf-8'
         )
@@ -989,6 +1526,56 @@ def check_answers():
             mimetype='application/json; charset=utf-8'
         )
 
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/submissions/<submission_id>/events')
+def submission_events(submission_id):
+    """
+    Поток Server-Sent Events с вердиктами AI по работе ученика:
+    verdict - вердикт поля, complete - все поля проверены и строка записана.
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', submission_id or '') or submission_store.get(submission_id) is None:
+        return jsonify({"success": False, "error": "Работа не найдена"}), 404
+
+    def stream():
+        sent = set()
+        started = last_ping = time.time()
+        while True:
+            state = submission_store.get(submission_id)
+            if state is None:
+                return
+            
+            pending = set(state['pending'])
+            for index in state['ai_fields']:
+                if index not in pending and index not in sent:
+                    sent.add(index)
+                    yield _sse_event('verdict', {"index": index, "detail": state['details'][index],
+                                                 **summarize_details(state['details'])})
+            
+            if state.get('completed'):
+                yield _sse_event('complete', {**summarize_details(state['details']),
+                                              "sheets_result": state.get('sheets_result')})
+                return
+            
+            now = time.time()
+            if now - started > SUBMISSION_STREAM_TIMEOUT:
+                yield _sse_event('timeout', {"pending_count": len(pending)})
+                return
+            if now - last_ping > 15:
+                # Комментарий SSE не дает прокси закрыть простаивающее соединение
+                last_ping = now
+                yield ": ping\n\n"
+            time.sleep(SUBMISSION_POLL_INTERVAL)
+
+    # Уже отправленные вердикты повторяются при переподключении EventSource - клиент их перезаписывает
+    return app.response_class(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/static/classes.json')
 def get_classes():
     try:
@@ -0,0 +1,106 @@
+"""
+Реестр AI проверщиков процесса
+
+Один прогретый AIAnswerChecker на (провайдер, модель, отпечаток API ключа):
+его HTTP сессия держит открытые соединения с провайдером, ограничитель -
+число одновременных запросов. Проверка работ, /api/ai/test,
+quick_check_answer и batch_check_answers берут проверщики отсюда и не
+открывают соединения заново. Состояние circuit breaker хранится по
+(провайдер, модель) в общей базе circuit_breaker.py - тот же ключ без ключа API.
+
+При смене настроек остаются только проверщики новой цепочки; проверщик,
+которым не пользовались CHECKER_IDLE_TTL секунд, удаляется с закрытием сессии.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ai_checker import AIAnswerChecker
+
+CHECKER_IDLE_TTL = 600
+# Удаление простаивающих проверщиков - попутно, не чаще раза в столько секунд
+EVICT_INTERVAL = 60
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """Отпечаток API ключа для ключа реестра (сам ключ в реестре не хранится)"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12] if api_key else ''
+
+
+class CheckerRegistry:
+    """Потокобезопасный реестр проверщиков по (провайдер, модель, отпечаток ключа)"""
+
+    def __init__(self, idle_ttl: float = CHECKER_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], List] = {}
+        self._evicted_at = time.monotonic()
+
+    @staticmethod
+    def _default_model(provider: str) -> str:
+        if provider == 'gemini':
+            from ai_config import AIConfig
+            return AIConfig.current().GEMINI_MODEL
+        return AIAnswerChecker.PROVIDER_MODELS.get(provider, '')
+
+    def get(self, provider: str, api_key: Optional[str] = None,
+            model: Optional[str] = None) -> AIAnswerChecker:
+        """Проверщик провайдера (создается при первом обращении); без ключа - ValueError"""
+        provider = provider.lower()
+        api_key = api_key or AIAnswerChecker.env_api_key(provider)
+        model = model or self._default_model(provider)
+        key = (provider, model, key_fingerprint(api_key))
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._evicted_at >= EVICT_INTERVAL:
+                self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                checker = AIAnswerChecker(provider=provider, api_key=api_key, model=model)
+                checker.registry_key = key
+                entry = self._entries[key] = [checker, now]
+            entry[1] = now
+            return entry[0]
+
+    def touch(self, checker: AIAnswerChecker):
+        """Отметить использование проверщика и его цепочки (без блокировки)"""
+        now = time.monotonic()
+        for member in [checker] + checker.fallback_providers + checker.cascade_checkers:
+            entry = self._entries.get(getattr(member, 'registry_key', None))
+            if entry is not None:
+                entry[1] = now
+
+    def retain(self, checkers: Iterable[AIAnswerChecker]):
+        """
+        Оставить только указанные проверщики (цепочку новых настроек).
+        Сессии остальных не закрываются: ими еще могут пользоваться начатые запросы.
+        """
+        keep = {getattr(checker, 'registry_key', None) for checker in checkers}
+        with self._lock:
+            for key in [key for key in self._entries if key not in keep]:
+                del self._entries[key]
+
+    def _evict_idle(self, now: float):
+        self._evicted_at = now
+        for key, (checker, last_used) in list(self._entries.items()):
+            if now - last_used >= self.idle_ttl:
+                del self._entries[key]
+                checker.session.close()
+
+    def stats(self) -> List[Dict]:
+        """Проверщики реестра (для /api/ai/status)"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'provider': provider,
+                'model': model,
+                'key': fingerprint,
+                'idle': round(now - last_used, 1)
+            } for (provider, model, fingerprint), (_, last_used) in self._entries.items()]
+
+
+# Глобальный реестр процесса
+checker_registry = CheckerRegistry()
@@ -0,0 +1,201 @@
+"""
+Circuit breaker для AI провайдеров
+
+Состояние хранится по ключу (провайдер, модель) в локальной базе SQLite,
+общей для всех воркеров gunicorn на сервере:
+
+    closed    - запросы идут к провайдеру, ошибки считаются в окне;
+    open      - после BREAKER_FAILURE_THRESHOLD ошибок за BREAKER_WINDOW
+                секунд запросы сразу уходят в fallback;
+    half_open - через BREAKER_COOLDOWN секунд один воркер пропускает
+                пробный запрос: успех закрывает breaker, ошибка - снова open.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+from local_db import get_sqlite_connection
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Общий для процессов circuit breaker по (провайдер, модель)"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'AI_BREAKER_DB', os.path.join(Config.DATA_FOLDER, 'ai_breaker.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _get_connection(self):
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS ai_circuit_breaker (
+                            provider TEXT NOT NULL,
+                            model TEXT NOT NULL,
+                            state TEXT NOT NULL DEFAULT 'closed',
+                            failures INTEGER NOT NULL DEFAULT 0,
+                            window_start REAL NOT NULL DEFAULT 0,
+                            opened_at REAL NOT NULL DEFAULT 0,
+                            last_error TEXT,
+                            updated_at REAL NOT NULL DEFAULT 0,
+                            PRIMARY KEY (provider, model)
+                        )
+                    """)
+                    self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _settings():
+        from ai_config import AIConfig
+        settings = AIConfig.current()
+        return (int(settings.BREAKER_FAILURE_THRESHOLD), float(settings.BREAKER_WINDOW),
+                float(settings.BREAKER_COOLDOWN))
+
+    def allow_request(self, provider: str, model: str) -> bool:
+        """Можно ли обращаться к провайдеру (в half_open - только одному пробному запросу)"""
+        threshold, window, cooldown = self._settings()
+        if threshold <= 0:
+            return True
+
+        try:
+            conn = self._get_connection()
+            row = conn.execute(
+                "SELECT state, opened_at FROM ai_circuit_breaker WHERE provider = ? AND model = ?",
+                (provider, model)
+            ).fetchone()
+            if row is None or row[0] == STATE_CLOSED:
+                return True
+
+            now = time.time()
+            if now - row[1] < cooldown:
+                return False
+
+            # Пробный запрос получает тот воркер, чей UPDATE прошел первым;
+            # opened_at сдвигается, чтобы зависший пробник не блокировал навсегда
+            cursor = conn.execute("""
+                UPDATE ai_circuit_breaker SET state = ?, opened_at = ?, updated_at = ?
+                WHERE provider = ? AND model = ? AND state = ? AND opened_at = ?
+            """, (STATE_HALF_OPEN, now, now, provider, model, row[0], row[1]))
+            if cursor.rowcount:
+                print(f"🔌 {provider}/{model}: пробный запрос после паузы")
+            return cursor.rowcount > 0
+        except Exception as e:
+            # Сбой учета не должен блокировать проверку
+            print(f"⚠️ Ошибка circuit breaker: {e}")
+            return True
+
+    def record_success(self, provider: str, model: str):
+        """Успешный ответ провайдера - breaker закрывается"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.execute("""
+                UPDATE ai_circuit_breaker SET state = ?, failures = 0, updated_at = ?
+                WHERE provider = ? AND model = ? AND state != ?
+            """, (STATE_CLOSED, time.time(), provider, model, STATE_CLOSED))
+            if cursor.rowcount:
+                print(f"🔌 {provider}/{model}: провайдер снова доступен")
+            else:
+                # Ошибки в окне считаются подряд - успех обнуляет счетчик
+                conn.execute("""
+                    UPDATE ai_circuit_breaker SET failures = 0
+                    WHERE provider = ? AND model = ? AND failures > 0
+                """, (provider, model))
+        except Exception as e:
+            print(f"⚠️ Ошибка circuit breaker: {e}")
+
+    def record_failure(self, provider: str, model: str, error: str = ''):
+        """Ошибка провайдера: учесть в окне, при превышении порога - открыть breaker"""
+        threshold, window, cooldown = self._settings()
+        if threshold <= 0:
+            return
+
+        now = time.time()
+        try:
+            conn = self._get_connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT state, failures, window_start, opened_at FROM ai_circuit_breaker "
+                    "WHERE provider = ? AND model = ?", (provider, model)
+                ).fetchone()
+                state, failures, window_start, opened_at = row or (STATE_CLOSED, 0, now, 0)
+
+                if state == STATE_HALF_OPEN:
+                    # Пробный запрос не прошел - снова пауза
+                    state, opened_at = STATE_OPEN, now
+                elif state == STATE_CLOSED:
+                    if now - window_start > window:
+                        failures, window_start = 0, now
+                    failures += 1
+                    if failures >= threshold:
+                        state, opened_at = STATE_OPEN, now
+                        print(f"🔌 {provider}/{model}: {failures} ошибок за {int(window)} с, "
+                              f"запросы приостановлены на {int(cooldown)} с")
+
+                conn.execute("""
+                    INSERT OR REPLACE INTO ai_circuit_breaker
+                        (provider, model, state, failures, window_start, opened_at, last_error, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (provider, model, state, failures, window_start, opened_at,
+                      (error or '')[:500], now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            print(f"⚠️ Ошибка circuit breaker: {e}")
+
+    def status(self) -> List[Dict]:
+        """Состояние всех известных провайдеров и моделей (для /api/ai/status)"""
+        _, _, cooldown = self._settings()
+        now = time.time()
+        result = []
+        try:
+            rows = self._get_connection().execute("""
+                SELECT provider, model, state, failures, opened_at, last_error, updated_at
+                FROM ai_circuit_breaker ORDER BY provider, model
+            """).fetchall()
+        except Exception as e:
+            print(f"⚠️ Ошибка circuit breaker: {e}")
+            return result
+
+        for provider, model, state, failures, opened_at, last_error, updated_at in rows:
+            item = {
+                'provider': provider,
+                'model': model,
+                'state': state,
+                'failures': failures,
+                'last_error': last_error,
+                'updated_at': updated_at
+            }
+            if state == STATE_OPEN:
+                item['retry_in'] = max(round(opened_at + cooldown - now, 1), 0)
+            result.append(item)
+        return result
+
+    def reset(self, provider: Optional[str] = None, model: Optional[str] = None):
+        """Сбросить состояние (все ключи или один провайдер/модель)"""
+        query = "DELETE FROM ai_circuit_breaker"
+        params = []
+        if provider:
+            query += " WHERE provider = ?"
+            params.append(provider)
+            if model:
+                query += " AND model = ?"
+                params.append(model)
+        self._get_connection().execute(query, params)
+
+
+# Глобальный экземпляр
+circuit_breaker = CircuitBreaker()
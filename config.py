@@ -17,6 +17,8 @@ class Config:
     STATIC_FOLDER = os.path.join(BASE_DIR, "static")
     # 🔑 КРИТИЧЕСКИ ВАЖНАЯ СТРОКА: папка для ключей авторизации
     CREDENTIALS_FOLDER = os.path.join(BASE_DIR, "credentials") 
+    # 📂 Локальные SQLite-базы (кэш AI без PostgreSQL и т.п.)
+    DATA_FOLDER = os.path.join(BASE_DIR, "data")
 
     # Google Sheets API
     GOOGLE_SHEETS_SCOPES = [
@@ -38,7 +40,8 @@ class Config:
             Config.UPLOAD_FOLDER,  
             Config.TEMPLATES_FOLDER,  
             Config.STATIC_FOLDER,
-            Config.CREDENTIALS_FOLDER # <--- Добавленная папка для ключей
+            Config.CREDENTIALS_FOLDER, # <--- Добавленная папка для ключей
+            Config.DATA_FOLDER
             # Папка templates не нужна, так как Flask ищет ее сам в корне проекта
         ]:
             # exist_ok=True предотвращает ошибку, если папка уже есть
@@ -10,6 +10,7 @@ class Config:
     TEMPLATES_FOLDER = "templates_json"
     STATIC_FOLDER = "static"
     CREDENTIALS_FOLDER = "credentials"
+    DATA_FOLDER = "data"
 
     PDF_DPI = 200
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
@@ -17,7 +18,7 @@ class Config:
     @staticmethod
     def create_directories():
         import os
-        for folder in [Config.UPLOAD_FOLDER, Config.TEMPLATES_FOLDER, Config.STATIC_FOLDER, Config.CREDENTIALS_FOLDER]:
+        for folder in [Config.UPLOAD_FOLDER, Config.TEMPLATES_FOLDER, Config.STATIC_FOLDER, Config.CREDENTIALS_FOLDER, Config.DATA_FOLDER]:
             os.makedirs(folder, exist_ok=True)
 
     @staticmethod
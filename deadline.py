@@ -0,0 +1,50 @@
+"""
+Бюджет времени на проверку работы ученика
+
+/check_answers создает Deadline на AIConfig.SUBMISSION_DEADLINE секунд
+и передает его в AI checker, кэш и запись в Google Sheets. Каждый этап
+берет таймаут из оставшегося бюджета, а не из своего значения по
+умолчанию. Если бюджета не хватает, этап не блокирует ответ: поле
+уходит в фоновую AI проверку (pending), строка в таблицу пишется в фоне.
+"""
+
+import time
+from typing import Optional
+
+# Меньше этого остатка AI запрос не начинается - поле проверяется в фоне
+MIN_AI_BUDGET = 1.0
+# Запись в Sheets - несколько HTTP запросов (авторизация, вкладка, заголовки, строка)
+MIN_SHEETS_BUDGET = 3.0
+
+
+class Deadline:
+    """Момент, к которому должна завершиться обработка запроса"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, default: float) -> float:
+        """Таймаут операции: ее обычный таймаут, но не больше остатка бюджета"""
+        return max(min(default, self.remaining()), 0.001)
+
+
+def deadline_after(seconds) -> Optional[Deadline]:
+    """Deadline на seconds секунд; 0 или пусто - без ограничения"""
+    return Deadline(float(seconds)) if seconds and float(seconds) > 0 else None
+
+
+def request_timeout(deadline: Optional[Deadline], default: float) -> float:
+    """Таймаут запроса с учетом необязательного бюджета"""
+    return deadline.timeout(default) if deadline else default
+
+
+def remaining(deadline: Optional[Deadline]) -> float:
+    """Остаток бюджета (без ограничения - бесконечность)"""
+    return deadline.remaining() if deadline else float('inf')
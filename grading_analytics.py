@@ -0,0 +1,394 @@
+"""
+Аналитика проверки работ
+
+Журнал AI проверок (ai_log.py) хранит только вызовы AI, и вопрос "какие
+поля чаще всего уходят в AI" требует его полного просмотра. Здесь каждое
+проверенное поле - строка локальной базы SQLite с индексами по шаблону,
+полю, методу и времени:
+
+    submit     - вердикт поля в /check_answers (локальное совпадение, AI или pending);
+    background - фоновая AI проверка поля асинхронной работы;
+    regrade    - перепроверка поля из очереди regrade_queue.
+
+Вердикты уровней каскада моделей лежат в stage_verdicts - по ним видно,
+как часто дешевая модель расходится с итоговым вердиктом. Отчеты (доля
+AI проверок и попаданий в кэш по полям, задержки, расхождения) нужны,
+чтобы решать, каким полям добавить варианты и снизить нагрузку на AI.
+
+Запись не задерживает ответ ученику: события ставятся в очередь и
+пишутся фоновым потоком пачками (как журнал AI в ai_log.py), старые
+строки удаляются тем же потоком раз в ANALYTICS_RETENTION_INTERVAL.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from local_db import get_sqlite_connection
+
+# Методы проверки, для которых вызывался AI checker (в том числе из кэша)
+AI_METHODS = ('ai', 'ai_deferred', 'ai_error')
+# Итог строки submit: поле отправлено в AI (сразу или в фоновую проверку)
+AI_SUBMIT_METHODS = AI_METHODS + ('pending',)
+# Сколько хранить строки аналитики и как часто удалять старые
+ANALYTICS_RETENTION_DAYS = int(os.getenv('GRADING_ANALYTICS_RETENTION_DAYS', 180))
+ANALYTICS_RETENTION_INTERVAL = 3600
+ANALYTICS_RETENTION_BATCH = 5000
+# Очередь записи: работы (списки событий), пачка одной транзакции, ожидание пачки
+ANALYTICS_QUEUE_SIZE = 10000
+ANALYTICS_BATCH_SIZE = 200
+ANALYTICS_FLUSH_INTERVAL = 0.5
+# Границы корзин распределения задержек, мс
+LATENCY_BUCKETS_MS = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+def field_event(template_id: str, field_id: str, stage: str, verdict: Dict) -> Dict:
+    """Событие проверки поля по вердикту (verdict['ai_call'] - сведения о вызове AI)"""
+    ai_call = verdict.get('ai_call') or {}
+    return {
+        'template_id': template_id,
+        'field_id': field_id,
+        'stage': stage,
+        'method': verdict.get('check_method', 'none'),
+        'is_correct': verdict.get('is_correct'),
+        'ai_called': bool(ai_call),
+        'from_cache': bool(ai_call.get('from_cache')),
+        'latency_ms': ai_call.get('latency_ms'),
+        'confidence': verdict.get('ai_confidence') if ai_call else None,
+        'ai_provider': ai_call.get('ai_provider'),
+        'ai_model': ai_call.get('ai_model'),
+        'cascade': ai_call.get('cascade') or []
+    }
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    """ISO время фильтра отчета в секунды эпохи (пусто - без ограничения)"""
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+class GradingAnalytics:
+    """Строки проверки полей и отчеты по ним в локальной базе SQLite"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'GRADING_ANALYTICS_DB', os.path.join(Config.DATA_FOLDER, 'grading_analytics.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[float, List[Dict]]]" = queue.Queue(maxsize=ANALYTICS_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._retained_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def _get_connection(self):
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS field_checks (
+                            id INTEGER PRIMARY KEY,
+                            ts REAL NOT NULL,
+                            template_id TEXT NOT NULL,
+                            field_id TEXT NOT NULL,
+                            stage TEXT NOT NULL,
+                            method TEXT NOT NULL,
+                            is_correct INTEGER,
+                            ai_called INTEGER NOT NULL DEFAULT 0,
+                            from_cache INTEGER NOT NULL DEFAULT 0,
+                            latency_ms REAL,
+                            confidence REAL,
+                            ai_provider TEXT,
+                            ai_model TEXT
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS stage_verdicts (
+                            check_id INTEGER NOT NULL,
+                            level INTEGER NOT NULL,
+                            provider TEXT NOT NULL,
+                            model TEXT NOT NULL,
+                            is_correct INTEGER NOT NULL,
+                            confidence REAL,
+                            accepted INTEGER NOT NULL,
+                            PRIMARY KEY (check_id, level)
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_checks_field "
+                                 "ON field_checks(template_id, field_id, ts)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_checks_method ON field_checks(method, ts)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_checks_ts ON field_checks(ts)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_model ON stage_verdicts(provider, model)")
+                    self._schema_ready = True
+        return conn
+
+    def record(self, events: List[Dict]) -> bool:
+        """
+        Поставить события проверки полей в очередь (не блокирует).
+        События одной работы пишутся одной транзакцией; False - очередь полна.
+        """
+        if not events:
+            return True
+        self.start()
+        try:
+            self._queue.put_nowait((time.time(), list(events)))
+            return True
+        except queue.Full:
+            self.dropped += len(events)
+            return False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='grading-analytics', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Дождаться записи всего, что уже в очереди (тесты, остановка процесса)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def stats(self) -> Dict:
+        """Счетчики записи аналитики (для /api/ai/status)"""
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=ANALYTICS_RETENTION_INTERVAL)]
+            except queue.Empty:
+                self._apply_retention()
+                continue
+            # Работы, пришедшие за ANALYTICS_FLUSH_INTERVAL, уходят той же транзакцией
+            flush_at = time.monotonic() + ANALYTICS_FLUSH_INTERVAL
+            while len(batch) < ANALYTICS_BATCH_SIZE:
+                wait = flush_at - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=wait))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Ошибка записи аналитики проверки ({len(batch)} работ потеряно): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            self._apply_retention()
+
+    def _write_batch(self, batch: List[Tuple[float, List[Dict]]]):
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for ts, events in batch:
+                for event in events:
+                    check_id = conn.execute("""
+                        INSERT INTO field_checks
+                            (ts, template_id, field_id, stage, method, is_correct, ai_called,
+                             from_cache, latency_ms, confidence, ai_provider, ai_model)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (ts, str(event['template_id']), str(event['field_id']), event['stage'],
+                          event['method'], None if event['is_correct'] is None else int(bool(event['is_correct'])),
+                          int(event['ai_called']), int(event['from_cache']), event['latency_ms'],
+                          event['confidence'], event['ai_provider'], event['ai_model'])).lastrowid
+                    # Только уровни, давшие вердикт (не сбой провайдера)
+                    conn.executemany("""
+                        INSERT INTO stage_verdicts
+                            (check_id, level, provider, model, is_correct, confidence, accepted)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, [(check_id, level, item['provider'], item['model'], int(bool(item['is_correct'])),
+                           item.get('confidence'), int(bool(item.get('accepted'))))
+                          for level, item in enumerate(event['cascade']) if item.get('success')])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.written += sum(len(events) for _, events in batch)
+
+    def _apply_retention(self):
+        """Удалить строки старше ANALYTICS_RETENTION_DAYS - не чаще раза в ANALYTICS_RETENTION_INTERVAL"""
+        if self._retained_at and time.monotonic() - self._retained_at < ANALYTICS_RETENTION_INTERVAL:
+            return
+        self._retained_at = time.monotonic()
+        cutoff = time.time() - ANALYTICS_RETENTION_DAYS * 86400
+        try:
+            conn = self._get_connection()
+            # Небольшими транзакциями - запись новых строк не ждет долго
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    ids = [row[0] for row in conn.execute(
+                        "SELECT id FROM field_checks WHERE ts < ? ORDER BY ts LIMIT ?",
+                        (cutoff, ANALYTICS_RETENTION_BATCH)
+                    ).fetchall()]
+                    if ids:
+                        placeholders = ', '.join('?' * len(ids))
+                        conn.execute(f"DELETE FROM stage_verdicts WHERE check_id IN ({placeholders})", ids)
+                        conn.execute(f"DELETE FROM field_checks WHERE id IN ({placeholders})", ids)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                if len(ids) < ANALYTICS_RETENTION_BATCH:
+                    break
+        except Exception as e:
+            print(f"⚠️ Ошибка удаления старой аналитики проверки: {e}")
+
+    @staticmethod
+    def _where(template_id: Optional[str] = None, field_id: Optional[str] = None,
+               method: Optional[str] = None, since: Optional[str] = None,
+               until: Optional[str] = None, prefix: str = '') -> Tuple[str, List]:
+        """Условие отчета по фильтрам (prefix - псевдоним таблицы field_checks)"""
+        conditions, params = [], []
+        for column, value in (('template_id', template_id), ('field_id', field_id), ('method', method)):
+            if value:
+                conditions.append(f"{prefix}{column} = ?")
+                params.append(value)
+        for operator, value in (('>=', _timestamp(since)), ('<=', _timestamp(until))):
+            if value is not None:
+                conditions.append(f"{prefix}ts {operator} ?")
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    # Счетчики отчетов. Доля AI считается по итогу строки submit - одна строка
+    # на поле сданной работы, поэтому она не больше 1. Попытки AI фоновой
+    # проверки и перепроверки - отдельные столбцы, в долю не входят.
+    _COUNTERS_SQL = f"""
+        COALESCE(SUM(stage = 'submit'), 0) AS checks,
+        COALESCE(SUM(stage = 'submit' AND method IN ({', '.join(repr(m) for m in AI_SUBMIT_METHODS)})), 0)
+            AS ai_checks,
+        COALESCE(SUM(stage = 'submit' AND method NOT IN ({', '.join(repr(m) for m in AI_SUBMIT_METHODS)}, 'none')), 0)
+            AS local_matches,
+        COALESCE(SUM(ai_called), 0) AS ai_calls,
+        COALESCE(SUM(from_cache), 0) AS cache_hits,
+        COALESCE(SUM(stage = 'background'), 0) AS background_attempts,
+        COALESCE(SUM(stage = 'regrade'), 0) AS regrade_attempts
+    """
+
+    @staticmethod
+    def _counters(checks, ai_checks, local_matches, ai_calls, cache_hits,
+                  background_attempts, regrade_attempts) -> Dict:
+        return {
+            'checks': checks,
+            'ai_checks': ai_checks,
+            'local_matches': local_matches,
+            'ai_call_rate': round(ai_checks / checks, 3) if checks else None,
+            # Вызовы AI checker на всех этапах и доля ответов из кэша среди них
+            'ai_calls': ai_calls,
+            'cache_hits': cache_hits,
+            'cache_hit_rate': round(cache_hits / ai_calls, 3) if ai_calls else None,
+            'background_attempts': background_attempts,
+            'regrade_attempts': regrade_attempts
+        }
+
+    def field_report(self, template_id: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """
+        Поля по числу отправок в AI: сколько раз поле проверялось при сдаче
+        работ, какая доля ушла в AI и какая часть вызовов AI - из кэша
+        """
+        where, params = self._where(template_id=template_id, since=since, until=until)
+        rows = self._get_connection().execute(f"""
+            SELECT template_id, field_id, {self._COUNTERS_SQL},
+                   AVG(CASE WHEN ai_called AND NOT from_cache THEN latency_ms END) AS avg_latency_ms
+            FROM field_checks{where}
+            GROUP BY template_id, field_id
+            ORDER BY ai_checks DESC, checks DESC
+            LIMIT ?
+        """, [*params, limit]).fetchall()
+        return [{
+            'template_id': row[0], 'field_id': row[1],
+            **self._counters(*row[2:-1]),
+            'avg_latency_ms': round(row[-1], 1) if row[-1] is not None else None
+        } for row in rows]
+
+    def summary(self, template_id: Optional[str] = None, since: Optional[str] = None,
+                until: Optional[str] = None) -> Dict:
+        """Проверки по методам, общая доля отправок в AI и попаданий в кэш"""
+        where, params = self._where(template_id=template_id, since=since, until=until)
+        conn = self._get_connection()
+        methods = dict(conn.execute(
+            f"SELECT method, COUNT(*) FROM field_checks{where} GROUP BY method", params
+        ).fetchall())
+        row = conn.execute(f"SELECT {self._COUNTERS_SQL} FROM field_checks{where}", params).fetchone()
+        return {**self._counters(*row), 'methods': methods}
+
+    def latency_report(self, template_id: Optional[str] = None, field_id: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       include_cache: bool = False) -> Dict:
+        """Распределение задержки AI проверки поля: корзины и перцентили, мс"""
+        where, params = self._where(template_id=template_id, field_id=field_id, since=since, until=until)
+        where += (' AND ' if where else ' WHERE ') + 'ai_called AND latency_ms IS NOT NULL'
+        if not include_cache:
+            where += ' AND NOT from_cache'
+        conn = self._get_connection()
+
+        bucket_sql = ' '.join(f"WHEN latency_ms <= {bound} THEN '{bound}'" for bound in LATENCY_BUCKETS_MS)
+        buckets = dict(conn.execute(f"""
+            SELECT CASE {bucket_sql} ELSE 'inf' END AS bucket, COUNT(*)
+            FROM field_checks{where} GROUP BY bucket
+        """, params).fetchall())
+        count = sum(buckets.values())
+
+        percentiles = {}
+        for percentile in (50, 90, 99):
+            row = conn.execute(
+                f"SELECT latency_ms FROM field_checks{where} ORDER BY latency_ms LIMIT 1 OFFSET ?",
+                [*params, max(int(count * percentile / 100 + 0.5) - 1, 0)]
+            ).fetchone() if count else None
+            percentiles[f'p{percentile}'] = row[0] if row else None
+        return {
+            'count': count,
+            'buckets': {bound: buckets.get(bound, 0)
+                        for bound in [str(bound) for bound in LATENCY_BUCKETS_MS] + ['inf']},
+            **percentiles
+        }
+
+    def disagreement_report(self, template_id: Optional[str] = None, since: Optional[str] = None,
+                            until: Optional[str] = None) -> List[Dict]:
+        """
+        Расхождения этапов: как часто вердикт уровня каскада (провайдер, модель)
+        не совпал с итоговым вердиктом поля и как часто уровень был принят
+        """
+        where, params = self._where(template_id=template_id, since=since, until=until, prefix='c.')
+        where += (' AND ' if where else ' WHERE ') + 'c.is_correct IS NOT NULL'
+        rows = self._get_connection().execute(f"""
+            SELECT s.provider, s.model, COUNT(*) AS verdicts,
+                   SUM(s.is_correct != c.is_correct) AS disagreements,
+                   SUM(s.accepted) AS accepted,
+                   AVG(s.confidence) AS avg_confidence
+            FROM stage_verdicts s JOIN field_checks c ON c.id = s.check_id{where}
+            GROUP BY s.provider, s.model
+            ORDER BY verdicts DESC
+        """, params).fetchall()
+        return [{
+            'provider': provider, 'model': model,
+            'verdicts': verdicts, 'disagreements': disagreements, 'accepted': accepted,
+            'disagreement_rate': round(disagreements / verdicts, 3) if verdicts else None,
+            'avg_confidence': round(avg_confidence, 3) if avg_confidence is not None else None
+        } for provider, model, verdicts, disagreements, accepted, avg_confidence in rows]
+
+
+# Глобальное хранилище аналитики
+grading_analytics = GradingAnalytics()
@@ -1,5 +1,6 @@
 import psycopg2
 import os
+import sys
 from datetime import datetime, timedelta
 import hashlib
 import json
@@ -39,7 +40,8 @@ def create_cache_table(conn):
         explanation TEXT NOT NULL,
         created_at TIMESTAMP DEFAULT NOW(),
         expires_at TIMESTAMP NOT NULL,
-        usage_count INTEGER DEFAULT 1
+        usage_count INTEGER DEFAULT 1,
+        size_bytes INTEGER NOT NULL DEFAULT 0
     );
     """
     
@@ -71,6 +73,249 @@ def create_cache_table(conn):
         conn.rollback()
         return False
 
+def partition_name(day):
+    """Имя дневной секции для даты истечения day"""
+    return f"ai_response_cache_p{day.strftime('%Y%m%d')}"
+
+def is_partitioned(conn):
+    """Проверка: ai_response_cache - секционированная таблица?"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'ai_response_cache' AND n.nspname = current_schema()
+    """)
+    row = cursor.fetchone()
+    cursor.close()
+    return bool(row) and row[0] == 'p'
+
+def create_partitioned_cache_table(conn, days_ahead=3):
+    """
+    Создание таблицы кэша, секционированной по дням expires_at.
+
+    Секция целиком состоит из записей, истекших в один день, поэтому
+    после полуночи ее можно удалить через DROP TABLE вместо DELETE.
+    Уникальный ключ по cache_key в такой таблице невозможен,
+    поэтому AICacheManager работает с ней через UPDATE + INSERT
+    (включается переменной окружения AI_CACHE_PARTITIONED=1).
+    Существующая обычная таблица переименовывается в ai_response_cache_legacy,
+    действительные записи переносятся в новую.
+    """
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT to_regclass('ai_response_cache')")
+        exists = cursor.fetchone()[0] is not None
+        migrate_legacy = exists and not is_partitioned(conn)
+        if migrate_legacy:
+            cursor.execute("ALTER TABLE ai_response_cache RENAME TO ai_response_cache_legacy")
+            print("🔁 Старая таблица переименована в ai_response_cache_legacy")
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ai_response_cache (
+            id SERIAL,
+            cache_key VARCHAR(255) NOT NULL,
+            student_answer TEXT NOT NULL,
+            correct_variants TEXT NOT NULL,
+            question_context TEXT,
+            ai_provider VARCHAR(50) NOT NULL,
+            ai_model VARCHAR(100) NOT NULL,
+            is_correct BOOLEAN NOT NULL,
+            confidence FLOAT NOT NULL,
+            explanation TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            expires_at TIMESTAMP NOT NULL,
+            usage_count INTEGER DEFAULT 1,
+            size_bytes INTEGER NOT NULL DEFAULT 0
+        ) PARTITION BY RANGE (expires_at);
+        """)
+        cursor.execute("CREATE TABLE IF NOT EXISTS ai_response_cache_default "
+                       "PARTITION OF ai_response_cache DEFAULT;")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_part_cache_key ON ai_response_cache(cache_key);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_part_expires_at ON ai_response_cache(expires_at);")
+        print("✅ Секционированная таблица ai_response_cache создана/проверена")
+
+        ensure_future_partitions(conn, days_ahead, cursor=cursor)
+
+        if migrate_legacy:
+            cursor.execute("""
+                INSERT INTO ai_response_cache
+                (cache_key, student_answer, correct_variants, question_context, ai_provider,
+                 ai_model, is_correct, confidence, explanation, created_at, expires_at, usage_count,
+                 size_bytes)
+                SELECT cache_key, student_answer, correct_variants, question_context, ai_provider,
+                       ai_model, is_correct, confidence, explanation, created_at, expires_at, usage_count,
+                       octet_length(student_answer) + octet_length(correct_variants)
+                       + COALESCE(octet_length(question_context), 0) + octet_length(explanation)
+                FROM ai_response_cache_legacy WHERE expires_at > NOW()
+            """)
+            print(f"✅ Перенесено действительных записей: {cursor.rowcount}")
+            # Счетчики пересчитает create_stats_table по новой таблице
+            cursor.execute("DROP TABLE IF EXISTS ai_response_cache_stats")
+
+        conn.commit()
+        cursor.close()
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка создания секционированной таблицы: {e}")
+        conn.rollback()
+        return False
+
+def ensure_future_partitions(conn, days_ahead=3, cursor=None):
+    """Создать дневные секции на сегодня и days_ahead дней вперед"""
+    own_cursor = cursor is None
+    if own_cursor:
+        cursor = conn.cursor()
+
+    today = datetime.now().date()
+    created = 0
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        cursor.execute("SELECT to_regclass(%s)", (name,))
+        if cursor.fetchone()[0] is not None:
+            continue
+        # Записи этого дня могли попасть в DEFAULT - тогда секцию создать нельзя,
+        # они останутся там до удаления пакетной очисткой
+        try:
+            cursor.execute("SAVEPOINT create_partition")
+            cursor.execute(
+                f"CREATE TABLE {name} PARTITION OF ai_response_cache "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                (day, day + timedelta(days=1))
+            )
+            cursor.execute("RELEASE SAVEPOINT create_partition")
+            created += 1
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT create_partition")
+            print(f"⚠️ Не удалось создать секцию {name}: {e}")
+
+    if own_cursor:
+        conn.commit()
+        cursor.close()
+    return created
+
+def drop_expired_partitions(conn):
+    """Удалить секции, все записи которых уже истекли (верхняя граница <= сегодня)"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = 'ai_response_cache'
+          AND child.relname LIKE 'ai\\_response\\_cache\\_p%'
+    """)
+    cutoff = partition_name(datetime.now().date())
+    dropped = 0
+    for (name,) in cursor.fetchall():
+        # Имена сравниваются лексикографически: ..._pYYYYMMDD
+        if name < cutoff:
+            # Вычитаем содержимое секции из счетчиков статистики и удаляем ее
+            cursor.execute(f"""
+                INSERT INTO ai_response_cache_stats AS s
+                    (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total, hits, misses)
+                SELECT ai_provider, ai_model, -COUNT(*), -SUM(size_bytes),
+                       -SUM(confidence), -SUM(usage_count), 0, 0
+                FROM {name} GROUP BY ai_provider, ai_model
+                ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+                    entries = s.entries + EXCLUDED.entries,
+                    bytes = s.bytes + EXCLUDED.bytes,
+                    confidence_sum = s.confidence_sum + EXCLUDED.confidence_sum,
+                    usage_total = s.usage_total + EXCLUDED.usage_total
+            """)
+            cursor.execute(f"DROP TABLE IF EXISTS {name}")
+            dropped += 1
+    conn.commit()
+    cursor.close()
+    return dropped
+
+def _stats_schema_state(cursor):
+    """(есть ли колонка size_bytes, есть ли таблица статистики) - без блокировок"""
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'ai_response_cache' AND column_name = 'size_bytes'
+        ), to_regclass('ai_response_cache_stats') IS NOT NULL
+    """)
+    column_exists, stats_exists = cursor.fetchone()
+    return column_exists, stats_exists
+
+def create_stats_table(conn):
+    """
+    Создание таблицы счетчиков статистики кэша (ai_response_cache_stats).
+
+    Счетчики обновляются приложением при вставке, попадании и удалении записей,
+    поэтому /api/ai/cache/stats не сканирует таблицу кэша. При первом создании
+    таблица заполняется полным проходом по кэшу. Для баз, созданных раньше,
+    добавляется колонка size_bytes.
+
+    Вызывается и приложением при первом подключении, поэтому сначала схема
+    проверяется только чтением каталога: ALTER TABLE берет ACCESS EXCLUSIVE
+    блокировку на таблицу кэша и все ее секции даже при IF NOT EXISTS.
+    """
+    try:
+        cursor = conn.cursor()
+        column_exists, stats_exists = _stats_schema_state(cursor)
+        if column_exists and stats_exists:
+            conn.commit()
+            cursor.close()
+            return True
+
+        # Несколько воркеров могут стартовать одновременно
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (0x41494353,))
+        column_exists, stats_exists = _stats_schema_state(cursor)
+        if not column_exists:
+            cursor.execute("ALTER TABLE ai_response_cache "
+                           "ADD COLUMN size_bytes INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ai_response_cache_stats (
+            ai_provider VARCHAR(50) NOT NULL,
+            ai_model VARCHAR(100) NOT NULL,
+            entries BIGINT NOT NULL DEFAULT 0,
+            bytes BIGINT NOT NULL DEFAULT 0,
+            confidence_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            usage_total BIGINT NOT NULL DEFAULT 0,
+            hits BIGINT NOT NULL DEFAULT 0,
+            misses BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (ai_provider, ai_model)
+        );
+        """)
+        conn.commit()
+        cursor.close()
+
+        if not stats_exists:
+            print("✅ Таблица ai_response_cache_stats создана")
+            rebuild_stats_table(conn)
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка создания таблицы статистики: {e}")
+        conn.rollback()
+        return False
+
+def rebuild_stats_table(conn):
+    """Пересчет счетчиков entries/bytes/... полным проходом (hits/misses сохраняются)"""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE ai_response_cache_stats SET entries = 0, bytes = 0, "
+                   "confidence_sum = 0, usage_total = 0")
+    cursor.execute("""
+        INSERT INTO ai_response_cache_stats AS s
+            (ai_provider, ai_model, entries, bytes, confidence_sum, usage_total)
+        SELECT ai_provider, ai_model, COUNT(*), SUM(size_bytes), SUM(confidence), SUM(usage_count)
+        FROM ai_response_cache
+        GROUP BY ai_provider, ai_model
+        ON CONFLICT (ai_provider, ai_model) DO UPDATE SET
+            entries = EXCLUDED.entries,
+            bytes = EXCLUDED.bytes,
+            confidence_sum = EXCLUDED.confidence_sum,
+            usage_total = EXCLUDED.usage_total
+    """)
+    conn.commit()
+    cursor.close()
+    print("✅ Статистика кэша пересчитана")
+
 def generate_cache_key(student_answer, correct_variants, question_context, ai_model):
     """Генерация ключа кэша"""
     data = f"{student_answer}_{json.dumps(correct_variants, sort_keys=True)}_{question_context}_{ai_model}"
@@ -190,7 +435,9 @@ def cleanup_test_data(conn):
 
 def main():
     """Основная функция"""
-    print("🚀 Инициализация кэша в PostgreSQL")
+    # --partitioned: таблица, секционированная по дням истечения записей
+    partitioned = '--partitioned' in sys.argv
+    print("🚀 Инициализация кэша в PostgreSQL" + (" (секционированная таблица)" if partitioned else ""))
     
     # Подключаемся к БД
     conn = create_connection()
@@ -199,7 +446,13 @@ def main():
     
     try:
         # Создаем таблицу
-        if not create_cache_table(conn):
+        if partitioned:
+            if not create_partitioned_cache_table(conn):
+                return
+        elif not create_cache_table(conn):
+            return
+        
+        if not create_stats_table(conn):
             return
         
         # Тестируем операции
@@ -0,0 +1,202 @@
+"""
+Хранилище "выученных" вариантов ответов
+
+Вердикты AI по ответам учеников накапливаются по (шаблон, поле, ответ).
+Учитель одобряет их пакетом, после чего ответ переносится в шаблон:
+принятый - в field['variants'], отклоненный - в field['rejected_variants'].
+Оба списка проверяются на этапе точного совпадения, до вызова AI.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+from local_db import get_sqlite_connection
+
+# Статусы записи
+STATUS_PENDING = 'pending'      # ждет решения учителя
+STATUS_APPROVED = 'approved'    # перенесен в variants
+STATUS_REJECTED = 'rejected'    # перенесен в rejected_variants
+STATUS_DISMISSED = 'dismissed'  # учитель решил не переносить
+
+
+def normalize_answer(answer: str) -> str:
+    """Нормализация ответа так же, как в check_answers (регистр, пробелы по краям)"""
+    return (answer or '').strip().lower()
+
+
+class LearnedVariantsStore:
+    """Вердикты AI по шаблонам и полям в локальной базе SQLite"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'LEARNED_VARIANTS_DB', os.path.join(Config.DATA_FOLDER, 'learned_variants.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        # Слияние в JSON шаблона - последовательно в пределах процесса
+        self._template_lock = threading.Lock()
+
+    def _get_connection(self):
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS learned_variants (
+                            template_id TEXT NOT NULL,
+                            field_id TEXT NOT NULL,
+                            answer TEXT NOT NULL,
+                            accepted_count INTEGER NOT NULL DEFAULT 0,
+                            rejected_count INTEGER NOT NULL DEFAULT 0,
+                            confidence_sum REAL NOT NULL DEFAULT 0,
+                            status TEXT NOT NULL DEFAULT 'pending',
+                            first_seen REAL NOT NULL,
+                            last_seen REAL NOT NULL,
+                            PRIMARY KEY (template_id, field_id, answer)
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_learned_status "
+                                 "ON learned_variants(template_id, status)")
+                    self._schema_ready = True
+        return conn
+
+    def record(self, template_id: str, field_id: str, answer: str,
+               is_correct: bool, confidence: float) -> bool:
+        """Учесть вердикт AI по ответу ученика"""
+        answer = normalize_answer(answer)
+        if not template_id or not answer:
+            return False
+
+        now = time.time()
+        try:
+            self._get_connection().execute("""
+                INSERT INTO learned_variants
+                    (template_id, field_id, answer, accepted_count, rejected_count,
+                     confidence_sum, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (template_id, field_id, answer) DO UPDATE SET
+                    accepted_count = accepted_count + excluded.accepted_count,
+                    rejected_count = rejected_count + excluded.rejected_count,
+                    confidence_sum = confidence_sum + excluded.confidence_sum,
+                    last_seen = excluded.last_seen
+            """, (template_id, field_id, answer,
+                  1 if is_correct else 0, 0 if is_correct else 1,
+                  float(confidence or 0), now, now))
+            return True
+        except Exception as e:
+            print(f"⚠️ Ошибка записи выученного варианта: {e}")
+            return False
+
+    def list_variants(self, template_id: str, status: Optional[str] = STATUS_PENDING) -> List[Dict]:
+        """Список вердиктов по шаблону (по умолчанию - ожидающие решения)"""
+        query = """
+            SELECT field_id, answer, accepted_count, rejected_count, confidence_sum,
+                   status, first_seen, last_seen
+            FROM learned_variants WHERE template_id = ?
+        """
+        params = [template_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY field_id, accepted_count + rejected_count DESC"
+
+        result = []
+        for row in self._get_connection().execute(query, params):
+            field_id, answer, accepted, rejected, confidence_sum, row_status, first_seen, last_seen = row
+            seen = accepted + rejected
+            result.append({
+                'field_id': field_id,
+                'answer': answer,
+                # Вердикт AI - по большинству наблюдений
+                'ai_verdict': accepted >= rejected,
+                'accepted_count': accepted,
+                'rejected_count': rejected,
+                'avg_confidence': round(confidence_sum / seen, 3) if seen else 0,
+                'status': row_status,
+                'first_seen': first_seen,
+                'last_seen': last_seen
+            })
+        return result
+
+    def apply_decisions(self, template_id: str, decisions: List[Dict]) -> Dict:
+        """
+        Применить решения учителя и перенести ответы в JSON шаблона.
+
+        decisions: [{"field_id", "answer", "action"}], где action:
+            "approve" - согласиться с вердиктом AI,
+            "accept"  - засчитывать ответ (в variants),
+            "reject"  - не засчитывать ответ (в rejected_variants),
+            "dismiss" - ничего не переносить.
+        """
+        template_path = os.path.join(Config.TEMPLATES_FOLDER, f"{template_id}.json")
+        if not os.path.exists(template_path):
+            raise FileNotFoundError("Шаблон не найден")
+
+        pending = {
+            (item['field_id'], item['answer']): item
+            for item in self.list_variants(template_id, status=None)
+        }
+
+        with self._template_lock:
+            with open(template_path, 'r', encoding='utf-8') as f:
+                template = json.load(f)
+            fields_by_id = {field.get('id'): field for field in template.get('fields', [])}
+
+            updates = []
+            summary = {'accepted': 0, 'rejected': 0, 'dismissed': 0, 'skipped': 0}
+            for decision in decisions:
+                field_id = decision.get('field_id')
+                answer = normalize_answer(decision.get('answer', ''))
+                action = decision.get('action', 'approve')
+                item = pending.get((field_id, answer))
+                field = fields_by_id.get(field_id)
+
+                if item is None or field is None:
+                    summary['skipped'] += 1
+                    continue
+
+                if action == 'approve':
+                    action = 'accept' if item['ai_verdict'] else 'reject'
+
+                if action == 'accept':
+                    self._move_answer(field, answer, to_key='variants', from_key='rejected_variants')
+                    updates.append((STATUS_APPROVED, field_id, answer))
+                    summary['accepted'] += 1
+                elif action == 'reject':
+                    self._move_answer(field, answer, to_key='rejected_variants', from_key='variants')
+                    updates.append((STATUS_REJECTED, field_id, answer))
+                    summary['rejected'] += 1
+                elif action == 'dismiss':
+                    updates.append((STATUS_DISMISSED, field_id, answer))
+                    summary['dismissed'] += 1
+                else:
+                    summary['skipped'] += 1
+
+            if summary['accepted'] or summary['rejected']:
+                with open(template_path, 'w', encoding='utf-8') as f:
+                    json.dump(template, f, ensure_ascii=False, indent=2)
+
+        if updates:
+            self._get_connection().executemany(
+                "UPDATE learned_variants SET status = ? "
+                "WHERE template_id = ? AND field_id = ? AND answer = ?",
+                [(status, template_id, field_id, answer) for status, field_id, answer in updates]
+            )
+        return summary
+
+    @staticmethod
+    def _move_answer(field: Dict, answer: str, to_key: str, from_key: str):
+        """Добавить ответ в список to_key поля и убрать из from_key"""
+        target = field.setdefault(to_key, [])
+        if answer not in (normalize_answer(v) for v in target):
+            target.append(answer)
+        if from_key in field:
+            field[from_key] = [v for v in field[from_key] if normalize_answer(v) != answer]
+
+
+# Глобальный экземпляр хранилища
+learned_store = LearnedVariantsStore()
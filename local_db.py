@@ -0,0 +1,39 @@
+"""
+Вспомогательные функции для локальных баз SQLite
+Используются, когда PostgreSQL недоступен (один контейнер, тесты)
+"""
+
+import os
+import sqlite3
+import threading
+
+_local = threading.local()
+
+
+def get_sqlite_connection(path: str) -> sqlite3.Connection:
+    """
+    Получить соединение SQLite для текущего потока.
+
+    Соединения кэшируются на поток (sqlite3 не любит общие соединения
+    между потоками) и пересоздаются после fork() воркера gunicorn.
+    База работает в WAL-режиме: читатели не блокируют писателя.
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+
+    conn = _local.connections.get(path)
+    if conn is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # isolation_level=None - autocommit, транзакции открываем явно
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        _local.connections[path] = conn
+
+    return conn
@@ -0,0 +1,180 @@
+"""
+Упрощенная морфология для локальной проверки ответов
+
+Нормализация ответа в ключ сравнения: нижний регистр, ё -> е, отсечение
+окончаний (русский и казахский, без словаря), транслитерация в латиницу.
+"VRом", "vr-ом" и "VR" дают один ключ "vr", "виртуальной реальностью" и
+"виртуальная реальность" - ключ "virtualn realnost".
+
+Словарь синонимов (answer_synonyms.json) задает группы равнозначных
+ответов и пары противоположных групп (верно/неверно).
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, List, Optional
+
+SYNONYMS_FILE = os.getenv(
+    'ANSWER_SYNONYMS_FILE', os.path.join(os.path.dirname(__file__), 'answer_synonyms.json')
+)
+
+# Окончания, от длинных к коротким (отсекается одно, самое длинное)
+RU_ENDINGS = sorted({
+    # прилагательные и причастия
+    'ыми', 'ими', 'ого', 'его', 'ому', 'ему', 'ая', 'яя', 'ую', 'юю', 'ой', 'ей',
+    'ий', 'ый', 'ое', 'ее', 'ые', 'ие', 'ым', 'им', 'ом', 'ем', 'их', 'ых',
+    # существительные
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ям', 'ам', 'иях', 'ях', 'ах', 'ию', 'ью',
+    'ия', 'ья', 'ье', 'ов', 'ев', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    # глаголы
+    'ться', 'тся', 'ать', 'ять', 'ить', 'еть', 'ует', 'уют', 'ешь', 'ет', 'ют',
+    'ит', 'ят', 'ла', 'ло', 'ли', 'сь', 'ся',
+}, key=len, reverse=True)
+
+KZ_ENDINGS = sorted({
+    # множественное число
+    'лар', 'лер', 'дар', 'дер', 'тар', 'тер',
+    # падежи
+    'ның', 'нің', 'дың', 'дің', 'тың', 'тің', 'ға', 'ге', 'қа', 'ке', 'на', 'не',
+    'ды', 'ді', 'ты', 'ті', 'ны', 'ні', 'нда', 'нде', 'да', 'де', 'та', 'те',
+    'дан', 'ден', 'тан', 'тен', 'нан', 'нен', 'мен', 'бен', 'пен',
+}, key=len, reverse=True)
+
+KZ_LETTERS = set('әғқңөұүһі')
+
+# Окончание, написанное отдельно от аббревиатуры: "vr ом", "VR-ом"
+DETACHED_ENDINGS = {'а', 'у', 'е', 'ом', 'ем', 'ой', 'ей', 'ы', 'и', 'ов', 'ам', 'ами', 'ах'}
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+    # казахские буквы
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u', 'һ': 'h', 'і': 'i',
+}
+# Латиница, которую ученики используют вместо кириллицы, приводится к тем же буквам
+LATIN_FOLDS = [('kh', 'h'), ('ph', 'f'), ('x', 'ks'), ('w', 'v'), ('q', 'k'),
+               ('c', 'k'), ('y', 'i'), ('j', 'i')]
+
+_TOKEN_RE = re.compile(r'\w+')
+_CYRILLIC_RE = re.compile(r'[а-яәғқңөұүһі]')
+
+
+def _strip_ending(token: str, endings: List[str], min_stem: int) -> str:
+    for ending in endings:
+        if token.endswith(ending) and len(token) - len(ending) >= min_stem:
+            return token[:-len(ending)]
+    return token
+
+
+def stem(token: str) -> str:
+    """Отсечь окончание слова (русский или казахский по буквам слова)"""
+    if not _CYRILLIC_RE.search(token):
+        # Латиница: только английское множественное число
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            return token[:-1]
+        return token
+
+    # Аббревиатура с русским окончанием ("vrом") - основа может быть короткой
+    mixed = bool(re.search(r'[a-z0-9]', token))
+    min_stem = 2 if mixed else 3
+
+    if KZ_LETTERS & set(token):
+        # Казахский агглютинативен: до двух аффиксов подряд (кітаптардың -> кітап)
+        for _ in range(2):
+            stripped = _strip_ending(token, KZ_ENDINGS, min_stem)
+            if stripped == token:
+                break
+            token = stripped
+        return token
+
+    return _strip_ending(token, RU_ENDINGS, min_stem)
+
+
+def fold(token: str) -> str:
+    """Транслитерация в латиницу с упрощением похожих звуков"""
+    token = ''.join(TRANSLIT.get(ch, ch) for ch in token)
+    for src, dst in LATIN_FOLDS:
+        token = token.replace(src, dst)
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова ответа в нижнем регистре; окончание, отделенное от аббревиатуры, отбрасывается"""
+    tokens = _TOKEN_RE.findall((text or '').lower().replace('ё', 'е').replace('_', ' '))
+    result = []
+    for token in tokens:
+        if result and token in DETACHED_ENDINGS and not _CYRILLIC_RE.search(result[-1]):
+            continue
+        result.append(token)
+    return result
+
+
+def normalize_key(text: str) -> str:
+    """Ключ сравнения ответа: основы слов в латинице через пробел"""
+    return ' '.join(fold(stem(token)) for token in tokenize(text))
+
+
+class SynonymDictionary:
+    """Группы синонимов из JSON файла, перечитываются при изменении файла"""
+
+    def __init__(self, path: str = SYNONYMS_FILE):
+        self.path = path
+        self.version = None
+        self._groups: Dict[str, str] = {}
+        self._members: Dict[str, List[str]] = {}
+        self._opposites: Dict[str, FrozenSet[str]] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Перечитать словарь, если файл изменился (версия - время изменения)"""
+        try:
+            version = os.stat(self.path).st_mtime_ns
+        except OSError:
+            version = None
+        if version == self.version:
+            return
+
+        with self._lock:
+            if version == self.version:
+                return
+            data = {}
+            if version is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    print(f"⚠️ Ошибка загрузки словаря синонимов: {e}")
+
+            groups, members = {}, {}
+            for name, words in data.get('groups', {}).items():
+                members[name] = list(words)
+                for word in words:
+                    groups[normalize_key(word)] = name
+
+            opposites: Dict[str, set] = {}
+            for first, second in data.get('opposites', []):
+                opposites.setdefault(first, set()).add(second)
+                opposites.setdefault(second, set()).add(first)
+
+            self._groups = groups
+            self._members = members
+            self._opposites = {name: frozenset(items) for name, items in opposites.items()}
+            self.version = version
+
+    def group_of(self, key: str) -> Optional[str]:
+        """Имя группы по ключу ответа (normalize_key)"""
+        return self._groups.get(key)
+
+    def members(self, group: str) -> List[str]:
+        return self._members.get(group, [])
+
+    def opposites_of(self, group: str) -> FrozenSet[str]:
+        return self._opposites.get(group, frozenset())
+
+
+# Глобальный словарь синонимов
+synonyms = SynonymDictionary()
@@ -0,0 +1,160 @@
+"""
+Разбор и сравнение числовых ответов
+
+Понимает десятичную запятую и точку ("3,50" = "3.5"), разделители
+тысяч ("1 000 000", "1,000.5"), дроби и смешанные дроби ("1/2", "1 1/2"),
+проценты и необязательные единицы измерения ("5 см", "90°").
+Значения хранятся как Fraction - сравнение точное, без ошибок float.
+
+Допуск задается в поле шаблона ключом "tolerance": число - абсолютный
+допуск, строка с % ("1%") - относительный.
+"""
+
+import re
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Optional, Tuple
+
+from morphology import normalize_key
+
+_SPACES = {'\u00a0': ' ', '\u202f': ' ', '\u2009': ' ', '\u2212': '-', '\u2013': '-'}
+
+_MIXED_RE = re.compile(r'^([+-]?)(\d+)\s+(\d+)\s*/\s*(\d+)(.*)$')
+_FRACTION_RE = re.compile(r'^([+-]?)(\d+)\s*/\s*(\d+)(.*)$')
+_DECIMAL_RE = re.compile(r"^([+-]?)(\d[\d .,']*)(.*)$")
+_GROUPS_RE = re.compile(r'^\d{1,3}(?:X\d{3})+$')
+_AMBIGUOUS_RE = re.compile(r'^[1-9]\d{0,2}[.,]\d{3}$')
+
+# Единица измерения - только после числа и без цифр ("3 и 5" - не число)
+MAX_UNIT_LENGTH = 20
+
+
+@dataclass(frozen=True)
+class ParsedNumber:
+    value: Fraction
+    unit: str = ''  # нормализованная единица ('%' для процентов)
+
+
+def _parse_digits(token: str) -> Optional[Fraction]:
+    """Число с разделителями тысяч и десятичной запятой или точкой"""
+    token = token.strip().rstrip('.,')
+    if not token:
+        return None
+
+    # Пробелы и апострофы - только разделители тысяч ("1 000 000,5")
+    if ' ' in token or "'" in token:
+        match = re.match(r"^([\d ']+?)(?:[.,](\d+))?$", token)
+        if not match or not _GROUPS_RE.match(re.sub(r"[ ']+", 'X', match.group(1))):
+            return None
+        integer, fraction = re.sub(r"[ ']+", '', match.group(1)), match.group(2)
+        return Fraction(integer + ('.' + fraction if fraction else ''))
+
+    commas, dots = token.count(','), token.count('.')
+    if commas and dots:
+        # Последний из разделителей - десятичный, другой - тысячи
+        decimal = ',' if token.rfind(',') > token.rfind('.') else '.'
+        thousands = '.' if decimal == ',' else ','
+        integer, _, fraction = token.rpartition(decimal)
+        if not _GROUPS_RE.match(integer.replace(thousands, 'X')):
+            return None
+        token = integer.replace(thousands, '') + '.' + fraction
+    elif commas > 1 or dots > 1:
+        separator = ',' if commas else '.'
+        if not _GROUPS_RE.match(token.replace(separator, 'X')):
+            return None
+        token = token.replace(separator, '')
+    else:
+        # Одна запятая или точка - десятичный разделитель ("3,50" = 3.5).
+        # "1,000" и "1.000" - тысяча или единица: не число, решают следующие этапы
+        if _AMBIGUOUS_RE.match(token):
+            return None
+        token = token.replace(',', '.')
+
+    try:
+        return Fraction(token)
+    except ValueError:
+        return None
+
+
+def _normalize_unit(unit: str) -> Optional[str]:
+    unit = unit.strip(" .,;:!")
+    if not unit:
+        return ''
+    if len(unit) > MAX_UNIT_LENGTH or re.search(r'\d', unit):
+        return None
+    key = normalize_key(unit)
+    if '%' in unit or key.startswith('protsent') or key.startswith('paiyz'):
+        return '%'
+    return key or unit.replace(' ', '')
+
+
+def parse_number(text: str) -> Optional[ParsedNumber]:
+    """Разобрать числовой ответ или вернуть None, если это не число"""
+    text = (text or '').strip().lower()
+    for src, dst in _SPACES.items():
+        text = text.replace(src, dst)
+
+    value = None
+    rest = ''
+    match = _MIXED_RE.match(text)
+    if match:
+        sign, whole, numerator, denominator, rest = match.groups()
+        if int(denominator):
+            value = int(whole) + Fraction(int(numerator), int(denominator))
+    else:
+        match = _FRACTION_RE.match(text)
+        if match:
+            sign, numerator, denominator, rest = match.groups()
+            if int(denominator):
+                value = Fraction(int(numerator), int(denominator))
+        else:
+            match = _DECIMAL_RE.match(text)
+            if match:
+                sign, token, rest = match.groups()
+                # Хвост из пробелов и разделителей не относится к числу
+                stripped = token.rstrip(' .,\'')
+                rest = token[len(stripped):] + rest
+                value = _parse_digits(stripped)
+
+    if value is None:
+        return None
+
+    unit = _normalize_unit(rest)
+    if unit is None:
+        return None
+    return ParsedNumber(-value if sign == '-' else value, unit)
+
+
+def parse_tolerance(tolerance) -> Tuple[Fraction, Fraction]:
+    """Допуск поля: (абсолютный, относительный)"""
+    if tolerance in (None, '', 0):
+        return Fraction(0), Fraction(0)
+    if isinstance(tolerance, (int, float)):
+        return abs(Fraction(str(tolerance))), Fraction(0)
+    if isinstance(tolerance, str) and tolerance.strip().endswith('%'):
+        parsed = parse_number(tolerance.strip()[:-1])
+        return Fraction(0), (abs(parsed.value) / 100 if parsed else Fraction(0))
+    parsed = parse_number(str(tolerance))
+    return (abs(parsed.value) if parsed else Fraction(0)), Fraction(0)
+
+
+def numbers_equal(student: ParsedNumber, expected: ParsedNumber,
+                  tolerance: Tuple[Fraction, Fraction] = (Fraction(0), Fraction(0))) -> Optional[bool]:
+    """
+    Сравнить числа с допуском.
+
+    Единица необязательна: сравнивается, только если указана в обоих ответах.
+    Процент без пары сравнивается и как есть, и как доля ("50%" = "50" = "0,5").
+    Разные единицы - None (перевод "5 м" = "500 см" оставлен AI).
+    """
+    if student.unit and expected.unit and student.unit != expected.unit:
+        return None
+    absolute, relative = tolerance
+    allowed = max(absolute, relative * abs(expected.value))
+
+    candidates = [student.value]
+    if student.unit == '%' and not expected.unit:
+        candidates.append(student.value / 100)
+    elif expected.unit == '%' and not student.unit:
+        candidates.append(student.value * 100)
+    return any(abs(value - expected.value) <= allowed for value in candidates)
@@ -0,0 +1,197 @@
+"""
+Предварительная проверка шаблона (pre-grading)
+
+После сохранения шаблона фоновый поток генерирует вероятные ответы
+учеников по каждому полю (опечатки на расстоянии 1-2,
+синонимы групп поля из answer_synonyms.json), отбрасывает решаемые
+локально и заранее прогоняет остальные через AIAnswerChecker
+с ограничением скорости. Вердикты попадают в кэш AI на
+PREGRADE_CACHE_TTL (шаблон обычно сохраняют задолго до урока),
+и в конце урока проверка таких ответов обходится без вызова AI.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import Config
+from answer_matching import (CompiledField, get_compiled_template,
+                             TYPO_MIN_LENGTH, TYPO_SIMILARITY)
+from morphology import synonyms
+
+# Одна опечатка typo_edits меняет слово не больше чем на 2 (перестановка букв)
+MAX_EDIT_DISTANCE = 2
+# Проверок кандидатов локальными этапами на поле - ограничение CPU воркера
+PREGRADE_MAX_MATCH_ATTEMPTS = 1000
+
+# Соседние клавиши (ЙЦУКЕН и QWERTY) - самые частые замены при опечатке
+_KEYBOARD_ROWS = [
+    'йцукенгшщзхъ', 'фывапролджэ', 'ячсмитьбю',
+    'qwertyuiop', 'asdfghjkl', 'zxcvbnm',
+]
+KEYBOARD_NEIGHBOURS: Dict[str, str] = {}
+for _row in _KEYBOARD_ROWS:
+    for _i, _ch in enumerate(_row):
+        KEYBOARD_NEIGHBOURS[_ch] = _row[max(_i - 1, 0):_i] + _row[_i + 1:_i + 2]
+
+
+def typo_edits(word: str) -> List[str]:
+    """Опечатки на расстоянии 1: пропуск, перестановка, соседняя клавиша, повтор"""
+    edits = []
+    for i in range(len(word)):
+        edits.append(word[:i] + word[i + 1:])
+        if i + 1 < len(word):
+            edits.append(word[:i] + word[i + 1] + word[i] + word[i + 2:])
+        for ch in KEYBOARD_NEIGHBOURS.get(word[i], ''):
+            edits.append(word[:i] + ch + word[i + 1:])
+        edits.append(word[:i + 1] + word[i] + word[i + 1:])
+    # Порядок сохраняется: кандидаты детерминированы между запусками
+    return list(dict.fromkeys(e for e in edits if e and e != word))
+
+
+def typos_solved_locally(variant: str, depth: int) -> bool:
+    """
+    Любая опечатка глубины depth этого варианта засчитывается этапом 4
+    (допуск опечаток) - генерировать такие кандидаты для AI бессмысленно.
+    Схожесть не ниже 1 - расстояние / длина варианта.
+    """
+    length = len(variant)
+    return (length - depth > TYPO_MIN_LENGTH
+            and 1 - MAX_EDIT_DISTANCE * depth / length > TYPO_SIMILARITY)
+
+
+def candidate_answers(compiled_field: CompiledField) -> Iterator[str]:
+    """Кандидаты по мере надобности: синонимы, затем опечатки глубины 1 и 2"""
+    # Синонимы групп поля и противоположных групп (верно/неверно);
+    # решенные словарем синонимов отсеются при проверке
+    for group in sorted(compiled_field.variant_groups | compiled_field.opposite_groups):
+        for word in synonyms.members(group):
+            yield word.lower()
+
+    for variant in compiled_field.correct_variants:
+        if not typos_solved_locally(variant, 1):
+            yield from typo_edits(variant)
+    for variant in compiled_field.correct_variants:
+        if not typos_solved_locally(variant, 2):
+            for edit in typo_edits(variant):
+                yield from typo_edits(edit)
+
+
+def predict_answers(compiled_field: CompiledField, max_answers: int) -> List[str]:
+    """
+    Вероятные ответы учеников по полю, которые не решаются локально
+    и поэтому дойдут до AI при проверке.
+    """
+    if not compiled_field.correct_variants:
+        return []
+
+    result = []
+    seen = set()
+    attempts = 0
+    for candidate in candidate_answers(compiled_field):
+        if len(result) >= max_answers or attempts >= PREGRADE_MAX_MATCH_ATTEMPTS:
+            break
+        if len(candidate) <= 1 or candidate in seen:
+            continue
+        seen.add(candidate)
+        attempts += 1
+        if compiled_field.match(candidate):
+            continue
+        # Ключ кэша не зависит от регистра - одна проверка на ответ
+        result.append(candidate)
+    return result
+
+
+class PreGrader:
+    """Фоновая очередь предварительной проверки шаблонов"""
+
+    def __init__(self, checker_factory: Callable):
+        # Фабрика AIAnswerChecker (get_ai_checker из app.py)
+        self.checker_factory = checker_factory
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, template_id: str) -> bool:
+        """Поставить шаблон в очередь (повторное сохранение не дублирует задачу)"""
+        with self._lock:
+            if template_id in self._scheduled:
+                return False
+            self._scheduled.add(template_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ai-pregrader', daemon=True)
+                self._thread.start()
+        self._queue.put(template_id)
+        return True
+
+    def _run(self):
+        from ai_config import AIConfig
+
+        while True:
+            template_id = self._queue.get()
+            with self._lock:
+                self._scheduled.discard(template_id)
+            try:
+                # Весь шаблон проверяется с одними настройками
+                with AIConfig.pinned():
+                    self.pregrade_template(template_id)
+            except Exception as e:
+                print(f"⚠️ Ошибка предварительной проверки шаблона {template_id}: {e}")
+
+    def pregrade_template(self, template_id: str) -> Dict:
+        """Прогнать вероятные ответы по всем полям шаблона через AI"""
+        from ai_config import AIConfig
+
+        settings = AIConfig.current()
+        summary = {'checked': 0, 'cached': 0, 'skipped_fields': 0}
+        checker = self.checker_factory()
+        if checker is None or not settings.CACHE_AI_RESPONSES:
+            return summary
+
+        # Шаблон читается в момент обработки - учитываются последние правки
+        template_path = os.path.join(Config.TEMPLATES_FOLDER, f"{template_id}.json")
+        if not os.path.exists(template_path):
+            return summary
+        with open(template_path, 'r', encoding='utf-8') as f:
+            template = json.load(f)
+
+        delay = 60.0 / max(float(settings.PREGRADE_RATE_PER_MINUTE), 1.0)
+        print(f"🔮 Предварительная проверка шаблона {template_id}")
+
+        compiled_template = get_compiled_template(template_path, template)
+        for field in template.get('fields', []):
+            if not field.get('checkable', True):
+                summary['skipped_fields'] += 1
+                continue
+
+            compiled_field = compiled_template.field(field.get('id'))
+            correct_variants = compiled_field.correct_variants
+            for answer in predict_answers(compiled_field, int(settings.PREGRADE_MAX_PER_FIELD)):
+                # Те же аргументы, что в check_answers - иначе ключ кэша не совпадет
+                result = checker.check_answer(
+                    student_answer=answer,
+                    correct_variants=correct_variants,
+                    question_context=correct_variants[0],
+                    system_prompt=settings.SYSTEM_PROMPT,
+                    model_name=settings.GEMINI_MODEL,
+                    cache_ttl=int(settings.PREGRADE_CACHE_TTL)
+                )
+                if result.from_cache:
+                    summary['cached'] += 1
+                    continue
+
+                if result.ai_provider == 'fallback':
+                    # Провайдер недоступен или исчерпана квота - не тратим ее дальше
+                    print(f"⚠️ Предварительная проверка {template_id} прервана: AI недоступен")
+                    return summary
+
+                summary['checked'] += 1
+                time.sleep(delay)
+
+        print(f"🔮 Шаблон {template_id}: проверено {summary['checked']}, "
+              f"уже в кэше {summary['cached']}")
+        return summary
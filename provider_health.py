@@ -0,0 +1,125 @@
+"""
+Оценка здоровья AI провайдеров
+
+Для каждой пары (провайдер, модель) в процессе копятся доля успешных
+ответов (экспоненциальное среднее) и последние задержки. По ним
+AIAnswerChecker понижает в цепочке провайдеров нездоровых и считает
+дедлайн p95 для hedged-запросов. Там же суммируются токены запросов.
+
+Ошибки со временем забываются: отклонение доли успехов от 1 и число
+наблюдений убывают вдвое за HEALTH_HALF_LIFE секунд, поэтому понижение
+провайдера длится, пока он продолжает ошибаться, а после паузы он
+возвращается на свое место в цепочке и снова получает запросы.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Вес нового наблюдения в среднем доле успехов
+SUCCESS_ALPHA = 0.2
+LATENCY_SAMPLES = 200
+
+# Провайдер понижается в цепочке, только если оценка ниже порога и за ней
+# достаточно недавних наблюдений; одна медленная или ошибочная проверка не понижает
+HEALTH_HALF_LIFE = float(os.getenv('AI_HEALTH_HALF_LIFE', '300'))
+HEALTH_MIN_SAMPLES = float(os.getenv('AI_HEALTH_MIN_SAMPLES', '5'))
+HEALTH_DEMOTE_SCORE = float(os.getenv('AI_HEALTH_DEMOTE_SCORE', '0.5'))
+
+
+class ProviderHealth:
+    """Статистика успехов и задержек провайдеров в пределах процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # [доля успехов, число наблюдений, время последнего наблюдения]
+        self._success: Dict[Tuple[str, str], List[float]] = {}
+        self._latency: Dict[Tuple[str, str], deque] = {}
+        self._usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    @staticmethod
+    def _decayed(state: Optional[List[float]], now: float) -> Tuple[float, float]:
+        """Доля успехов и число наблюдений с учетом забывания"""
+        if not state:
+            return 1.0, 0.0
+        success, samples, updated = state
+        factor = 0.5 ** (max(now - updated, 0.0) / HEALTH_HALF_LIFE) if HEALTH_HALF_LIFE > 0 else 1.0
+        return 1.0 - (1.0 - success) * factor, samples * factor
+
+    def record(self, provider: str, model: str, success: bool, latency: float):
+        key = (provider, model)
+        now = time.monotonic()
+        with self._lock:
+            previous, samples = self._decayed(self._success.get(key), now)
+            current = previous + SUCCESS_ALPHA * ((1.0 if success else 0.0) - previous)
+            self._success[key] = [current, samples + 1, now]
+            if success:
+                # Задержки ошибок (таймауты) не описывают обычную скорость ответа
+                self._latency.setdefault(key, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def record_usage(self, provider: str, model: str, usage: Dict[str, int]):
+        """Учесть токены запроса (prompt_tokens, output_tokens, cached_tokens)"""
+        with self._lock:
+            totals = self._usage.setdefault((provider, model), {'requests': 0})
+            totals['requests'] += 1
+            for name, value in usage.items():
+                totals[name] = totals.get(name, 0) + int(value or 0)
+
+    def percentile(self, provider: str, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Перцентиль задержки (0 < q < 1) или None, если замеров мало"""
+        with self._lock:
+            samples = sorted(self._latency.get((provider, model), ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def score(self, provider: str, model: str, timeout: float) -> float:
+        """Оценка 0..1: доля успехов минус штраф за медленные ответы (не больше 0.5)"""
+        with self._lock:
+            success, _ = self._decayed(self._success.get((provider, model)), time.monotonic())
+        p95 = self.percentile(provider, model, 0.95)
+        penalty = min(p95 / timeout, 1.0) * 0.5 if p95 and timeout else 0.0
+        return max(success - penalty, 0.0)
+
+    def is_degraded(self, provider: str, model: str, timeout: float) -> bool:
+        """
+        Понизить ли провайдера в цепочке.
+
+        Нужны и низкая оценка, и не меньше HEALTH_MIN_SAMPLES недавних
+        наблюдений. Штраф за задержку не превышает порога, так что одна
+        медленность без ошибок провайдера не понижает.
+        """
+        with self._lock:
+            _, samples = self._decayed(self._success.get((provider, model)), time.monotonic())
+        if samples < HEALTH_MIN_SAMPLES:
+            return False
+        return self.score(provider, model, timeout) < HEALTH_DEMOTE_SCORE
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Сводка для /api/ai/status"""
+        now = time.monotonic()
+        with self._lock:
+            states = {key: self._decayed(state, now) for key, state in self._success.items()}
+        result = {}
+        for (provider, model), (success, samples) in states.items():
+            p50 = self.percentile(provider, model, 0.5)
+            p95 = self.percentile(provider, model, 0.95)
+            item = {
+                'success_rate': round(success, 3),
+                'samples': round(samples, 1),
+                'latency_p50': round(p50, 3) if p50 is not None else None,
+                'latency_p95': round(p95, 3) if p95 is not None else None
+            }
+            with self._lock:
+                usage = dict(self._usage.get((provider, model), {}))
+            if usage:
+                item['usage'] = usage
+                item['avg_prompt_tokens'] = round(usage.get('prompt_tokens', 0) / usage['requests'], 1)
+            result[f"{provider}/{model}"] = item
+        return result
+
+
+# Глобальная статистика процесса
+provider_health = ProviderHealth()
@@ -0,0 +1,206 @@
+"""
+Очередь отложенной AI проверки
+
+Если AI не ответил (ошибка провайдера, исчерпана квота, открыт
+circuit breaker), поле работы ученика не засчитывается навсегда, а
+попадает в очередь (submission_id, индекс поля) в локальной базе
+SQLite. Фоновый поток в каждом воркере забирает из нее задачи не чаще
+REGRADE_RATE_PER_MINUTE в минуту на все воркеры вместе, проверяет поле
+заново, обновляет работу в submission_store и строку в Google Sheets.
+Пик нагрузки так растягивается во времени.
+
+Поля фоновой проверки (pending) тоже ставятся в очередь - со сроком
+через PENDING_RECOVERY_DELAY. Фоновая проверка снимает задачу, когда
+запишет вердикт; если воркер перезапустился раньше, поле проверит очередь.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from config import Config
+from local_db import get_sqlite_connection
+
+# Задача, взятая воркером, возвращается в очередь, если он не ответил за это время
+CLAIM_LEASE = 300
+# Пауза перед повтором: 30 с, 60 с, 120 с ... не больше часа
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+# Срок страховочной задачи поля фоновой проверки
+PENDING_RECOVERY_DELAY = int(os.getenv('AI_PENDING_RECOVERY_DELAY', 600))
+IDLE_SLEEP = 1
+
+
+class RegradeQueue:
+    """Постоянная очередь полей, ожидающих повторной AI проверки"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'AI_REGRADE_DB', os.path.join(Config.DATA_FOLDER, 'regrade_queue.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _get_connection(self):
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS regrade_queue (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            submission_id TEXT NOT NULL,
+                            field_index INTEGER NOT NULL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            next_attempt_at REAL NOT NULL,
+                            last_error TEXT,
+                            created_at REAL NOT NULL,
+                            UNIQUE (submission_id, field_index)
+                        )
+                    """)
+                    # Время последней выдачи задачи - общий для воркеров ограничитель скорости
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS regrade_rate (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            last_claim_at REAL NOT NULL
+                        )
+                    """)
+                    self._schema_ready = True
+        return conn
+
+    def enqueue(self, submission_id: str, field_index: int, error: str = '',
+                delay: float = RETRY_BASE_DELAY):
+        """Поставить поле в очередь (повторная постановка не дублирует задачу)"""
+        now = time.time()
+        self._get_connection().execute("""
+            INSERT OR IGNORE INTO regrade_queue
+                (submission_id, field_index, next_attempt_at, last_error, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (submission_id, field_index, now + delay, (error or '')[:500], now))
+
+    def cancel(self, submission_id: str, field_index: int):
+        """Снять задачу поля (фоновая проверка записала вердикт)"""
+        self._get_connection().execute(
+            "DELETE FROM regrade_queue WHERE submission_id = ? AND field_index = ?",
+            (submission_id, field_index)
+        )
+
+    def claim(self, rate_per_minute: float) -> Optional[Dict]:
+        """
+        Взять задачу, срок которой наступил, если общий лимит скорости позволяет.
+        Задача остается в очереди до complete() - при падении воркера ее заберут снова.
+        """
+        interval = 60.0 / max(float(rate_per_minute), 0.01)
+        now = time.time()
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT last_claim_at FROM regrade_rate WHERE id = 1").fetchone()
+            if row and now - row[0] < interval:
+                conn.execute("ROLLBACK")
+                return None
+
+            item = conn.execute("""
+                SELECT id, submission_id, field_index, attempts FROM regrade_queue
+                WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1
+            """, (now,)).fetchone()
+            if item is None:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.execute("UPDATE regrade_queue SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?",
+                         (now + CLAIM_LEASE, item[0]))
+            conn.execute("INSERT OR REPLACE INTO regrade_rate (id, last_claim_at) VALUES (1, ?)", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return {'id': item[0], 'submission_id': item[1], 'field_index': item[2], 'attempts': item[3] + 1}
+
+    def complete(self, item_id: int):
+        self._get_connection().execute("DELETE FROM regrade_queue WHERE id = ?", (item_id,))
+
+    def retry(self, item_id: int, attempts: int, error: str = ''):
+        """Вернуть задачу в очередь с растущей паузой"""
+        delay = min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+        self._get_connection().execute(
+            "UPDATE regrade_queue SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (time.time() + delay, (error or '')[:500], item_id)
+        )
+
+    def stats(self) -> Dict:
+        """Размер очереди и возраст самой старой задачи (для /api/ai/status)"""
+        try:
+            count, oldest = self._get_connection().execute(
+                "SELECT COUNT(*), MIN(created_at) FROM regrade_queue"
+            ).fetchone()
+        except Exception as e:
+            print(f"⚠️ Ошибка очереди перепроверки: {e}")
+            return {}
+        return {
+            'pending': count,
+            'oldest_age': round(time.time() - oldest, 1) if oldest else None
+        }
+
+
+class RegradeWorker:
+    """Фоновый поток, разбирающий очередь перепроверки"""
+
+    def __init__(self, queue: RegradeQueue, regrade: Callable[[Dict], Optional[str]],
+                 give_up: Callable[[Dict, str], None]):
+        # regrade(задача) -> None, если поле проверено, иначе текст ошибки (повторить позже);
+        # give_up(задача, ошибка) - попытки исчерпаны
+        self.queue = queue
+        self.regrade = regrade
+        self.give_up = give_up
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ai-regrader', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from ai_config import AIConfig
+
+        while True:
+            try:
+                item = None
+                settings = AIConfig.current()
+                if settings.REGRADE_ENABLED:
+                    item = self.queue.claim(settings.REGRADE_RATE_PER_MINUTE)
+                if item is None:
+                    time.sleep(IDLE_SLEEP)
+                    continue
+                # Задача проверяется с одними настройками от начала до конца
+                with AIConfig.pinned():
+                    self.process(item)
+            except Exception as e:
+                print(f"⚠️ Ошибка очереди перепроверки: {e}")
+                time.sleep(IDLE_SLEEP)
+
+    def process(self, item: Dict):
+        from ai_config import AIConfig
+
+        try:
+            error = self.regrade(item)
+        except Exception as e:
+            error = str(e)
+
+        if error is None:
+            self.queue.complete(item['id'])
+        elif item['attempts'] >= int(AIConfig.current().REGRADE_MAX_ATTEMPTS):
+            print(f"⚠️ Перепроверка {item['submission_id']}/{item['field_index']} "
+                  f"прекращена после {item['attempts']} попыток: {error}")
+            self.queue.complete(item['id'])
+            self.give_up(item, error)
+        else:
+            self.queue.retry(item['id'], item['attempts'], error)
+
+
+# Глобальная очередь
+regrade_queue = RegradeQueue()
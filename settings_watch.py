@@ -0,0 +1,131 @@
+"""
+Распространение изменений настроек AI между воркерами
+
+Каждый воркер gunicorn держит свой снимок настроек (ai_config.settings_store).
+Фоновый поток SettingsWatcher заменяет снимок, как только ai_settings.json
+изменился, и вызывает подписчиков (например, пересоздание AI checker):
+
+    postgres - если кэш работает на PostgreSQL, воркер, сохранивший настройки,
+               отправляет NOTIFY ai_settings, остальные получают его по LISTEN
+               и перечитывают файл сразу. mtime файла в этом режиме
+               проверяется лишь раз в LISTEN_FILE_CHECK_INTERVAL секунд - на
+               случай правки файла вручную или потерянного уведомления;
+    mtime    - без PostgreSQL mtime файла проверяется раз в WATCH_INTERVAL секунд.
+
+Пока поток работает, запросы не проверяют файл сами - чтение настроек
+в обработчиках ничего не стоит.
+"""
+
+import select
+import threading
+import time
+from typing import Callable, List, Optional
+
+from ai_config import SettingsSnapshot, SettingsStore, settings_store
+
+try:
+    from ai_cache import cache_manager
+except ImportError:
+    cache_manager = None
+
+SETTINGS_CHANNEL = 'ai_settings'
+WATCH_INTERVAL = 0.5
+# Режим postgres: ожидание уведомления и редкая проверка файла
+LISTEN_WAIT = 5
+LISTEN_FILE_CHECK_INTERVAL = 60
+# Повторная попытка LISTEN после потери подключения к PostgreSQL
+LISTEN_RETRY_INTERVAL = 60
+
+
+class SettingsWatcher:
+    """Фоновый поток, подменяющий снимок настроек процесса при их изменении"""
+
+    def __init__(self, store: SettingsStore):
+        self.store = store
+        self.mode: Optional[str] = None
+        self._listeners: List[Callable[[SettingsSnapshot], None]] = []
+        self._seen: Optional[SettingsSnapshot] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[SettingsSnapshot], None]):
+        """callback(новый снимок) вызывается из потока наблюдения при каждой смене настроек"""
+        self._listeners.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._seen = self.store.get()
+                self._thread = threading.Thread(target=self._run, name='ai-settings-watch', daemon=True)
+                self._thread.start()
+                self.store.watched = True
+
+    def publish(self) -> bool:
+        """Сообщить остальным воркерам, что файл настроек изменился"""
+        if cache_manager is None:
+            return False
+        return cache_manager.notify(SETTINGS_CHANNEL, repr(self.store.get().version))
+
+    def _run(self):
+        conn, listen_at, file_check_at = None, 0.0, 0.0
+        while True:
+            try:
+                if conn is None and cache_manager is not None and time.monotonic() >= listen_at:
+                    listen_at = time.monotonic() + LISTEN_RETRY_INTERVAL
+                    conn = cache_manager.listen(SETTINGS_CHANNEL)
+                self.mode = 'postgres' if conn is not None else 'mtime'
+
+                notified = False
+                if conn is not None:
+                    try:
+                        notified = self._wait_notify(conn)
+                    except Exception as e:
+                        print(f"⚠️ LISTEN {SETTINGS_CHANNEL} прерван, настройки проверяются по mtime: {e}")
+                        conn = self._close(conn)
+                else:
+                    time.sleep(WATCH_INTERVAL)
+
+                if conn is not None and not notified and time.monotonic() < file_check_at:
+                    # LISTEN работает - файл не опрашивается на каждом шаге
+                    continue
+                file_check_at = time.monotonic() + LISTEN_FILE_CHECK_INTERVAL
+                # Уведомление - файл перечитывается сразу, иначе только при смене mtime
+                self.check(force=notified)
+            except Exception as e:
+                print(f"⚠️ Ошибка наблюдения за настройками AI: {e}")
+                time.sleep(WATCH_INTERVAL)
+
+    def check(self, force: bool = False):
+        """Перепроверить файл и оповестить подписчиков, если снимок сменился"""
+        snapshot = self.store.refresh(force=force) if force else self.store.revalidate()
+        if snapshot is self._seen:
+            return
+        self._seen = snapshot
+        print(f"⚙️ Настройки AI обновлены (версия {snapshot.version})")
+        for callback in list(self._listeners):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"⚠️ Ошибка применения новых настроек AI: {e}")
+
+    @staticmethod
+    def _wait_notify(conn) -> bool:
+        """Ждать уведомление не дольше LISTEN_WAIT"""
+        if select.select([conn], [], [], LISTEN_WAIT) == ([], [], []):
+            return False
+        conn.poll()
+        notified = bool(conn.notifies)
+        del conn.notifies[:]
+        return notified
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return None
+
+
+# Глобальный наблюдатель за настройками процесса
+settings_watcher = SettingsWatcher(settings_store)
@@ -132,6 +132,14 @@ async function saveSettings() {
         system_prompt: document.getElementById('systemPrompt').value,
         cache_enabled: document.getElementById('cacheEnabled').checked,
         cache_duration: parseInt(document.getElementById('cacheDuration').value),
+        cache_negative_ttl: parseInt(document.getElementById('cacheNegativeTtl').value),
+        cache_min_confidence: parseFloat(document.getElementById('cacheMinConfidence').value),
+        pregrade_enabled: document.getElementById('pregradeEnabled').checked,
+        pregrade_rate_per_minute: parseInt(document.getElementById('pregradeRate').value),
+        pregrade_cache_ttl: parseInt(document.getElementById('pregradeCacheTtl').value),
+        async_grading: document.getElementById('asyncGrading').checked,
+        regrade_enabled: document.getElementById('regradeEnabled').checked,
+        regrade_rate_per_minute: parseInt(document.getElementById('regradeRate').value),
         logging_enabled: document.getElementById('loggingEnabled').checked,
         log_file: document.getElementById('logFile').value
     };
@@ -186,6 +194,14 @@ async function loadSettings() {
             document.getElementById('systemPrompt').value = config.system_prompt;
             document.getElementById('cacheEnabled').checked = config.cache_enabled;
             document.getElementById('cacheDuration').value = config.cache_duration;
+            document.getElementById('cacheNegativeTtl').value = config.cache_negative_ttl ?? 60;
+            document.getElementById('cacheMinConfidence').value = config.cache_min_confidence ?? 0.7;
+            document.getElementById('pregradeEnabled').checked = config.pregrade_enabled ?? false;
+            document.getElementById('pregradeRate').value = config.pregrade_rate_per_minute ?? 20;
+            document.getElementById('pregradeCacheTtl').value = config.pregrade_cache_ttl ?? 604800;
+            document.getElementById('asyncGrading').checked = config.async_grading ?? false;
+            document.getElementById('regradeEnabled').checked = config.regrade_enabled ?? true;
+            document.getElementById('regradeRate').value = config.regrade_rate_per_minute ?? 10;
             document.getElementById('loggingEnabled').checked = config.logging_enabled;
             document.getElementById('logFile').value = config.log_file;
 
@@ -270,6 +286,14 @@ function resetSettings() {
         
         document.getElementById('cacheEnabled').checked = true;
         document.getElementById('cacheDuration').value = 3600;
+        document.getElementById('cacheNegativeTtl').value = 60;
+        document.getElementById('cacheMinConfidence').value = 0.7;
+        document.getElementById('pregradeEnabled').checked = false;
+        document.getElementById('pregradeRate').value = 20;
+        document.getElementById('pregradeCacheTtl').value = 604800;
+        document.getElementById('asyncGrading').checked = false;
+        document.getElementById('regradeEnabled').checked = true;
+        document.getElementById('regradeRate').value = 10;
         document.getElementById('loggingEnabled').checked = true;
         document.getElementById('logFile').value = 'logs/ai_checks.log';
         
@@ -302,13 +326,14 @@ async function clearCache() {
 // Просмотр логов
 async function viewLogs() {
     try {
-        const response = await fetch('/api/ai/logs');
+        // Сервер отдает логи от новых к старым, постранично
+        const response = await fetch('/api/ai/logs?limit=50');
         const result = await response.json();
         
         if (result.success) {
             let html = '<div style="max-height: 400px; overflow-y: auto; font-family: monospace; font-size: 12px;">';
             
-            result.logs.slice(-50).reverse().forEach(log => {
+            result.logs.forEach(log => {
                 const time = new Date(log.timestamp).toLocaleString('ru-RU');
                 const statusIcon = log.success ? '✅' : '❌';
                 
@@ -368,12 +393,14 @@ async function loadStatistics() {
             document.getElementById('aiChecks').textContent = stats.ai_checks || 0;
             document.getElementById('successRate').textContent = (stats.success_rate || 0) + '%';
             
-            // Статистика кэша
-            document.getElementById('cacheTotalEntries').textContent = stats.cache_total_entries || 0;
-            document.getElementById('cacheValidEntries').textContent = stats.cache_valid_entries || 0;
-            document.getElementById('cacheTotalUsage').textContent = stats.cache_total_usage || 0;
-            document.getElementById('cacheAvgConfidence').textContent = 
-                stats.cache_avg_confidence ? stats.cache_avg_confidence.toFixed(2) : '0.00';
+            // Статистика кэша (элементы есть не на всех версиях страницы)
+            setStatText('cacheSize', stats.cache_size || 0);
+            setStatText('cacheHitRatio', Math.round((stats.cache_hit_ratio || 0) * 100) + '%');
+            setStatText('cacheTotalEntries', stats.cache_total_entries || 0);
+            setStatText('cacheValidEntries', stats.cache_valid_entries || 0);
+            setStatText('cacheTotalUsage', stats.cache_total_usage || 0);
+            setStatText('cacheAvgConfidence',
+                stats.cache_avg_confidence ? stats.cache_avg_confidence.toFixed(2) : '0.00');
             
             // Обновляем эффективность кэша
             updateCacheEfficiency(stats);
@@ -383,6 +410,14 @@ async function loadStatistics() {
     }
 }
 
+// Установка текста элемента статистики, если он есть на странице
+function setStatText(id, value) {
+    const element = document.getElementById(id);
+    if (element) {
+        element.textContent = value;
+    }
+}
+
 // Обновление эффективности кэша
 function updateCacheEfficiency(stats) {
     const efficiencyElement = document.getElementById('cacheEfficiency');
@@ -422,6 +457,16 @@ async function checkAIStatus() {
         } else if (!status.api_key_configured) {
             showAlert('warning', '⚠️ API ключ не настроен. Введите ключ для активации AI проверки.');
         }
+        
+        (status.circuit_breakers || [])
+            .filter(breaker => breaker.state === 'open')
+            .forEach(breaker => showAlert('warning',
+                `⚠️ ${breaker.provider}/${breaker.model} временно отключен после ошибок ` +
+                `(повтор через ${Math.ceil(breaker.retry_in)} с): ${breaker.last_error || ''}`));
+        
+        if (status.regrade_queue?.pending > 0) {
+            showAlert('info', `⏳ Ожидают перепроверки AI: ${status.regrade_queue.pending} ответов`);
+        }
     } catch (error) {
         console.error('Ошибка проверки статуса:', error);
     }
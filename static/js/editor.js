@@ -473,6 +473,12 @@ function showFieldProperties(field) {
         <textarea id="fieldVariants" style="width:100%; height:100px; margin-bottom:10px; padding:5px; border:1px solid #ddd; border-radius:3px;">
 ${fieldData.variants.join('\n')}
         </textarea>
+        <label>Допуск для числовых ответов (0.01 или 1%):</label>
+        <input type="text" id="fieldTolerance" value="${fieldData.tolerance ?? ''}" style="width:100%; margin-bottom:10px; padding:5px; border:1px solid #ddd; border-radius:3px;">
+        <label style="display:block; margin-bottom:10px;">
+            <input type="checkbox" id="fieldSynonyms" ${fieldData.synonyms === false ? '' : 'checked'}>
+            Засчитывать синонимы из словаря
+        </label>
         <button id="updateFieldBtn" class="btn" style="width:100%; margin-bottom:10px;">Обновить данные</button>
         <button id="deleteFieldBtn" class="btn btn-danger" style="width:100%;">Удалить поле</button>
         <div style="margin-top:15px; font-size:12px; color:#666;">
@@ -487,10 +493,26 @@ ${fieldData.variants.join('\n')}
         fieldData.variants = document.getElementById('fieldVariants').value
             .split('\n').map(v => v.trim()).filter(v => v);
     });
+    document.getElementById('fieldTolerance').addEventListener('blur', updateFieldTolerance);
+    document.getElementById('fieldSynonyms').addEventListener('change', (e) => {
+        // Список групп, заданный в JSON шаблона, при включении не затираем
+        if (!e.target.checked) fieldData.synonyms = false;
+        else if (fieldData.synonyms === false) delete fieldData.synonyms;
+    });
     document.getElementById('updateFieldBtn').onclick = () => {
         fieldData.variants = document.getElementById('fieldVariants').value
             .split('\n').map(v => v.trim()).filter(v => v);
+        updateFieldTolerance();
     };
+
+    function updateFieldTolerance() {
+        const tolerance = document.getElementById('fieldTolerance').value.trim();
+        if (tolerance) {
+            fieldData.tolerance = tolerance;
+        } else {
+            delete fieldData.tolerance;
+        }
+    }
     document.getElementById('deleteFieldBtn').onclick = () => deleteField();
 }
 
@@ -596,8 +618,126 @@ async function loadSelectedTemplate() {
             }
             else showModal('В шаблоне нет файлов');
             updateFieldCount();
+            loadLearnedVariants();
         } else showModal('Ошибка загрузки: ' + (template.error || 'Неизвестная'));
     } catch (err) {
         showModal('Ошибка: ' + err.message);
     }
-}
\ No newline at end of file
+}
+
+// ==================== Ответы, проверенные AI ====================
+
+const LEARNED_ACTIONS = {
+    approve: 'Как решил AI',
+    accept: 'Засчитывать',
+    reject: 'Не засчитывать',
+    dismiss: 'Пропустить'
+};
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text ?? '';
+    return div.innerHTML;
+}
+
+async function loadLearnedVariants() {
+    const list = document.getElementById('learnedList');
+    const applyBtn = document.getElementById('learnedApplyBtn');
+    const approveAllBtn = document.getElementById('learnedApproveAllBtn');
+    if (!list) return;
+    if (!currentTemplate.template_id) {
+        list.innerHTML = '<p style="color: #666; font-style: italic;">Сначала загрузите или сохраните шаблон</p>';
+        return;
+    }
+
+    try {
+        const response = await fetch(`/api/templates/${encodeURIComponent(currentTemplate.template_id)}/learned`);
+        const result = await response.json();
+        if (!result.success) {
+            list.innerHTML = `<p style="color: #e74c3c;">${escapeHtml(result.error)}</p>`;
+            return;
+        }
+
+        const hasVariants = result.variants.length > 0;
+        applyBtn.disabled = !hasVariants;
+        approveAllBtn.disabled = !hasVariants;
+        if (!hasVariants) {
+            list.innerHTML = '<p style="color: #666; font-style: italic;">Новых ответов нет</p>';
+            return;
+        }
+
+        const options = Object.entries(LEARNED_ACTIONS)
+            .map(([action, label]) => `<option value="${action}">${label}</option>`).join('');
+        list.innerHTML = result.variants.map((item, index) => `
+            <div class="learned-item" data-field-id="${escapeHtml(item.field_id)}" data-answer="${escapeHtml(item.answer)}"
+                 style="padding: 8px; margin-bottom: 6px; background: #f8f9fa; border-radius: 4px;
+                        border-left: 3px solid ${item.ai_verdict ? '#27ae60' : '#e74c3c'};">
+                <label style="display: flex; gap: 6px; align-items: center;">
+                    <input type="checkbox" class="learned-check" id="learned_${index}">
+                    <strong>"${escapeHtml(item.answer)}"</strong>
+                </label>
+                <div style="font-size: 12px; color: #666;">
+                    Поле ${escapeHtml(item.field_id)} · AI: ${item.ai_verdict ? '✅ верно' : '❌ неверно'}
+                    (${item.accepted_count}/${item.rejected_count}, уверенность ${item.avg_confidence})
+                </div>
+                <select class="select learned-action" style="margin-top: 4px;">${options}</select>
+            </div>
+        `).join('');
+    } catch (err) {
+        list.innerHTML = `<p style="color: #e74c3c;">Ошибка: ${escapeHtml(err.message)}</p>`;
+    }
+}
+
+async function applyLearnedDecisions() {
+    const decisions = [...document.querySelectorAll('#learnedList .learned-item')]
+        .filter(item => item.querySelector('.learned-check').checked)
+        .map(item => ({
+            field_id: item.dataset.fieldId,
+            answer: item.dataset.answer,
+            action: item.querySelector('.learned-action').value
+        }));
+    if (decisions.length === 0) { showModal('Отметьте ответы для переноса'); return; }
+    await sendLearnedDecisions({ decisions });
+}
+
+async function approveAllLearned() {
+    const minConfidence = parseFloat(document.getElementById('learnedMinConfidence').value) || 0;
+    if (!confirm(`Согласиться с AI по всем ответам с уверенностью от ${minConfidence}?`)) return;
+    await sendLearnedDecisions({ approve_all: true, min_confidence: minConfidence });
+}
+
+async function sendLearnedDecisions(body) {
+    try {
+        const response = await fetch(`/api/templates/${encodeURIComponent(currentTemplate.template_id)}/learned/approve`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        const result = await response.json();
+        if (!result.success) { showModal('Ошибка: ' + result.error); return; }
+
+        // Сервер уже изменил шаблон - подтягиваем варианты, чтобы следующее сохранение их не затерло
+        await refreshFieldVariants();
+        showModal(`Засчитывается: ${result.accepted}, не засчитывается: ${result.rejected}, ` +
+                  `пропущено: ${result.dismissed + result.skipped}`);
+        loadLearnedVariants();
+    } catch (err) {
+        showModal('Ошибка: ' + err.message);
+    }
+}
+
+async function refreshFieldVariants() {
+    const response = await fetch(`/load_template/${encodeURIComponent(currentTemplate.template_id)}`);
+    if (!response.ok) return;
+    const saved = await response.json();
+    const savedFields = Object.fromEntries((saved.fields || []).map(field => [field.id, field]));
+    currentTemplate.fields.forEach(field => {
+        const savedField = savedFields[field.id];
+        if (savedField) {
+            field.variants = savedField.variants || [];
+            field.rejected_variants = savedField.rejected_variants || [];
+        }
+    });
+    // Открытые свойства поля показывают старые варианты
+    clearFieldSelection();
+}
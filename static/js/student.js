@@ -474,7 +474,10 @@ function showResults(result) {
     // Статус Google Sheets
     const sheetsStatus = document.getElementById('sheetsStatus');
     if (sheetsStatus) {
-        if (result.sheets_result?.success) {
+        if (result.sheets_result?.deferred) {
+            sheetsStatus.textContent = "⏳ " + result.sheets_result.message;
+            sheetsStatus.style.color = "#666";
+        } else if (result.sheets_result?.success) {
             sheetsStatus.innerHTML = "💾 Результаты и ответы сохранены в Google Таблице";
             sheetsStatus.style.color = "#27ae60";
 
@@ -488,6 +491,9 @@ function showResults(result) {
         } else if (result.sheets_result) {
             sheetsStatus.textContent = "❌ Не удалось сохранить в Google Таблицу: " + (result.sheets_result?.error || "");
             sheetsStatus.style.color = "#e74c3c";
+        } else if (result.pending_count > 0) {
+            sheetsStatus.textContent = "⏳ Результаты будут сохранены после проверки AI";
+            sheetsStatus.style.color = "#666";
         }
     }
 
@@ -505,11 +511,19 @@ function showResults(result) {
             if (detail.check_method) {
                 const methodNames = {
                     'exact': '🎯 Точное совпадение',
-                    'numeric_sequence': '🔢 Числовая последовательность',
+                    'numeric': '🔢 Числовой ответ',
+                    'numeric_mismatch': '🔢 Другое число',
                     'partial_match': '📝 Частичное совпадение',
                     'similarity_85': '📊 Схожесть 85%',
+                    'exact_reject': '🚫 Отклонено учителем',
+                    'morphology': '🔤 Другая форма слова',
+                    'morphology_reject': '🚫 Отклонено учителем',
+                    'synonym': '🔁 Синоним',
+                    'synonym_reject': '🔁 Противоположный ответ',
                     'ai': '🤖 Проверено AI',
                     'ai_error': '⚠️ Ошибка AI',
+                    'pending': '⏳ Проверяется AI...',
+                    'ai_deferred': '⏳ Будет перепроверено AI',
                     'none': '❓ Не проверено'
                 };
                 
@@ -602,6 +616,10 @@ function showResults(result) {
                         ">${v}</span>
                     `).join('') || '—'}
                 </div>
+                ${detail.closest_variant ? `
+                <div style="margin: 6px 0; font-size: 13px; color: #666;">
+                    <strong>Ближе всего к:</strong> ${detail.closest_variant}
+                </div>` : ''}
                 ${methodBadge}
                 ${aiInfo}
             `;
@@ -650,9 +668,70 @@ function showResults(result) {
     if (console && result.details) {
         console.log('Детальные результаты проверки:', result);
     }
+
+    if (result.submission_id && result.pending_count > 0) {
+        streamPendingVerdicts(result);
+    }
+}
+
+// Поток вердиктов AI асинхронной проверки (Server-Sent Events)
+let resultStream = null;
+
+function closeResultStream() {
+    if (resultStream) {
+        resultStream.close();
+        resultStream = null;
+    }
+}
+
+function streamPendingVerdicts(result) {
+    if (resultStream && resultStream.submissionId === result.submission_id) return;
+    closeResultStream();
+
+    if (!window.EventSource) {
+        showModal('Браузер не поддерживает получение результатов AI. Обновите страницу позже.');
+        return;
+    }
+
+    const stream = new EventSource(`/api/submissions/${result.submission_id}/events`);
+    stream.submissionId = result.submission_id;
+    resultStream = stream;
+
+    const applyTotals = (data) => {
+        result.correct_count = data.correct_count;
+        result.total_count = data.total_count;
+        result.percentage = data.percentage;
+        result.ai_check_count = data.ai_check_count;
+    };
+
+    stream.addEventListener('verdict', (event) => {
+        const data = JSON.parse(event.data);
+        // Повтор вердикта после переподключения просто перезаписывает поле
+        if (result.details[data.index]?.check_method === 'pending') {
+            result.pending_count = Math.max((result.pending_count || 1) - 1, 0);
+        }
+        result.details[data.index] = data.detail;
+        applyTotals(data);
+        showResults(result);
+    });
+
+    stream.addEventListener('complete', (event) => {
+        const data = JSON.parse(event.data);
+        applyTotals(data);
+        result.pending_count = 0;
+        result.sheets_result = data.sheets_result;
+        closeResultStream();
+        showResults(result);
+    });
+
+    stream.addEventListener('timeout', () => {
+        closeResultStream();
+        showModal('AI проверяет ответы дольше обычного. Итог будет сохранен в таблице.');
+    });
 }
 
 function resetTest() {
+    closeResultStream();
     currentTemplate = null;
     currentPage = 0;
     studentAnswers = {};
@@ -19,16 +19,17 @@ def test_ai_config():
     
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
         print(f"✅ AI модуль загружен успешно")
-        print(f"   API Key настроен: {AIConfig.GEMINI_API_KEY != 'YOUR_API_KEY_HERE'}")
-        print(f"   Модель: {AIConfig.GEMINI_MODEL}")
-        print(f"   AI проверка включена: {AIConfig.AI_CHECKING_ENABLED}")
-        print(f"   Логирование включено: {AIConfig.LOG_AI_REQUESTS}")
-        print(f"   Файл логов: {AIConfig.AI_LOG_FILE}")
+        print(f"   API Key настроен: {settings.GEMINI_API_KEY != 'YOUR_API_KEY_HERE'}")
+        print(f"   Модель: {settings.GEMINI_MODEL}")
+        print(f"   AI проверка включена: {settings.AI_CHECKING_ENABLED}")
+        print(f"   Логирование включено: {settings.LOG_AI_REQUESTS}")
+        print(f"   Файл логов: {settings.AI_LOG_FILE}")
         
         # Проверяем директорию для логов
-        log_dir = os.path.dirname(AIConfig.AI_LOG_FILE)
+        log_dir = os.path.dirname(settings.AI_LOG_FILE)
         if log_dir and not os.path.exists(log_dir):
             os.makedirs(log_dir)
             print(f"✅ Создана директория для логов: {log_dir}")
@@ -49,8 +50,9 @@ def test_ai_checker():
     try:
         from ai_checker_0 import AIAnswerChecker
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
-        checker = AIAnswerChecker(provider="gemini", api_key=AIConfig.GEMINI_API_KEY)
+        checker = AIAnswerChecker(provider="gemini", api_key=settings.GEMINI_API_KEY)
         print(f"✅ AI Checker создан успешно")
         print(f"   Провайдер: {checker.provider}")
         print(f"   API Key присутствует: {bool(checker.api_key)}")
@@ -93,6 +95,7 @@ def test_ai_check(checker):
     ]
     
     from ai_config import AIConfig
+    settings = AIConfig.current()
     from dataclasses import asdict
     
     for i, test in enumerate(test_cases, 1):
@@ -105,8 +108,8 @@ def test_ai_check(checker):
                 student_answer=test['student_answer'],
                 correct_variants=test['correct_variants'],
                 question_context=test['context'],
-                system_prompt=AIConfig.SYSTEM_PROMPT,
-                model_name=AIConfig.GEMINI_MODEL
+                system_prompt=settings.SYSTEM_PROMPT,
+                model_name=settings.GEMINI_MODEL
             )
             
             result_dict = asdict(result)
@@ -117,7 +120,7 @@ def test_ai_check(checker):
             print(f"  Провайдер: {result.ai_provider}")
             
             # Тест логирования
-            if AIConfig.LOG_AI_REQUESTS:
+            if settings.LOG_AI_REQUESTS:
                 log_entry = {
                     "timestamp": datetime.now().isoformat(),
                     "test_case": i,
@@ -127,7 +130,7 @@ def test_ai_check(checker):
                     "success": True
                 }
                 
-                log_file = AIConfig.AI_LOG_FILE
+                log_file = settings.AI_LOG_FILE
                 os.makedirs(os.path.dirname(log_file), exist_ok=True)
                 
                 with open(log_file, 'a', encoding='utf-8') as f:
@@ -151,8 +154,9 @@ def check_log_file():
     
     try:
         from ai_config import AIConfig
+        settings = AIConfig.current()
         
-        log_file = AIConfig.AI_LOG_FILE
+        log_file = settings.AI_LOG_FILE
         
         if not os.path.exists(log_file):
             print(f"⚠️  Файл логов не существует: {log_file}")
@@ -0,0 +1,137 @@
+"""
+Хранилище работ учеников на время асинхронной AI проверки
+
+В асинхронном режиме /check_answers сразу возвращает локально
+проверенные поля, а поля, требующие AI, помечает "pending" и
+проверяет в фоне. Состояние работы (детали по полям, ожидающие поля,
+результат записи в Google Sheets) лежит в локальной базе SQLite по
+submission_id - поток SSE может обслуживать другой воркер gunicorn,
+чем тот, что проверяет ответы.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+from local_db import get_sqlite_connection
+
+# Сколько хранить завершенные работы (поток SSE мог переподключиться)
+SUBMISSION_TTL = 24 * 3600
+# Поток SSE опрашивает базу с этим интервалом и закрывается по таймауту
+SUBMISSION_POLL_INTERVAL = 0.5
+SUBMISSION_STREAM_TIMEOUT = 180
+
+
+def summarize_details(details: List[Dict]) -> Dict:
+    """Итоги работы по деталям полей (ожидающие AI поля считаются неверными)"""
+    total_count = len(details)
+    correct_count = sum(1 for detail in details if detail.get('is_correct'))
+    return {
+        'correct_count': correct_count,
+        'total_count': total_count,
+        'percentage': round((correct_count / total_count) * 100, 2) if total_count else 0,
+        'ai_check_count': sum(1 for detail in details
+                              if detail.get('check_method') == 'ai' and detail.get('is_correct'))
+    }
+
+
+class SubmissionStore:
+    """Состояние работ учеников по submission_id, общее для воркеров"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'AI_SUBMISSIONS_DB', os.path.join(Config.DATA_FOLDER, 'submissions.sqlite3')
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _get_connection(self):
+        conn = get_sqlite_connection(self.path)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS submissions (
+                            submission_id TEXT PRIMARY KEY,
+                            state TEXT NOT NULL,
+                            pending INTEGER NOT NULL DEFAULT 0,
+                            created_at REAL NOT NULL,
+                            updated_at REAL NOT NULL
+                        )
+                    """)
+                    self._schema_ready = True
+        return conn
+
+    def create(self, submission_id: str, state: Dict):
+        """Сохранить новую работу; state['pending'] - индексы полей, ждущих AI"""
+        now = time.time()
+        conn = self._get_connection()
+        conn.execute(
+            "INSERT INTO submissions (submission_id, state, pending, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (submission_id, json.dumps(state, ensure_ascii=False), len(state.get('pending', [])), now, now)
+        )
+        # Старые работы удаляются попутно - отдельный поток обслуживания не нужен
+        conn.execute("DELETE FROM submissions WHERE updated_at < ?", (now - SUBMISSION_TTL,))
+
+    def get(self, submission_id: str) -> Optional[Dict]:
+        row = self._get_connection().execute(
+            "SELECT state FROM submissions WHERE submission_id = ?", (submission_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, submission_id: str, update) -> Optional[Dict]:
+        """
+        Изменить состояние работы в транзакции: update(state) правит словарь на месте.
+        Возвращает новое состояние или None, если работы нет.
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state FROM submissions WHERE submission_id = ?", (submission_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            state = json.loads(row[0])
+            update(state)
+            conn.execute(
+                "UPDATE submissions SET state = ?, pending = ?, updated_at = ? WHERE submission_id = ?",
+                (json.dumps(state, ensure_ascii=False), len(state.get('pending', [])),
+                 time.time(), submission_id)
+            )
+            conn.execute("COMMIT")
+            return state
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete_field(self, submission_id: str, index: int, detail: Dict) -> Optional[Dict]:
+        """Записать вердикт поля и убрать его из ожидающих"""
+        def apply(state):
+            state['details'][index] = detail
+            state['pending'] = [i for i in state.get('pending', []) if i != index]
+        return self.update(submission_id, apply)
+
+    def complete_pending_field(self, submission_id: str, index: int, detail: Dict) -> Optional[Dict]:
+        """
+        Записать вердикт поля, только если оно еще ждет AI.
+        None - работы нет или поле уже проверено (фоновой задачей или очередью).
+        """
+        completed = []
+
+        def apply(state):
+            if index in state.get('pending', []):
+                state['details'][index] = detail
+                state['pending'] = [i for i in state['pending'] if i != index]
+                completed.append(index)
+        state = self.update(submission_id, apply)
+        return state if completed else None
+
+
+# Глобальное хранилище
+submission_store = SubmissionStore()
@@ -28,9 +28,10 @@ def print_result(test_name, result):
 def run_tests():
     """Запуск набора тестов"""
     print("🚀 Начало тестирования AI Checker")
-    print(f"📌 API Key настроен: {'Да' if AIConfig.GEMINI_API_KEY != 'YOUR_API_KEY_HERE' else 'Нет'}")
-    print(f"📌 AI проверка включена: {'Да' if AIConfig.AI_CHECKING_ENABLED else 'Нет'}")
-    print(f"📌 Порог схожести: {AIConfig.SIMILARITY_THRESHOLD * 100}%\n")
+    settings = AIConfig.current()
+    print(f"📌 API Key настроен: {'Да' if settings.GEMINI_API_KEY != 'YOUR_API_KEY_HERE' else 'Нет'}")
+    print(f"📌 AI проверка включена: {'Да' if settings.AI_CHECKING_ENABLED else 'Нет'}")
+    print(f"📌 Порог схожести: {settings.SIMILARITY_THRESHOLD * 100}%\n")
     
     try:
         checker = get_ai_checker()
@@ -0,0 +1,130 @@
+"""
+Тесты кэша AI ответов на локальной базе SQLite (без PostgreSQL и сети)
+
+Запуск: python -m pytest test_ai_cache.py  или  python test_ai_cache.py
+"""
+
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ai_cache import AICacheManager, SQLiteCacheBackend
+from init_cache_db import create_stats_table
+
+ANSWER = ('икусственный', ['искусственный'], 'искусственный', 'gemini-2.5-flash')
+
+
+def make_manager() -> AICacheManager:
+    """Менеджер кэша на отдельной временной базе SQLite"""
+    manager = AICacheManager()
+    backend = SQLiteCacheBackend(os.path.join(tempfile.mkdtemp(), 'ai_cache.sqlite3'))
+    manager.primary_backend = manager.fallback_backend = backend
+    return manager
+
+
+def save(manager, provider, is_correct, confidence, explanation, ttl):
+    student_answer, correct_variants, context, model = ANSWER
+    return manager.save_to_cache(student_answer, correct_variants, context, provider, model,
+                                 is_correct, confidence, explanation, ttl=ttl)
+
+
+def lookup(manager):
+    student_answer, correct_variants, context, model = ANSWER
+    return manager.get_cached_result(student_answer, correct_variants, context, model)
+
+
+def test_expired_fallback_replaced_by_real_verdict():
+    """Истекший fallback не должен возвращаться после сохранения настоящего вердикта"""
+    manager = make_manager()
+    assert save(manager, 'fallback', False, 0.0, 'AI недоступен', ttl=-1)
+    assert lookup(manager) is None
+
+    assert save(manager, 'gemini', True, 0.95, 'опечатка', ttl=3600)
+    result = lookup(manager)
+    assert result == {'is_correct': True, 'confidence': 0.95, 'explanation': 'опечатка', 'ai_provider': 'gemini'}
+
+
+def test_live_fallback_replaced_by_real_verdict():
+    """Перепроверка пишет настоящий вердикт поверх еще действующего fallback"""
+    manager = make_manager()
+    save(manager, 'fallback', False, 0.0, 'AI недоступен', ttl=60)
+    save(manager, 'gemini', True, 0.9, 'верно', ttl=3600)
+    result = lookup(manager)
+    assert result['ai_provider'] == 'gemini' and result['is_correct'] is True
+
+
+def test_stats_follow_replaced_record():
+    """Замена записи не удваивает entries и переносит ее вклад на нового провайдера"""
+    manager = make_manager()
+    save(manager, 'fallback', False, 0.0, 'AI недоступен', ttl=60)
+    save(manager, 'gemini', True, 0.9, 'верно', ttl=3600)
+    manager.flush_stats()
+
+    stats = manager.get_cache_stats()
+    assert stats['total_entries'] == 1
+    assert stats['avg_confidence'] == 0.9
+    assert stats['providers_count'] == 1
+    assert stats['total_usage'] == 2
+    assert stats['bytes_stored'] > 0
+
+    # Полный пересчет по таблице дает те же счетчики
+    manager.backend.rebuild_stats()
+    assert manager.get_cache_stats()['total_entries'] == 1
+
+
+def test_key_ignores_case_and_surrounding_spaces():
+    """Вердикт для "Искусственный " находится по ответу "искусственный" - как в локальной проверке"""
+    manager = make_manager()
+    student_answer, correct_variants, context, model = ANSWER
+    manager.save_to_cache(' ИКУСственный ', correct_variants, context, 'gemini', model,
+                          True, 0.9, 'опечатка', ttl=3600)
+    assert lookup(manager)['is_correct'] is True
+
+
+class RecordingConnection:
+    """Подключение PostgreSQL, записывающее запросы; каталог отвечает заданной схемой"""
+
+    def __init__(self, column_exists, stats_exists):
+        self.schema = (column_exists, stats_exists)
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.statements.append(' '.join(sql.split()))
+
+    def fetchone(self):
+        return self.schema
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_ready_schema_takes_no_locks():
+    """Приложение на готовой базе не выполняет DDL и не берет блокировок"""
+    conn = RecordingConnection(column_exists=True, stats_exists=True)
+    assert create_stats_table(conn)
+    assert len(conn.statements) == 1 and conn.statements[0].startswith('SELECT EXISTS')
+
+
+def test_missing_column_added_under_lock():
+    conn = RecordingConnection(column_exists=False, stats_exists=True)
+    assert create_stats_table(conn)
+    assert any('pg_advisory_xact_lock' in sql for sql in conn.statements)
+    assert any(sql.startswith('ALTER TABLE ai_response_cache ADD COLUMN size_bytes')
+               for sql in conn.statements)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,199 @@
+"""
+Тесты сегментов журнала AI на временной папке: ротация, сжатие блоками,
+постраничное чтение с конца по курсору и сводка по смещениям
+
+Запуск: python -m pytest test_ai_log.py  или  python test_ai_log.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ai_log as ai_log_module
+from ai_log import LogPage, LogSegments
+
+START = datetime(2026, 10, 1, 12, 0, 0)
+
+
+@contextmanager
+def patched(target, **attrs):
+    saved = {name: getattr(target, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def small_segments():
+    """Сжатие без паузы, блоки сжатого сегмента - по нескольку строк"""
+    return patched(ai_log_module, LOG_COMPRESS_DELAY=0, LOG_INDEX_BLOCK_BYTES=600, LOG_READ_BLOCK=256)
+
+
+def timestamp(number):
+    return (START + timedelta(seconds=number)).isoformat()
+
+
+def append(segments, numbers):
+    with open(segments.path, 'a', encoding='utf-8') as f:
+        for number in numbers:
+            f.write(json.dumps({'n': number, 'timestamp': timestamp(number), 'success': True,
+                                'ai_provider': 'groq', 'latency_ms': 120}) + '\n')
+
+
+def rotate(segments):
+    # Имена сегментов - время с микросекундами
+    time.sleep(0.002)
+    return segments.rotate(force=True)
+
+
+def make_log():
+    """
+    Журнал из трех частей: сжатый сегмент из нескольких блоков (0-59),
+    несжатый сегмент (60-89) и текущий файл (90-119)
+    """
+    segments = LogSegments(os.path.join(tempfile.mkdtemp(), 'ai_checks.log'))
+    append(segments, range(60))
+    rotate(segments)
+    segments.maintain()
+    append(segments, range(60, 90))
+    rotate(segments)
+    append(segments, range(90, 120))
+    return segments
+
+
+def read_pages(segments, cursor=None, limit=7, pages=None, **filters):
+    """Номера записей постранично; возвращает (номера, курсор после последней страницы)"""
+    numbers = []
+    while pages is None or pages > 0:
+        page = LogPage(segments, cursor=cursor, limit=limit, **filters)
+        numbers.extend(entry['n'] for entry in page)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+        pages = None if pages is None else pages - 1
+    return numbers, cursor
+
+
+def test_log_is_split_into_live_plain_and_compressed_parts():
+    with small_segments():
+        segments = make_log()
+        compressed = segments.segments()
+        assert len(compressed) == 1 and len(compressed[0]['index']) > 3
+        assert compressed[0]['summary']['total'] == 60
+        assert len(segments._plain_segments()) == 1
+
+
+def test_pages_return_every_entry_once_in_order():
+    with small_segments():
+        segments = make_log()
+        for limit in (1, 7, 30, 1000):
+            numbers, _ = read_pages(segments, limit=limit)
+            assert numbers == list(range(119, -1, -1)), limit
+
+
+def test_cursor_survives_compression_between_pages():
+    """Несжатый сегмент сжали, пока пользователь листал журнал"""
+    with small_segments():
+        segments = make_log()
+        # 30 записей текущего файла и 5 из несжатого сегмента
+        first, cursor = read_pages(segments, limit=5, pages=7)
+        assert first == list(range(119, 84, -1))
+
+        segments.maintain()
+        assert not segments._plain_segments() and len(segments.segments()) == 2
+        rest, _ = read_pages(segments, cursor=cursor, limit=5)
+        assert first + rest == list(range(119, -1, -1))
+
+
+def test_period_filter_reads_only_matching_blocks():
+    with small_segments():
+        segments = make_log()
+        blocks = segments.segments()[0]['index']
+        decompressed = []
+        decompress = ai_log_module.gzip.decompress
+
+        def counting_decompress(data):
+            decompressed.append(data)
+            return decompress(data)
+
+        with patched(ai_log_module.gzip, decompress=counting_decompress):
+            numbers, _ = read_pages(segments, limit=1000, since=timestamp(40), until=timestamp(95))
+        assert numbers == list(range(95, 39, -1))
+        assert 0 < len(decompressed) < len(blocks)
+
+
+def test_cursor_of_dropped_segment_ends_listing():
+    """Файл курсора удален по сроку хранения - страниц больше нет, без повторов"""
+    with small_segments():
+        segments = make_log()
+        _, cursor = read_pages(segments, limit=5, pages=15)
+        assert cursor.rpartition('@')[0] == segments.segments()[0]['key']
+
+        # Старейший сегмент вышел за срок хранения (несжатый сегмент при этом сжимается)
+        manifest = segments.load_manifest()
+        expired = datetime.now() - timedelta(days=ai_log_module.LOG_RETENTION_DAYS + 1)
+        manifest['segments'][0]['rotated_at'] = expired.isoformat()
+        segments._save_manifest(manifest)
+        segments.maintain()
+        assert [item['summary']['total'] for item in segments.segments()] == [30]
+
+        page = LogPage(segments, cursor=cursor, limit=5)
+        assert list(page) == [] and page.next_cursor is None
+        assert read_pages(segments)[0] == list(range(119, 59, -1))
+
+
+def test_summary_reads_only_new_lines():
+    parsed = []
+    parse_line = ai_log_module._parse_line
+
+    def counting_parse(line):
+        parsed.append(line)
+        return parse_line(line)
+
+    with small_segments():
+        segments = make_log()
+        assert segments.summary()['total'] == 120
+
+        with patched(ai_log_module, _parse_line=counting_parse):
+            assert segments.summary()['total'] == 120
+            assert parsed == []
+
+            append(segments, range(120, 125))
+            assert segments.summary()['total'] == 125
+            assert len(parsed) == 5
+
+        # Несжатый сегмент ушел в манифест - не считается дважды и уходит из состояния
+        segments.maintain()
+        assert segments.summary()['total'] == 125
+        with open(segments.stats_path, encoding='utf-8') as f:
+            files = json.load(f)['files']
+        assert len(files) == 1
+        assert list(files.values())[0]['offset'] == os.path.getsize(segments.path)
+
+
+def test_partial_line_is_read_once_completed():
+    with small_segments():
+        segments = LogSegments(os.path.join(tempfile.mkdtemp(), 'ai_checks.log'))
+        append(segments, range(3))
+        line = json.dumps({'n': 3, 'timestamp': timestamp(3), 'success': True}) + '\n'
+        with open(segments.path, 'a', encoding='utf-8') as f:
+            f.write(line[:10])
+        assert segments.summary()['total'] == 3
+        with open(segments.path, 'a', encoding='utf-8') as f:
+            f.write(line[10:])
+        assert segments.summary()['total'] == 4
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
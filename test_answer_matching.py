@@ -0,0 +1,58 @@
+"""
+Тесты локальной проверки ответов (answer_matching.py) без AI и сети
+
+Запуск: python -m pytest test_answer_matching.py  или  python test_answer_matching.py
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from answer_matching import CompiledTemplate
+from morphology import synonyms
+
+synonyms.refresh()
+
+
+def compile_field(field, **template):
+    field = {'id': 'f1', **field}
+    return CompiledTemplate({**template, 'fields': [field]}).field('f1')
+
+
+def test_synonyms_apply_by_default():
+    """Без настройки поле принимает синонимы и отклоняет противоположную группу"""
+    field = compile_field({'variants': ['верно']})
+    assert field.match('правда') == (True, 'synonym')
+    assert field.match('ложь') == (False, 'synonym_reject')
+
+
+def test_field_synonyms_opt_out():
+    """"synonyms": false - синонимы поля решает не словарь, а следующие этапы"""
+    field = compile_field({'variants': ['верно'], 'synonyms': False})
+    assert field.match('правда') is None
+    assert field.match('ложь') is None
+    assert field.match('верно') == (True, 'exact')
+
+
+def test_field_synonym_groups_whitelist():
+    """Список групп оставляет только перечисленные группы"""
+    field = compile_field({'variants': ['верно', 'vr'], 'synonyms': ['vr']})
+    assert field.match('виртуальная реальность') == (True, 'synonym')
+    assert field.match('правда') is None
+
+
+def test_template_default_and_field_override():
+    """Настройка шаблона действует на все поля, поле может ее переопределить"""
+    template = CompiledTemplate({'synonyms': False, 'fields': [
+        {'id': 'f1', 'variants': ['верно']},
+        {'id': 'f2', 'variants': ['верно'], 'synonyms': True},
+    ]})
+    assert template.field('f1').match('правда') is None
+    assert template.field('f2').match('правда') == (True, 'synonym')
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,147 @@
+"""
+Тесты /check_answers: поля, отложенные для AI, не теряются (без сети и Google Sheets)
+
+AI проверка поля подменяется, базы работ, очереди и аналитики - временные.
+Запуск: python -m pytest test_check_answers.py  или  python test_check_answers.py
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DATA_DIR = tempfile.mkdtemp()
+for env_name, file_name in [('AI_REGRADE_DB', 'regrade_queue.sqlite3'),
+                            ('AI_SUBMISSIONS_DB', 'submissions.sqlite3'),
+                            ('GRADING_ANALYTICS_DB', 'grading_analytics.sqlite3'),
+                            ('LEARNED_VARIANTS_DB', 'learned_variants.sqlite3'),
+                            ('AI_CACHE_SQLITE_PATH', 'ai_cache.sqlite3')]:
+    # Другой тестовый модуль мог уже создать глобальные хранилища на своей временной базе
+    os.environ.setdefault(env_name, os.path.join(DATA_DIR, file_name))
+os.environ['AI_CACHE_BACKEND'] = 'sqlite'
+
+import app as app_module
+from ai_config import AIConfig, SettingsSnapshot, settings_store
+from config import Config
+from regrade_queue import PENDING_RECOVERY_DELAY
+
+TEMPLATE = {
+    'name': 'Тест',
+    'fields': [
+        {'id': 'f1', 'variants': ['альфа']},   # AI не успел - проверяется в фоне
+        {'id': 'f2', 'variants': ['гамма']},   # AI недоступен - в очередь перепроверки
+        {'id': 'f3', 'variants': ['омега']},   # проверено локально
+    ]
+}
+ANSWERS = {'f1': 'бета', 'f2': 'дельта', 'f3': 'омега'}
+AI_VERDICT = {'is_correct': True, 'checked_by_ai': True, 'check_method': 'ai',
+              'ai_confidence': 0.9, 'ai_explanation': 'верно по смыслу'}
+
+
+@contextmanager
+def patched(target, **attrs):
+    saved = {name: getattr(target, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def fake_check_field(ai_checker, template_id, question_number, field_id, student_answer,
+                     correct_variants, deadline=None):
+    if deadline is None:
+        # Фоновая проверка или очередь перепроверки - AI ответил
+        return dict(AI_VERDICT)
+    if field_id == 'f1':
+        return {'check_method': 'pending'}
+    return {'is_correct': False, 'checked_by_ai': True, 'check_method': 'ai_deferred',
+            'ai_error': 'квота исчерпана', 'ai_explanation': 'AI недоступен'}
+
+
+def submit():
+    """Отправить работу; фоновые задачи возвращаются, а не запускаются"""
+    templates_dir = tempfile.mkdtemp()
+    with open(os.path.join(templates_dir, 'test.json'), 'w', encoding='utf-8') as f:
+        json.dump(TEMPLATE, f, ensure_ascii=False)
+
+    defaults = {name: value for name, value in vars(AIConfig).items()
+                if name.isupper() and not callable(value)}
+    snapshot = SettingsSnapshot({**defaults, 'ASYNC_AI_GRADING': False, 'SUBMISSION_DEADLINE': 30})
+    tasks = []
+    with patched(Config, TEMPLATES_FOLDER=templates_dir), \
+            patched(settings_store, get=lambda: snapshot), \
+            patched(app_module, check_field_with_ai=fake_check_field,
+                    get_ai_checker=lambda: object(),
+                    submit_grading=lambda fn, *args: tasks.append((fn, args))):
+        response = app_module.app.test_client().post('/check_answers', json={
+            'template_id': 'test', 'answers': ANSWERS, 'student_info': {}
+        })
+    return response.get_json(), tasks, templates_dir
+
+
+def queued(submission_id):
+    """Задачи очереди перепроверки работы: {индекс поля: срок}"""
+    with sqlite3.connect(os.environ['AI_REGRADE_DB']) as conn:
+        rows = conn.execute("SELECT field_index, next_attempt_at - created_at FROM regrade_queue "
+                            "WHERE submission_id = ?", (submission_id,)).fetchall()
+    return {index: delay for index, delay in rows}
+
+
+def test_deferred_field_queued_next_to_pending_field():
+    """Отложенное поле попадает в очередь, даже если другое поле ждет фоновой проверки"""
+    result, tasks, _ = submit()
+    assert result['success'] and result['pending_count'] == 1
+    assert [args[1] for _, args in tasks] == [0]
+
+    items = queued(result['submission_id'])
+    assert set(items) == {0, 1}
+    # Поле фоновой проверки - страховка на случай перезапуска воркера
+    assert items[0] >= PENDING_RECOVERY_DELAY - 1
+
+
+def test_background_grade_replaces_backstop():
+    result, tasks, _ = submit()
+    submission_id = result['submission_id']
+    with patched(app_module, check_field_with_ai=fake_check_field, get_ai_checker=lambda: object()):
+        for fn, args in tasks:
+            fn(*args)
+
+    state = app_module.submission_store.get(submission_id)
+    assert state['pending'] == [] and state['completed']
+    assert state['details'][0]['check_method'] == 'ai'
+    # Остается только задача отложенного поля
+    assert set(queued(submission_id)) == {1}
+
+
+def test_pending_field_recovered_by_queue_after_restart():
+    """Фоновая задача потерялась вместе с воркером - поле проверяет очередь"""
+    result, _, templates_dir = submit()
+    submission_id = result['submission_id']
+
+    with patched(Config, TEMPLATES_FOLDER=templates_dir), \
+            patched(app_module, check_field_with_ai=fake_check_field, get_ai_checker=lambda: object()):
+        error = app_module.regrade_field({'id': 0, 'submission_id': submission_id,
+                                          'field_index': 0, 'attempts': 1})
+        assert error is None
+
+        state = app_module.submission_store.get(submission_id)
+        assert state['pending'] == [] and state['completed']
+        assert state['details'][0]['check_method'] == 'ai'
+
+        # Запоздавшая фоновая задача не перезаписывает вердикт и не завершает работу второй раз
+        with patched(app_module, finish_submission=lambda *args: (_ for _ in ()).throw(AssertionError)):
+            compiled_field = app_module._load_compiled_field('test', 'f1')
+            app_module.grade_pending_field(submission_id, 0, 'f1', compiled_field, 'бета')
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,167 @@
+"""
+Тесты circuit breaker на временной базе SQLite (без AI провайдеров)
+
+Запуск: python -m pytest test_circuit_breaker.py  или  python test_circuit_breaker.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import circuit_breaker as circuit_breaker_module
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+THRESHOLD, WINDOW, COOLDOWN = 3, 60.0, 30.0
+KEY = ('groq', 'llama-3.3-70b-versatile')
+
+
+class FakeClock:
+    """Подмена модуля time в circuit_breaker: время двигается вручную"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@contextmanager
+def patched(target, **attrs):
+    saved = {name: getattr(target, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def make_breaker(path=None) -> CircuitBreaker:
+    """Breaker на временной базе с фиксированными порогами вместо ai_settings.json"""
+    breaker = CircuitBreaker(path or os.path.join(tempfile.mkdtemp(), 'ai_breaker.sqlite3'))
+    breaker._settings = lambda: (THRESHOLD, WINDOW, COOLDOWN)
+    return breaker
+
+
+def state(breaker):
+    items = breaker.status()
+    return (items[0]['state'], items[0]['failures']) if items else (STATE_CLOSED, 0)
+
+
+def open_breaker(breaker):
+    for _ in range(THRESHOLD):
+        breaker.record_failure(*KEY, 'HTTP 503')
+
+
+def test_opens_at_threshold_within_window():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        for _ in range(THRESHOLD - 1):
+            breaker.record_failure(*KEY, 'HTTP 503')
+        assert state(breaker) == (STATE_CLOSED, THRESHOLD - 1)
+        assert breaker.allow_request(*KEY)
+
+        breaker.record_failure(*KEY, 'HTTP 503')
+        assert state(breaker)[0] == STATE_OPEN
+        assert not breaker.allow_request(*KEY)
+
+
+def test_failures_outside_window_do_not_open():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        for _ in range(THRESHOLD - 1):
+            breaker.record_failure(*KEY, 'HTTP 503')
+        clock.now += WINDOW + 1
+        breaker.record_failure(*KEY, 'HTTP 503')
+        assert state(breaker) == (STATE_CLOSED, 1)
+
+
+def test_success_resets_failure_count():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        for _ in range(THRESHOLD - 1):
+            breaker.record_failure(*KEY, 'HTTP 503')
+        breaker.record_success(*KEY)
+        assert state(breaker) == (STATE_CLOSED, 0)
+
+        breaker.record_failure(*KEY, 'HTTP 503')
+        assert state(breaker) == (STATE_CLOSED, 1)
+
+
+def test_single_probe_after_cooldown():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        open_breaker(breaker)
+        clock.now += COOLDOWN - 1
+        assert not breaker.allow_request(*KEY)
+
+        clock.now += 2
+        assert breaker.allow_request(*KEY)
+        assert state(breaker)[0] == STATE_HALF_OPEN
+        assert not breaker.allow_request(*KEY)
+
+        # Пробник завис - через паузу пропускается следующий
+        clock.now += COOLDOWN + 1
+        assert breaker.allow_request(*KEY)
+
+
+def test_concurrent_probe_won_by_one_worker():
+    """Два воркера (соединения) одновременно видят истекшую паузу - пробник один"""
+    path = os.path.join(tempfile.mkdtemp(), 'ai_breaker.sqlite3')
+    open_breaker(make_breaker(path))
+
+    for _ in range(20):
+        make_breaker(path)._get_connection().execute(
+            "UPDATE ai_circuit_breaker SET state = ?, opened_at = 0", (STATE_OPEN,)
+        )
+        start = threading.Barrier(2)
+        allowed = []
+
+        def worker():
+            breaker = make_breaker(path)
+            breaker._get_connection()
+            start.wait()
+            allowed.append(breaker.allow_request(*KEY))
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(allowed) == [False, True]
+
+
+def test_failed_probe_reopens():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        open_breaker(breaker)
+        clock.now += COOLDOWN + 1
+        assert breaker.allow_request(*KEY)
+
+        breaker.record_failure(*KEY, 'HTTP 503')
+        assert state(breaker)[0] == STATE_OPEN
+        assert breaker.status()[0]['retry_in'] == COOLDOWN
+        assert not breaker.allow_request(*KEY)
+
+
+def test_successful_probe_closes():
+    breaker, clock = make_breaker(), FakeClock()
+    with patched(circuit_breaker_module, time=clock):
+        open_breaker(breaker)
+        clock.now += COOLDOWN + 1
+        assert breaker.allow_request(*KEY)
+
+        breaker.record_success(*KEY)
+        assert state(breaker) == (STATE_CLOSED, 0)
+        assert breaker.allow_request(*KEY) and breaker.allow_request(*KEY)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
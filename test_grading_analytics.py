@@ -0,0 +1,66 @@
+"""
+Тесты аналитики проверки (grading_analytics.py) на временной базе SQLite
+
+Запуск: python -m pytest test_grading_analytics.py  или  python test_grading_analytics.py
+"""
+
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from grading_analytics import GradingAnalytics, field_event
+
+AI_CALL = {'from_cache': False, 'latency_ms': 120.0, 'ai_provider': 'gemini', 'ai_model': 'flash'}
+
+
+def make_analytics() -> GradingAnalytics:
+    return GradingAnalytics(os.path.join(tempfile.mkdtemp(), 'grading_analytics.sqlite3'))
+
+
+def event(field_id, stage, method, ai_call=None):
+    verdict = {'check_method': method, 'is_correct': method == 'ai'}
+    if ai_call:
+        verdict['ai_call'] = dict(ai_call)
+    return field_event('tpl', field_id, stage, verdict)
+
+
+def test_record_is_written_in_background():
+    analytics = make_analytics()
+    assert analytics.record([event('f1', 'submit', 'exact'), event('f2', 'submit', 'ai', AI_CALL)])
+    assert analytics.flush()
+    assert analytics.stats()['written'] == 2
+    assert analytics.summary()['checks'] == 2
+
+
+def test_ai_call_rate_counts_each_submitted_field_once():
+    """Поле, ушедшее в фон и в перепроверку, - одна отправка в AI из одной проверки"""
+    analytics = make_analytics()
+    analytics.record([
+        event('f1', 'submit', 'pending', AI_CALL),      # AI не успел в бюджет
+        event('f2', 'submit', 'ai_deferred', AI_CALL),  # AI недоступен
+        event('f3', 'submit', 'exact'),
+    ])
+    analytics.record([event('f1', 'background', 'ai', AI_CALL)])
+    analytics.record([event('f2', 'regrade', 'ai_deferred', AI_CALL)])
+    analytics.record([event('f2', 'regrade', 'ai', AI_CALL)])
+    analytics.flush()
+
+    summary = analytics.summary()
+    assert summary['checks'] == 3
+    assert summary['ai_checks'] == 2 and summary['ai_call_rate'] == 0.667
+    assert summary['local_matches'] == 1
+    assert summary['ai_calls'] == 5
+    assert summary['background_attempts'] == 1 and summary['regrade_attempts'] == 2
+
+    fields = {item['field_id']: item for item in analytics.field_report()}
+    assert fields['f1']['ai_call_rate'] == 1.0 and fields['f1']['background_attempts'] == 1
+    assert fields['f2']['ai_call_rate'] == 1.0 and fields['f2']['regrade_attempts'] == 2
+    assert all(item['ai_call_rate'] <= 1 for item in fields.values())
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
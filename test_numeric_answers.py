@@ -0,0 +1,64 @@
+"""
+Тесты разбора и сравнения числовых ответов (numeric_answers.py)
+
+Запуск: python -m pytest test_numeric_answers.py  или  python test_numeric_answers.py
+"""
+
+import os
+import sys
+from fractions import Fraction
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from answer_matching import CompiledTemplate
+from numeric_answers import numbers_equal, parse_number
+
+
+def value(text):
+    parsed = parse_number(text)
+    return parsed.value if parsed else None
+
+
+def test_decimal_comma_and_dot():
+    assert value('3,50') == value('3.5') == Fraction(7, 2)
+    assert value('0,500') == Fraction(1, 2)
+    assert value('7/2') == Fraction(7, 2)
+
+
+def test_unambiguous_thousands():
+    """Пробелы и смешанные разделители однозначно задают тысячи"""
+    assert value('1 000') == 1000
+    assert value('1 000 000,5') == Fraction(2000001, 2)
+    assert value('1,000.5') == value('1.000,5') == Fraction(2001, 2)
+    assert value('1,000,000') == 1000000
+
+
+def test_single_separator_with_three_digits_is_ambiguous():
+    """"1,000" и "1.000" - тысяча или единица: разбор не угадывает"""
+    assert parse_number('1,000') is None
+    assert parse_number('1.000') is None
+    assert parse_number('12,345 м') is None
+
+
+def test_ambiguous_answer_falls_through_to_ai():
+    """Неоднозначный ответ не засчитывается и не отклоняется локально"""
+    thousand = CompiledTemplate({'fields': [{'id': 'f1', 'variants': ['1000']}]}).field('f1')
+    assert thousand.match('1,000') is None
+    assert thousand.match('1.000') is None
+    assert thousand.match('1 000') == (True, 'numeric')
+
+    one = CompiledTemplate({'fields': [{'id': 'f1', 'variants': ['1']}]}).field('f1')
+    assert one.match('1,000') is None
+    assert one.match('1.000') is None
+
+
+def test_units_and_tolerance():
+    assert numbers_equal(parse_number('5 см'), parse_number('5'))
+    assert numbers_equal(parse_number('5 м'), parse_number('500 см')) is None
+    assert numbers_equal(parse_number('3,14'), parse_number('3.1416'), (Fraction(1, 100), Fraction(0)))
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
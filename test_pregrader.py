@@ -0,0 +1,64 @@
+"""
+Тесты генерации вероятных ответов предварительной проверки (pregrader.py)
+
+Запуск: python -m pytest test_pregrader.py  или  python test_pregrader.py
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from answer_matching import CompiledTemplate
+from morphology import synonyms
+from pregrader import PREGRADE_MAX_MATCH_ATTEMPTS, predict_answers, typos_solved_locally
+
+synonyms.refresh()
+
+LONG_VARIANTS = [
+    'электромагнитное поле', 'виртуальная реальность', 'искусственный интеллект',
+    'дополненная реальность', 'кристаллическая решетка', 'круговорот воды в природе',
+    'закон всемирного тяготения', 'периодическая система', 'органическая химия',
+    'электрическое сопротивление', 'тепловое равновесие', 'фотосинтез хлорофилл',
+]
+
+
+def compile_field(variants):
+    return CompiledTemplate({'fields': [{'id': 'f1', 'variants': variants}]}).field('f1')
+
+
+def counting(field):
+    """Поле, считающее вызовы match()"""
+    calls = []
+    match = field.match
+    field.match = lambda answer: calls.append(answer) or match(answer)
+    return calls
+
+
+def test_long_variant_typos_are_not_generated():
+    """Опечатки длинного варианта засчитываются локально - они не кандидаты"""
+    assert typos_solved_locally('электромагнитное поле', 1)
+    assert not typos_solved_locally('кот', 1)
+    assert not typos_solved_locally('электромагнитное поле', 2)
+
+
+def test_match_attempts_are_capped():
+    field = compile_field(LONG_VARIANTS)
+    calls = counting(field)
+    answers = predict_answers(field, 10 ** 6)
+    assert len(calls) <= PREGRADE_MAX_MATCH_ATTEMPTS
+    assert answers
+
+
+def test_predicted_answers_reach_ai():
+    """Кандидаты не решаются локальными этапами"""
+    field = compile_field(['собака', 'кот'])
+    answers = predict_answers(field, 30)
+    assert answers
+    assert all(field.match(answer) is None for answer in answers)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
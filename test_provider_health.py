@@ -0,0 +1,140 @@
+"""
+Тесты здоровья провайдеров и порядка цепочки (без сети)
+
+Запуск: python -m pytest test_provider_health.py  или  python test_provider_health.py
+"""
+
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ai_checker
+from ai_checker import AICheckResult, AIAnswerChecker, _hedge_executor
+from deadline import Deadline
+from provider_health import HEALTH_HALF_LIFE, HEALTH_MIN_SAMPLES, ProviderHealth
+
+TIMEOUT = 10.0
+
+
+def age(health: ProviderHealth, provider: str, model: str, seconds: float):
+    """Сдвинуть последнее наблюдение в прошлое"""
+    health._success[(provider, model)][2] -= seconds
+
+
+def ordered(health: ProviderHealth):
+    """Порядок цепочки primary -> backup при заданной статистике"""
+    primary = AIAnswerChecker('groq', api_key='test', model='health-test-primary')
+    backup = AIAnswerChecker('cohere', api_key='test', model='health-test-backup')
+    chained = primary.with_chain([backup], [])
+    saved, ai_checker.provider_health = ai_checker.provider_health, health
+    try:
+        return [checker.provider for checker in chained._ordered_chain(None)]
+    finally:
+        ai_checker.provider_health = saved
+
+
+def test_single_failure_or_slow_call_keeps_primary_first():
+    """Одна ошибка или медленный ответ не меняют настроенный порядок"""
+    health = ProviderHealth()
+    health.record('groq', 'health-test-primary', False, 1.0)
+    assert not health.is_degraded('groq', 'health-test-primary', TIMEOUT)
+    assert ordered(health) == ['groq', 'cohere']
+
+    health = ProviderHealth()
+    for _ in range(20):
+        health.record('groq', 'health-test-primary', True, TIMEOUT)
+    assert not health.is_degraded('groq', 'health-test-primary', TIMEOUT)
+    assert ordered(health) == ['groq', 'cohere']
+
+
+def test_repeated_failures_demote_primary():
+    health = ProviderHealth()
+    for _ in range(int(HEALTH_MIN_SAMPLES) + 3):
+        health.record('groq', 'health-test-primary', False, 1.0)
+    assert health.is_degraded('groq', 'health-test-primary', TIMEOUT)
+    assert ordered(health) == ['cohere', 'groq']
+
+
+def test_demoted_provider_recovers_after_pause():
+    """Старые ошибки забываются, и провайдер возвращается на первое место"""
+    health = ProviderHealth()
+    for _ in range(int(HEALTH_MIN_SAMPLES) + 3):
+        health.record('groq', 'health-test-primary', False, 1.0)
+    age(health, 'groq', 'health-test-primary', HEALTH_HALF_LIFE * 4)
+    assert not health.is_degraded('groq', 'health-test-primary', TIMEOUT)
+    assert ordered(health) == ['groq', 'cohere']
+
+    # Ошибки после восстановления снова понижают его, но не сразу
+    health.record('groq', 'health-test-primary', False, 1.0)
+    assert ordered(health) == ['groq', 'cohere']
+
+
+class FakeProvider:
+    def __init__(self, provider, delay, success=True):
+        self.provider, self.delay, self.success = provider, delay, success
+        self.calls = 0
+
+
+def fake_call(checker):
+    checker.calls += 1
+    time.sleep(checker.delay)
+    return AICheckResult(is_correct=True, confidence=0.9, explanation='',
+                         ai_provider=checker.provider if checker.success else 'fallback'), True
+
+
+def hedged(primary, secondary, hedge_after=0.05, deadline=None, timeout=5.0):
+    started = time.monotonic()
+    result, _ = AIAnswerChecker._check_hedged(primary, secondary, hedge_after, fake_call, deadline, timeout)
+    return result.ai_provider, time.monotonic() - started
+
+
+def test_fast_primary_does_not_hedge():
+    primary, secondary = FakeProvider('groq', 0.0), FakeProvider('cohere', 0.0)
+    assert hedged(primary, secondary)[0] == 'groq'
+    time.sleep(0.1)
+    assert secondary.calls == 0
+
+
+def test_hedge_answers_when_slow_primary_fails():
+    primary, secondary = FakeProvider('groq', 0.3, success=False), FakeProvider('cohere', 0.0)
+    provider, elapsed = hedged(primary, secondary)
+    assert provider == 'cohere' and secondary.calls == 1
+    assert elapsed < 0.5  # запасной запущен заранее, а не после ошибки основного
+
+
+def test_busy_pool_does_not_delay_or_hedge_primary():
+    """Занятый пул hedging не добавляет основному задержку и не запускает платный запасной"""
+    release = threading.Event()
+    blockers = [_hedge_executor.submit(release.wait, 5) for _ in range(16)]
+    try:
+        primary, secondary = FakeProvider('groq', 0.0), FakeProvider('cohere', 0.0)
+        provider, elapsed = hedged(primary, secondary, hedge_after=0.2)
+        assert provider == 'groq' and elapsed < 0.1
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.result()
+    assert secondary.calls == 0
+
+
+def test_hedge_wait_is_bounded_by_deadline():
+    """Запасной застрял в очереди пула - ответ ученику не ждет дольше бюджета"""
+    release = threading.Event()
+    blockers = [_hedge_executor.submit(release.wait, 5) for _ in range(16)]
+    try:
+        primary, secondary = FakeProvider('groq', 0.1, success=False), FakeProvider('cohere', 0.0)
+        provider, elapsed = hedged(primary, secondary, hedge_after=0.02, deadline=Deadline(0.3))
+        assert provider == 'fallback' and elapsed < 0.6
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.result()
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
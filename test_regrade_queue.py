@@ -0,0 +1,164 @@
+"""
+Тесты очереди перепроверки на временной базе SQLite (без AI и Google Sheets)
+
+Запуск: python -m pytest test_regrade_queue.py  или  python test_regrade_queue.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Глобальная очередь модуля - тоже на временной базе, а не в папке данных
+os.environ.setdefault('AI_REGRADE_DB', os.path.join(tempfile.mkdtemp(), 'regrade_queue.sqlite3'))
+
+import regrade_queue as regrade_queue_module
+from regrade_queue import (CLAIM_LEASE, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                           RegradeQueue, RegradeWorker)
+
+# Лимит скорости не мешает забирать задачи подряд
+UNLIMITED = 10 ** 6
+
+
+class FakeClock:
+    """Подмена модуля time в regrade_queue: время двигается вручную"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@contextmanager
+def patched(target, **attrs):
+    saved = {name: getattr(target, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+
+
+def make_queue() -> RegradeQueue:
+    return RegradeQueue(os.path.join(tempfile.mkdtemp(), 'regrade_queue.sqlite3'))
+
+
+def next_attempt_at(queue, item_id):
+    row = queue._get_connection().execute(
+        "SELECT next_attempt_at FROM regrade_queue WHERE id = ?", (item_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def test_expired_lease_is_reclaimed():
+    """Воркер упал с задачей - после CLAIM_LEASE ее забирает другой"""
+    queue, clock = make_queue(), FakeClock()
+    with patched(regrade_queue_module, time=clock):
+        queue.enqueue('s1', 0, delay=0)
+        item = queue.claim(UNLIMITED)
+        assert item['attempts'] == 1
+
+        clock.now += CLAIM_LEASE - 1
+        assert queue.claim(UNLIMITED) is None
+
+        clock.now += 2
+        again = queue.claim(UNLIMITED)
+        assert again['id'] == item['id'] and again['attempts'] == 2
+
+
+def test_retry_backoff_grows_to_limit():
+    queue, clock = make_queue(), FakeClock()
+    with patched(regrade_queue_module, time=clock):
+        queue.enqueue('s1', 0, delay=0)
+        item = queue.claim(UNLIMITED)
+        delays = []
+        for attempts in range(1, 10):
+            queue.retry(item['id'], attempts, 'квота исчерпана')
+            delays.append(next_attempt_at(queue, item['id']) - clock.now)
+
+    assert delays[:4] == [RETRY_BASE_DELAY, RETRY_BASE_DELAY * 2,
+                          RETRY_BASE_DELAY * 4, RETRY_BASE_DELAY * 8]
+    assert delays == sorted(delays) and delays[-1] == RETRY_MAX_DELAY
+
+
+def test_rate_limit_shared_between_claims():
+    queue, clock = make_queue(), FakeClock()
+    with patched(regrade_queue_module, time=clock):
+        queue.enqueue('s1', 0, delay=0)
+        queue.enqueue('s1', 1, delay=0)
+        assert queue.claim(rate_per_minute=1) is not None
+        assert queue.claim(rate_per_minute=1) is None
+        clock.now += 60
+        assert queue.claim(rate_per_minute=1) is not None
+
+
+def test_cancel_during_claim_is_not_undone():
+    """Фоновая проверка сняла задачу, пока ее проверял воркер очереди"""
+    queue = make_queue()
+    queue.enqueue('s1', 0, delay=0)
+    item = queue.claim(UNLIMITED)
+
+    def regrade(claimed):
+        queue.cancel(claimed['submission_id'], claimed['field_index'])
+        return 'AI недоступен'
+
+    RegradeWorker(queue, regrade, give_up=lambda *args: None).process(item)
+    assert next_attempt_at(queue, item['id']) is None
+    assert queue.stats()['pending'] == 0
+
+
+def test_requeued_field_survives_stale_complete():
+    """Поле сняли и поставили заново - завершение старой задачи новую не удаляет"""
+    queue = make_queue()
+    queue.enqueue('s1', 0, delay=0)
+    item = queue.claim(UNLIMITED)
+
+    def regrade(claimed):
+        queue.cancel(claimed['submission_id'], claimed['field_index'])
+        queue.enqueue(claimed['submission_id'], claimed['field_index'], delay=0)
+        return None
+
+    RegradeWorker(queue, regrade, give_up=lambda *args: None).process(item)
+    assert queue.stats()['pending'] == 1
+    assert queue.claim(UNLIMITED)['attempts'] == 1
+
+
+def test_concurrent_claims_take_row_once():
+    """Два соединения (потока) одновременно забирают единственную задачу"""
+    path = os.path.join(tempfile.mkdtemp(), 'regrade_queue.sqlite3')
+    RegradeQueue(path).enqueue('s1', 0, delay=0)
+
+    for _ in range(20):
+        start = threading.Barrier(2)
+        claimed = []
+
+        def worker():
+            queue = RegradeQueue(path)
+            queue._get_connection()
+            start.wait()
+            claimed.append(queue.claim(UNLIMITED))
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        items = [item for item in claimed if item is not None]
+        assert len(items) == 1
+        # Вернуть задачу для следующего раунда
+        RegradeQueue(path)._get_connection().execute(
+            "UPDATE regrade_queue SET next_attempt_at = 0 WHERE id = ?", (items[0]['id'],)
+        )
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
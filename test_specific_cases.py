@@ -18,14 +18,14 @@ def test_problematic_cases():
     print("=" * 70)
     
     # Загружаем конфигурацию
-    AIConfig.load_from_file()
+    settings = AIConfig.current()
     
     # Создаем checker
     try:
-        checker = AIAnswerChecker(provider="gemini", api_key=AIConfig.GEMINI_API_KEY)
+        checker = AIAnswerChecker(provider="gemini", api_key=settings.GEMINI_API_KEY)
         print(f"✅ AI Checker инициализирован")
-        print(f"   API Key: {'***' + AIConfig.GEMINI_API_KEY[-4:] if AIConfig.GEMINI_API_KEY else 'НЕТ'}")
-        print(f"   Модель: {AIConfig.GEMINI_MODEL}")
+        print(f"   API Key: {'***' + settings.GEMINI_API_KEY[-4:] if settings.GEMINI_API_KEY else 'НЕТ'}")
+        print(f"   Модель: {settings.GEMINI_MODEL}")
     except Exception as e:
         print(f"❌ Ошибка инициализации: {e}")
         return
@@ -74,8 +74,8 @@ def test_problematic_cases():
                 student_answer=test['student_answer'],
                 correct_variants=test['correct_variants'],
                 question_context=test['context'],
-                system_prompt=AIConfig.SYSTEM_PROMPT,
-                model_name=AIConfig.GEMINI_MODEL
+                system_prompt=settings.SYSTEM_PROMPT,
+                model_name=settings.GEMINI_MODEL
             )
             
             result_dict = asdict(result)
@@ -118,10 +118,10 @@ def test_raw_api_call():
     
     import requests
     
-    AIConfig.load_from_file()
+    settings = AIConfig.current()
     
-    model = AIConfig.GEMINI_MODEL
-    api_key = AIConfig.GEMINI_API_KEY
+    model = settings.GEMINI_MODEL
+    api_key = settings.GEMINI_API_KEY
     
     url = f"https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={api_key}"
     